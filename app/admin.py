@@ -1,4 +1,39 @@
 from django.contrib import admin
-from .models import Schedule
+from .models import Calendar, CalendarPreference, DailyScheduleStats, RecurrenceException, RecurringSchedule, Schedule
 
-admin.site.register(Schedule)
+
+class CalendarAdmin(admin.ModelAdmin):
+    list_display = ('name', 'owner', 'created_at')
+
+
+class ScheduleAdmin(admin.ModelAdmin):
+    list_display = ('summary', 'calendar', 'date', 'start_time', 'end_time')
+    list_filter = ('calendar',)
+    readonly_fields = ('version',)
+
+
+class RecurrenceExceptionInline(admin.TabularInline):
+    model = RecurrenceException
+    extra = 1
+
+
+class RecurringScheduleAdmin(admin.ModelAdmin):
+    list_display = ('summary', 'calendar', 'frequency', 'interval', 'start_date', 'end_date')
+    list_filter = ('calendar',)
+    inlines = [RecurrenceExceptionInline]
+
+
+class DailyScheduleStatsAdmin(admin.ModelAdmin):
+    list_display = ('date', 'calendar', 'count')
+    list_filter = ('calendar',)
+
+
+class CalendarPreferenceAdmin(admin.ModelAdmin):
+    list_display = ('user', 'language', 'first_weekday', 'time_zone')
+
+
+admin.site.register(Calendar, CalendarAdmin)
+admin.site.register(Schedule, ScheduleAdmin)
+admin.site.register(RecurringSchedule, RecurringScheduleAdmin)
+admin.site.register(DailyScheduleStats, DailyScheduleStatsAdmin)
+admin.site.register(CalendarPreference, CalendarPreferenceAdmin)
@@ -0,0 +1,40 @@
+"""ASGIで動かす場合のURLconf
+
+カレンダーのページを非同期版のビューにし、それ以外はapp.urlsと同じにします。
+URLの名前も同じなので、テンプレートのリンクはそのまま非同期版のページを指します。
+project/urls.pyで、app.urlsの代わりにincludeしてください。
+
+"""
+from django.urls import path
+from . import urls, views
+
+app_name = urls.app_name
+
+urlpatterns = [
+    path('', views.AsyncMonthCalendar.as_view(), name='month'),
+    path('month/<int:year>/<int:month>/', views.AsyncMonthCalendar.as_view(), name='month'),
+    path('week/', views.AsyncWeekCalendar.as_view(), name='week'),
+    path('week/<int:year>/<int:month>/<int:day>/', views.AsyncWeekCalendar.as_view(), name='week'),
+    path('week_with_schedule/', views.AsyncWeekWithScheduleCalendar.as_view(), name='week_with_schedule'),
+    path(
+        'week_with_schedule/<int:year>/<int:month>/<int:day>/',
+        views.AsyncWeekWithScheduleCalendar.as_view(),
+        name='week_with_schedule'
+    ),
+    path(
+        'month_with_schedule/',
+        views.AsyncMonthWithScheduleCalendar.as_view(), name='month_with_schedule'
+    ),
+    path(
+        'month_with_schedule/<int:year>/<int:month>/',
+        views.AsyncMonthWithScheduleCalendar.as_view(), name='month_with_schedule'
+    ),
+    path('mycalendar/', views.AsyncMyCalendar.as_view(), name='mycalendar'),
+    path(
+        'mycalendar/<int:year>/<int:month>/<int:day>/', views.AsyncMyCalendar.as_view(), name='mycalendar'
+    ),
+]
+
+# 非同期版の無いページは、同期版のビューをそのまま使います
+async_names = {pattern.name for pattern in urlpatterns}
+urlpatterns += [pattern for pattern in urls.urlpatterns if pattern.name not in async_names]
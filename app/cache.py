@@ -0,0 +1,189 @@
+"""スケジュールを、Djangoのキャッシュフレームワークに保存するモジュール
+
+スケジュールは、(年, 月)の月単位、または(ISO週)の週単位の「バケツ」毎にキャッシュします。
+カレンダーに表示する範囲は、これらのバケツを組み合わせて作ります。
+
+それぞれのバケツにはバージョンがあり、キャッシュのキーにはバージョンが含まれます。
+スケジュールが保存・削除されたら、その日を含むバケツのバージョンを消すだけで、
+古いキャッシュは二度と読まれなくなります(古いデータは、タイムアウトで自然に消えます)。
+
+バージョンは、カレンダー毎の「区画(partition)」に分けることもできます。
+あるカレンダーのスケジュールが変わっても、他のカレンダーのキャッシュはそのまま使えます。
+
+"""
+import datetime
+import hashlib
+import uuid
+from django.conf import settings
+from django.core.cache import caches
+
+MONTH = 'month'
+WEEK = 'week'
+
+
+def get_cache():
+    """使うキャッシュを返す。settings.CALENDAR_CACHE_ALIASで変更できます"""
+    return caches[getattr(settings, 'CALENDAR_CACHE_ALIAS', 'default')]
+
+
+def get_bucket(kind, date):
+    """dateが入るバケツを返す。月なら(年, 月)、週ならその週の月曜日です"""
+    if kind == MONTH:
+        return date.year, date.month
+    return date - datetime.timedelta(days=date.weekday())
+
+
+def get_bucket_range(kind, bucket):
+    """バケツの最初の日と、最後の日を返す"""
+    if kind == MONTH:
+        year, month = bucket
+        first = datetime.date(year, month, 1)
+        if month == 12:
+            return first, datetime.date(year, 12, 31)
+        return first, datetime.date(year, month + 1, 1) - datetime.timedelta(days=1)
+    return bucket, bucket + datetime.timedelta(days=6)
+
+
+def get_buckets(kind, start, end):
+    """start〜endを含む、全てのバケツを順番に返す"""
+    buckets = []
+    date = start
+    while date <= end:
+        bucket = get_bucket(kind, date)
+        buckets.append(bucket)
+        date = get_bucket_range(kind, bucket)[1] + datetime.timedelta(days=1)
+    return buckets
+
+
+def get_calendar_partition(calendar_id):
+    """カレンダーの区画の名前を返す"""
+    return 'cal{}'.format(calendar_id)
+
+
+def _make_key(model, kind, bucket, *parts):
+    if kind == MONTH:
+        bucket = '{}-{:02d}'.format(*bucket)
+    else:
+        bucket = bucket.isoformat()
+    return ':'.join(['calendar', model._meta.label_lower, kind, bucket] + [str(part) for part in parts])
+
+
+def _make_version_key(model, kind, bucket, partition):
+    if partition:
+        return _make_key(model, kind, bucket, 'version', partition)
+    return _make_key(model, kind, bucket, 'version')
+
+
+def get_versions(model, kind, buckets, partitions=('',)):
+    """{バケツ: バージョン} の辞書を返す。バージョンがまだ無いバケツには、新しく作ります
+
+    複数の区画を渡すと、それぞれの区画のバージョンをつなげたものが、そのバケツのバージョンになります。
+
+    """
+    cache = get_cache()
+    version_keys = {
+        bucket: [_make_version_key(model, kind, bucket, partition) for partition in partitions]
+        for bucket in buckets
+    }
+    found = cache.get_many([key for keys in version_keys.values() for key in keys])
+    missing = {
+        key: uuid.uuid4().hex for keys in version_keys.values() for key in keys if key not in found
+    }
+    if missing:
+        # データを取得する前にバージョンを保存しておきます。
+        # 取得中にスケジュールが更新されれば、このバージョンが消され、取得したデータは使われなくなります
+        cache.set_many(missing, None)
+        found.update(missing)
+    return {bucket: '.'.join(found[key] for key in version_keys[bucket]) for bucket in buckets}
+
+
+def get_rows(model, kind, start, end, fetch, get_date, timeout=None, scope='', get_end_date=None, partitions=('',)):
+    """start〜endの行を、バケツ単位のキャッシュを使って返す
+
+    fetch(first, last)は、キャッシュに無かった場合に呼ばれ、その期間の行を日付順に返す関数です。
+    キャッシュに無いバケツがあれば、全てのバケツの範囲をまとめて1回で取得し、バケツ毎に保存します。
+    scopeは、同じ期間でも取得する行が違う場合(絞り込みの条件など)に、キーを分けるために使います。
+    get_end_dateを渡すと、複数日の行になり、その行と重なる全てのバケツに保存されます。
+    partitionsには、行が属する区画(カレンダー)を全て渡してください。
+
+    """
+    cache = get_cache()
+    buckets = get_buckets(kind, start, end)
+    versions = get_versions(model, kind, buckets, partitions)
+    data_keys = {bucket: _make_key(model, kind, bucket, versions[bucket], scope) for bucket in buckets}
+    found = cache.get_many(data_keys.values())
+
+    if len(found) < len(buckets):
+        bucket_rows = {bucket: [] for bucket in buckets}
+        first = get_bucket_range(kind, buckets[0])[0]
+        last = get_bucket_range(kind, buckets[-1])[1]
+        for row in fetch(first, last):
+            if get_end_date is None:
+                bucket_rows[get_bucket(kind, get_date(row))].append(row)
+                continue
+            for bucket in get_buckets(kind, max(get_date(row), first), min(get_end_date(row), last)):
+                bucket_rows[bucket].append(row)
+        found = {data_keys[bucket]: rows for bucket, rows in bucket_rows.items()}
+        cache.set_many(found, timeout)
+
+    if get_end_date is None:
+        rows = []
+        for bucket in buckets:
+            rows.extend(row for row in found[data_keys[bucket]] if start <= get_date(row) <= end)
+        return rows
+
+    # 複数のバケツに入っている行は、期間の中で最初に現れるバケツからだけ取り出します
+    rows = []
+    for bucket in buckets:
+        bucket_first = max(get_bucket_range(kind, bucket)[0], start)
+        rows.extend(
+            row for row in found[data_keys[bucket]]
+            if get_date(row) <= end and get_end_date(row) >= start and max(get_date(row), start) >= bucket_first
+        )
+    return rows
+
+
+def get_fragment_key(model, kind, start, end, *parts, partitions=('',)):
+    """start〜endを描画したHTMLの、キャッシュのキーを返す
+
+    start〜endを含むバケツのバージョンがキーに含まれるので、どれかのバケツが消されれば別のキーになります。
+
+    """
+    buckets = get_buckets(kind, start, end)
+    versions = get_versions(model, kind, buckets, partitions)
+    source = repr((start, end, [versions[bucket] for bucket in buckets]) + parts)
+    return _make_key(model, kind, get_bucket(kind, start), 'fragment', hashlib.md5(source.encode()).hexdigest())
+
+
+def get_model_version(model):
+    """modelの全ての行に対する、バージョンを返す"""
+    cache = get_cache()
+    key = 'calendar:{}:version'.format(model._meta.label_lower)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(key, version, None)
+    return version
+
+
+def evict_model(model):
+    """modelの全ての行に対する、バージョンを消す"""
+    get_cache().delete('calendar:{}:version'.format(model._meta.label_lower))
+
+
+def evict_dates(model, dates, partitions=('',)):
+    """それぞれの日を含む、全てのバケツのバージョンを消す"""
+    evict_spans(model, [(date, date) for date in dates], partitions)
+
+
+def evict_spans(model, spans, partitions=('',)):
+    """それぞれの(最初の日, 最後の日)と重なる、全てのバケツのバージョンを、それぞれの区画で消す"""
+    keys = set()
+    for start, end in spans:
+        if start is None:
+            continue
+        for kind in (MONTH, WEEK):
+            for bucket in get_buckets(kind, start, end or start):
+                keys.update(_make_version_key(model, kind, bucket, partition) for partition in partitions)
+    if keys:
+        get_cache().delete_many(keys)
@@ -1,13 +1,22 @@
+import datetime
 from django import forms
-from .models import Schedule
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.safestring import mark_safe
+from .models import Schedule, get_max_schedule_days
 
 
 class BS4ScheduleForm(forms.ModelForm):
-    """Bootstrapに対応するためのModelForm"""
+    """Bootstrapに対応するためのModelForm
+
+    dateを渡すと、その日に始まるスケジュールとして扱い、時間の重なるスケジュール(ダブルブッキング)があればエラーにします。
+    calendar_idも渡すと、そのカレンダーの中だけで重なりを調べます。
+
+    """
 
     class Meta:
         model = Schedule
-        fields = ('summary', 'description', 'start_time', 'end_time')
+        fields = ('summary', 'description', 'start_time', 'end_date', 'end_time')
         widgets = {
             'summary': forms.TextInput(attrs={
                 'class': 'form-control',
@@ -21,27 +30,135 @@ class BS4ScheduleForm(forms.ModelForm):
             'end_time': forms.TextInput(attrs={
                 'class': 'form-control',
             }),
+            'end_date': forms.DateInput(attrs={
+                'class': 'form-control',
+                'type': 'date',
+            }),
         }
 
+    def __init__(self, *args, date=None, calendar_id=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.date = date
+        self.calendar_id = calendar_id
+        if date is not None:
+            self.instance.date = date
+
     def clean_end_time(self):
         start_time = self.cleaned_data['start_time']
         end_time = self.cleaned_data['end_time']
-        if end_time <= start_time:
+        end_date = self.cleaned_data.get('end_date')
+        if end_time <= start_time and (end_date is None or self.date is None or end_date <= self.date):
+            # 翌日以降に終わるスケジュールなら、終了時間が開始時間より前でも構いません
             raise forms.ValidationError(
                 '終了時間は、開始時間よりも後にしてください'
             )
         return end_time
 
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.date is None or self.errors:
+            return cleaned_data
+        start = datetime.datetime.combine(self.date, cleaned_data['start_time'])
+        end = datetime.datetime.combine(cleaned_data.get('end_date') or self.date, cleaned_data['end_time'])
+        conflict = self.get_conflict(start, end)
+        if conflict is not None:
+            raise forms.ValidationError(
+                '「%(summary)s」(%(start)s〜%(end)s)と時間が重なっています',
+                params={
+                    'summary': conflict.summary,
+                    'start': conflict.start_datetime.strftime('%m/%d %H:%M'),
+                    'end': conflict.end_datetime.strftime('%m/%d %H:%M'),
+                },
+            )
+        return cleaned_data
+
+    def get_conflict(self, start, end):
+        """start〜end(日時)と時間が重なるスケジュールを1つ返す。無ければNone
+
+        他のスケジュールの開始日時 < end AND 終了日時 > start を、1回のクエリ(LIMIT 1)で調べます。
+        区間は終了を含まないので、10時〜11時と11時〜12時は重なりません。
+
+        """
+        schedules = Schedule.objects.filter(
+            # 日付の範囲で、(date, start_time)のインデックスを使います
+            Q(date__lt=end.date()) | Q(date=end.date(), start_time__lt=end.time()),
+            Q(end_date__gt=start.date()) | Q(end_date=start.date(), end_time__gt=start.time()),
+            date__range=(start.date() - datetime.timedelta(days=get_max_schedule_days() - 1), end.date()),
+        ).exclude(pk=self.instance.pk)
+        if self.calendar_id is not None:
+            schedules = schedules.filter(calendar_id=self.calendar_id)
+        return schedules.only('summary', 'date', 'end_date', 'start_time', 'end_time').order_by('date', 'start_time').first()
+
+
+class VersionField(forms.IntegerField):
+    """読み込んだ時のバージョンを送り返す、隠しフィールド
+
+    他の人の変更でバージョンが変わっていても、このフォームが変更されたことにはしません。
+    変更していないフォームまで保存しようとして、衝突扱いになるのを防ぎます。
+
+    """
+    widget = forms.HiddenInput
+
+    def has_changed(self, initial, data):
+        return False
+
 
 class SimpleScheduleForm(forms.ModelForm):
-    """シンプルなスケジュール登録用フォーム"""
+    """シンプルなスケジュール登録用フォーム
+
+    versionは、保存時に他の人の変更を上書きしないよう、読み込んだ時のバージョンを送るための隠しフィールドです。
+
+    """
 
     class Meta:
         model = Schedule
-        fields = ('summary', 'date',)
+        fields = ('summary', 'date', 'version')
+        field_classes = {
+            'version': VersionField,
+        }
         widgets = {
             'summary': forms.TextInput(attrs={
                 'class': 'form-control',
             }),
             'date': forms.HiddenInput,
+            'version': forms.HiddenInput,
         }
+
+
+class LazyExtraModelFormSet(forms.BaseModelFormSet):
+    """追加用のフォームを、必要になるまで作らないモデルフォームセット
+
+    バインドされていない(GETの)場合は、既存のインスタンス用のフォームだけを作ります。
+    追加用のフォームは、管理フォームのTOTAL_FORMSに数えられるだけで、インスタンスは作られません。
+    その代わりに、empty_formを使ってHTMLを作ってください(LazyDayForm)。
+    バインドされた(POSTの)場合は、送信されたTOTAL_FORMSの数だけ、普段通りに作られます。
+
+    """
+
+    @cached_property
+    def forms(self):
+        if self.is_bound:
+            return super().forms
+        return [self._construct_form(i, **self.get_form_kwargs(i)) for i in range(self.initial_form_count())]
+
+
+class LazyDayForm:
+    """empty_formを1回だけ描画したHTMLから作る、1日分の新規作成用フォーム
+
+    テンプレートでは、普通のフォームと同じように{{ form.as_p }}で表示できます。
+
+    """
+    __slots__ = ('html',)
+    prefix_placeholder = '__prefix__'
+    value_placeholder = '__value__'
+
+    def __init__(self, prototype_html, index, value):
+        self.html = mark_safe(
+            prototype_html.replace(self.prefix_placeholder, str(index)).replace(self.value_placeholder, str(value))
+        )
+
+    def as_p(self):
+        return self.html
+
+    def __str__(self):
+        return self.html
@@ -0,0 +1,137 @@
+"""カレンダーの日付グリッドを計算・キャッシュするモジュール
+
+月間カレンダーのグリッドや曜日名は、(年, 月, 最初の曜日)だけで決まります。
+リクエスト毎に計算し直すのは無駄なので、ここで一度だけ計算し、LRUキャッシュで共有します。
+共有されるため、返す値は全てタプルや読み取り専用の辞書など、変更できないものにしています。
+
+"""
+import calendar
+import datetime
+import functools
+from types import MappingProxyType
+from django.utils import translation
+from django.utils.dates import WEEKDAYS_ABBR
+
+GRID_CACHE_SIZE = 512  # 最初の曜日が1パターンなら、約40年分の月を保持できるくらい
+
+
+class DaySchedules(list):
+    """1日分の行のリスト
+
+    moreには、表示しきれなかった行の数が入ります(表示する数を制限した場合)。
+
+    """
+    __slots__ = ('more',)
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.more = 0
+
+
+class MonthGrid:
+    """1ヶ月分のカレンダーグリッド
+
+    weeks: ((日付, 日付...), (日付, ...)...) という、週毎の日付のタプル
+    positions: {日付: (週のインデックス, 曜日のインデックス)} という、読み取り専用の辞書
+
+    """
+    __slots__ = ('weeks', 'positions')
+
+    def __init__(self, weeks):
+        self.weeks = weeks
+        self.positions = get_positions(weeks)
+
+    @property
+    def first(self):
+        """グリッドの最初の日"""
+        return self.weeks[0][0]
+
+    @property
+    def last(self):
+        """グリッドの最後の日"""
+        return self.weeks[-1][-1]
+
+    def get_week(self, date):
+        """dateを含む週を返す。dateがグリッドになければKeyError"""
+        week_index, _ = self.positions[date]
+        return self.weeks[week_index]
+
+
+@functools.lru_cache(maxsize=GRID_CACHE_SIZE)
+def get_positions(weeks):
+    """{日付: (週のインデックス, 曜日のインデックス)} という、読み取り専用の辞書を返す"""
+    return MappingProxyType({
+        day: (week_index, day_index)
+        for week_index, week in enumerate(weeks)
+        for day_index, day in enumerate(week)
+    })
+
+
+@functools.lru_cache(maxsize=8)
+def get_calendar(first_weekday):
+    """最初の曜日毎に、calendar.Calendarのインスタンスを使い回す"""
+    return calendar.Calendar(first_weekday)
+
+
+@functools.lru_cache(maxsize=GRID_CACHE_SIZE)
+def get_month_grid(year, month, first_weekday=0):
+    """その月のグリッドを返す"""
+    weeks = tuple(
+        tuple(week) for week in get_calendar(first_weekday).monthdatescalendar(year, month)
+    )
+    return MonthGrid(weeks)
+
+
+def get_week_days(date, first_weekday=0):
+    """dateを含む週の日を全て返す。週の検索は、辞書を引くだけです"""
+    return get_month_grid(date.year, date.month, first_weekday).get_week(date)
+
+
+@functools.lru_cache(maxsize=32)
+def get_locale_week_names(language):
+    """languageの、月曜日から書いた曜日の略称のタプルを返す。('月', '火'...)や('Mon', 'Tue'...)です"""
+    with translation.override(language):
+        return tuple(str(WEEKDAYS_ABBR[weekday]) for weekday in range(7))
+
+
+@functools.lru_cache(maxsize=64)
+def get_week_names(week_names, first_weekday=0):
+    """first_weekday(最初に表示される曜日)にあわせて、week_namesをシフトしたタプルを返す
+
+    week_namesは月曜日から書かれたタプルを想定します。キャッシュのキーにするため、リストは渡せません。
+
+    """
+    return week_names[first_weekday:] + week_names[:first_weekday]
+
+
+def bucket_rows(weeks, rows, get_date, get_end_date=None):
+    """rowsを、それぞれの日の枠に振り分ける
+
+    [{1日: 1日の行のリスト, 2日: ...}, {8日: 8日の行のリスト...}, ...]という、週毎の辞書のリストを返します。
+    各行は、事前に計算した(週, 曜日)の枠に1回で入れるので、行数と日数に比例した時間で終わります。
+    rowsが日付・時間順に並んでいれば、それぞれの日の中でもその順番のままです。
+    get_end_dateを渡すと、複数日の行は、グリッドの中で重なる全ての日に入ります。
+
+    """
+    weeks = tuple(tuple(week) for week in weeks)  # タプルのタプルなら、コピーは作られません
+    positions = get_positions(weeks)
+    slots = [[DaySchedules() for day in week] for week in weeks]
+    for row in rows:
+        if get_end_date is None:
+            position = positions.get(get_date(row))
+            if position is not None:
+                week_index, day_index = position
+                slots[week_index][day_index].append(row)
+            continue
+        for day in iter_days(max(get_date(row), weeks[0][0]), min(get_end_date(row), weeks[-1][-1])):
+            week_index, day_index = positions[day]
+            slots[week_index][day_index].append(row)
+    return [dict(zip(week, week_slots)) for week, week_slots in zip(weeks, slots)]
+
+
+def iter_days(start, end):
+    """start〜endの日を、順番に返す"""
+    day = start
+    while day <= end:
+        yield day
+        day += datetime.timedelta(days=1)
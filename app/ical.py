@@ -0,0 +1,352 @@
+"""iCalendar(.ics、RFC 5545)の書き出しと読み込みを行うモジュール
+
+書き出しも読み込みも、ジェネレータで1行ずつ処理するので、何十万件あってもメモリの使用量は一定です。
+
+スケジュールの時間は、タイムゾーンの無い時間(浮動時間)として書き出します。
+読み込む際は、UTCやTZIDの付いた時間を、settings.TIME_ZONEの時間に変換します。
+終日のイベントは、0:00〜23:59:59のスケジュールとして扱います。
+
+"""
+import datetime
+import zoneinfo
+from django.utils import timezone
+from . import recurrence
+
+CRLF = '\r\n'
+MAX_LINE_OCTETS = 75  # 1行の最大のバイト数(改行を除く)。これより長い行は折り返します
+
+MAX_COUNT = datetime.date.max.toordinal()  # 毎日でも、これより多い回数は日付で扱える範囲を超えます
+
+ALL_DAY_START = datetime.time(0, 0)
+ALL_DAY_END = datetime.time(23, 59, 59)
+
+WEEKDAY_NAMES = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+FREQUENCIES = {
+    recurrence.DAILY: 'DAILY',
+    recurrence.WEEKLY: 'WEEKLY',
+    recurrence.MONTHLY: 'MONTHLY',
+}
+
+
+class UnsupportedEvent(ValueError):
+    """読み込めないイベント(対応していない繰り返しなど)"""
+
+
+def escape_text(text):
+    """TEXT型の値をエスケープする"""
+    return (
+        text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+    )
+
+
+def unescape_text(text):
+    """TEXT型の値のエスケープを戻す"""
+    if '\\' not in text:
+        return text
+    chars = []
+    escaped = False
+    for char in text:
+        if escaped:
+            chars.append('\n' if char in 'nN' else char)
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        else:
+            chars.append(char)
+    return ''.join(chars)
+
+
+def fold_line(line):
+    """75バイトを超える行を折り返し、改行を付けて返す。UTF-8の文字の途中では切りません"""
+    if len(line.encode()) <= MAX_LINE_OCTETS:
+        return line + CRLF
+    parts = []
+    current = []
+    size = 0
+    limit = MAX_LINE_OCTETS
+    for char in line:
+        char_size = len(char.encode())
+        if size + char_size > limit:
+            parts.append(''.join(current))
+            current = []
+            size = 0
+            limit = MAX_LINE_OCTETS - 1  # 続きの行は、先頭の空白の分だけ短くなります
+        current.append(char)
+        size += char_size
+    parts.append(''.join(current))
+    return (CRLF + ' ').join(parts) + CRLF
+
+
+def format_date(date):
+    return date.strftime('%Y%m%d')
+
+
+def format_datetime(date, time):
+    return '{}T{}'.format(format_date(date), time.strftime('%H%M%S'))
+
+
+def format_utc(value):
+    """aware(USE_TZ=False ならローカル)なdatetimeを、UTCの形式にする"""
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value.astimezone(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def get_time_lines(date, start_time, end_date, end_time):
+    """DTSTARTとDTENDの行を返す"""
+    if start_time == ALL_DAY_START and end_time == ALL_DAY_END:
+        # 終日のイベントのDTENDは、最後の日の翌日です
+        return [
+            'DTSTART;VALUE=DATE:{}'.format(format_date(date)),
+            'DTEND;VALUE=DATE:{}'.format(format_date(end_date + datetime.timedelta(days=1))),
+        ]
+    return [
+        'DTSTART:{}'.format(format_datetime(date, start_time)),
+        'DTEND:{}'.format(format_datetime(end_date, end_time)),
+    ]
+
+
+def iter_schedule_lines(schedule, uid_domain):
+    """Schedule(またはvalues()の辞書)1件分の、VEVENTの行を返す"""
+    if not isinstance(schedule, dict):
+        schedule = vars(schedule)
+    date = schedule['date']
+    yield 'BEGIN:VEVENT'
+    yield 'UID:{}'.format(schedule.get('uid') or 'schedule-{}@{}'.format(schedule['id'], uid_domain))
+    yield 'DTSTAMP:{}'.format(format_utc(schedule['updated_at']))
+    yield from get_time_lines(date, schedule['start_time'], schedule.get('end_date') or date, schedule['end_time'])
+    yield 'SUMMARY:{}'.format(escape_text(schedule['summary']))
+    if schedule['description']:
+        yield 'DESCRIPTION:{}'.format(escape_text(schedule['description']))
+    yield 'END:VEVENT'
+
+
+def get_rrule(recurring_schedule):
+    """RecurringScheduleの繰り返しを、RRULEの値にする"""
+    parts = ['FREQ={}'.format(FREQUENCIES[recurring_schedule.frequency])]
+    if recurring_schedule.interval != 1:
+        parts.append('INTERVAL={}'.format(recurring_schedule.interval))
+    weekdays = recurring_schedule.get_weekdays()
+    if recurring_schedule.frequency == recurrence.WEEKLY and weekdays:
+        parts.append('BYDAY={}'.format(','.join(WEEKDAY_NAMES[weekday] for weekday in sorted(set(weekdays)))))
+    if recurring_schedule.count is not None:
+        parts.append('COUNT={}'.format(recurring_schedule.count))
+    if recurring_schedule.until is not None:
+        parts.append('UNTIL={}'.format(format_datetime(recurring_schedule.until, ALL_DAY_END)))
+    return ';'.join(parts)
+
+
+def iter_recurring_schedule_lines(recurring_schedule, uid_domain):
+    """RecurringSchedule1件分の、RRULE付きのVEVENTの行を返す。例外の日は、EXDATEになります"""
+    start_date = recurring_schedule.start_date
+    yield 'BEGIN:VEVENT'
+    yield 'UID:{}'.format(recurring_schedule.uid or 'recurring-{}@{}'.format(recurring_schedule.pk, uid_domain))
+    yield 'DTSTAMP:{}'.format(format_utc(recurring_schedule.updated_at))
+    yield from get_time_lines(start_date, recurring_schedule.start_time, start_date, recurring_schedule.end_time)
+    yield 'RRULE:{}'.format(get_rrule(recurring_schedule))
+    for exception in recurring_schedule.exceptions.all():
+        yield 'EXDATE:{}'.format(format_datetime(exception.date, recurring_schedule.start_time))
+    yield 'SUMMARY:{}'.format(escape_text(recurring_schedule.summary))
+    if recurring_schedule.description:
+        yield 'DESCRIPTION:{}'.format(escape_text(recurring_schedule.description))
+    yield 'END:VEVENT'
+
+
+def iter_calendar(schedules, recurring_schedules=(), uid_domain='localhost', name=None):
+    """VCALENDAR全体を、折り返し済みの行で少しずつ返すジェネレータ"""
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//django-simple-calendar//JA',
+        'CALSCALE:GREGORIAN',
+        'X-WR-TIMEZONE:{}'.format(timezone.get_default_timezone_name()),
+    ]
+    if name:
+        lines.append('X-WR-CALNAME:{}'.format(escape_text(name)))
+    for line in lines:
+        yield fold_line(line)
+    for schedule in schedules:
+        for line in iter_schedule_lines(schedule, uid_domain):
+            yield fold_line(line)
+    for recurring_schedule in recurring_schedules:
+        for line in iter_recurring_schedule_lines(recurring_schedule, uid_domain):
+            yield fold_line(line)
+    yield fold_line('END:VCALENDAR')
+
+
+def unfold_lines(lines):
+    """折り返された行を、1つの論理行に戻して返すジェネレータ"""
+    current = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t'):
+            if current is not None:
+                current += line[1:]
+            continue
+        if current:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+def parse_line(line):
+    """'名前;パラメータ=値:値' の行を、(名前, {パラメータ: 値}, 値)にする"""
+    head, colon, value = line.partition(':')
+    if '"' in head:
+        # パラメータの値が引用符で囲まれていれば、その中の:は区切りではありません
+        in_quotes = False
+        for index, char in enumerate(line):
+            if char == '"':
+                in_quotes = not in_quotes
+            elif char == ':' and not in_quotes:
+                head, colon, value = line[:index], ':', line[index + 1:]
+                break
+        else:
+            colon = ''
+    if not colon:
+        raise ValueError('値の無い行です: {}'.format(line))
+    if ';' not in head:
+        return head.upper(), {}, value
+    name, *params = head.split(';')
+    return name.upper(), dict(param.partition('=')[::2] for param in params), value
+
+
+def iter_events(lines):
+    """VEVENTを、{名前: [(パラメータ, 値), ...]}の辞書にして、1つずつ返すジェネレータ
+
+    VEVENTの中のVALARMなど、入れ子のコンポーネントは読み飛ばします。
+
+    """
+    event = None
+    depth = 0
+    for line in unfold_lines(lines):
+        try:
+            name, params, value = parse_line(line)
+        except ValueError:
+            continue
+        if name == 'BEGIN':
+            if event is not None:
+                depth += 1
+            elif value.upper() == 'VEVENT':
+                event = {}
+            continue
+        if name == 'END':
+            if depth:
+                depth -= 1
+            elif event is not None and value.upper() == 'VEVENT':
+                yield event
+                event = None
+            continue
+        if event is not None and not depth:
+            event.setdefault(name, []).append((params, value))
+
+
+def get_local_timezone(params):
+    """TZIDパラメータのタイムゾーンを返す。無いか、分からなければNone(浮動時間)"""
+    tzid = params.get('TZID', '').strip('"')
+    if not tzid:
+        return None
+    try:
+        return zoneinfo.ZoneInfo(tzid)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def parse_datetime(params, value):
+    """DTSTARTなどの値を、(日付, 時間)にする。終日なら時間はNone
+
+    UTCやTZIDの付いた時間は、settings.TIME_ZONEの時間に変換します。
+
+    """
+    value = value.strip()
+    # strptime()は遅いので、固定の位置から切り出します。何十万件も読み込むと、大きな差になります
+    date = datetime.date(int(value[:4]), int(value[4:6]), int(value[6:8]))
+    if params.get('VALUE') == 'DATE' or len(value) == 8:
+        return date, None
+    if value[8:9] != 'T' or len(value) < 15:
+        raise ValueError('日時の形式が正しくありません: {}'.format(value))
+    moment = datetime.datetime.combine(date, datetime.time(int(value[9:11]), int(value[11:13]), int(value[13:15])))
+    if value.endswith('Z'):
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    else:
+        tzinfo = get_local_timezone(params)
+        if tzinfo is not None:
+            moment = moment.replace(tzinfo=tzinfo)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.get_default_timezone()).replace(tzinfo=None)
+    return moment.date(), moment.time()
+
+
+def get_text(event, name):
+    values = event.get(name)
+    return unescape_text(values[0][1]) if values else ''
+
+
+def parse_event(event):
+    """VEVENTの辞書を、Scheduleの値の辞書にする
+
+    {'uid': ..., 'summary': ..., 'date': ..., 'end_date': ..., 'start_time': ..., 'end_time': ..., 'rrule': ..., 'exdates': [...]}
+    を返します。DTSTARTの無いイベントは、UnsupportedEventです。
+
+    """
+    if 'DTSTART' not in event:
+        raise UnsupportedEvent('DTSTARTがありません')
+    if 'RECURRENCE-ID' in event:
+        raise UnsupportedEvent('繰り返しの1回だけを変更したイベントには、対応していません')
+    date, start_time = parse_datetime(*event['DTSTART'][0])
+    if 'DTEND' in event:
+        end_date, end_time = parse_datetime(*event['DTEND'][0])
+        if end_time is None:
+            end_date -= datetime.timedelta(days=1)  # 終日のDTENDは、最後の日の翌日です
+    else:
+        end_date, end_time = date, start_time
+    if start_time is None:
+        start_time, end_time = ALL_DAY_START, ALL_DAY_END
+    end_date = max(end_date, date)
+
+    exdates = []
+    for params, value in event.get('EXDATE', []):
+        for item in value.split(','):
+            exdates.append(parse_datetime(params, item)[0])
+    return {
+        'uid': get_text(event, 'UID')[:255],
+        'summary': get_text(event, 'SUMMARY')[:50],
+        'description': get_text(event, 'DESCRIPTION'),
+        'date': date,
+        'end_date': end_date,
+        'start_time': start_time,
+        'end_time': end_time if end_time is not None else start_time,
+        'rrule': parse_rrule(event['RRULE'][0][1]) if 'RRULE' in event else None,
+        'exdates': exdates,
+    }
+
+
+def parse_rrule(value):
+    """RRULEの値を、RecurringScheduleの値の辞書にする。対応していない繰り返しは、UnsupportedEventです"""
+    rule = dict(part.partition('=')[::2] for part in value.upper().split(';') if part)
+    frequencies = {name: frequency for frequency, name in FREQUENCIES.items()}
+    if rule.get('FREQ') not in frequencies:
+        raise UnsupportedEvent('対応していない繰り返しです: {}'.format(value))
+    supported = {'FREQ', 'INTERVAL', 'COUNT', 'UNTIL', 'BYDAY', 'WKST'}
+    if set(rule) - supported or (rule.get('BYDAY') and rule['FREQ'] != 'WEEKLY'):
+        raise UnsupportedEvent('対応していない繰り返しです: {}'.format(value))
+    try:
+        weekdays = [WEEKDAY_NAMES.index(day) for day in rule['BYDAY'].split(',')] if rule.get('BYDAY') else []
+    except ValueError:
+        raise UnsupportedEvent('対応していない曜日の指定です: {}'.format(value))
+    until = parse_datetime({}, rule['UNTIL'])[0] if rule.get('UNTIL') else None
+    interval = int(rule.get('INTERVAL') or 1)
+    count = int(rule['COUNT']) if rule.get('COUNT') else None
+    if interval < 1 or (count is not None and count < 1):
+        raise UnsupportedEvent('INTERVALとCOUNTは、1以上にしてください: {}'.format(value))
+    if count is not None and count > MAX_COUNT:
+        count = None  # 9999年までに終わらない回数は、終わりの無い繰り返しと同じです
+    return {
+        'frequency': frequencies[rule['FREQ']],
+        'interval': interval,
+        'weekdays': ','.join(str(weekday) for weekday in weekdays),
+        'count': count,
+        'until': until,
+    }
@@ -0,0 +1,164 @@
+"""カレンダーの各処理(グリッド、スケジュールの取得、振り分け、フォームセット、描画)の時間を計測するモジュール
+
+計測した時間・クエリ数・行数は、stage_timedシグナルで送られます。
+settings.CALENDAR_TIMING_SINKSにシンク(送り先)を指定すると、ログやStatsD(UDP)に送れます。::
+
+    CALENDAR_TIMING_SINKS = [
+        {'BACKEND': 'app.instrumentation.LoggingSink'},
+        {'BACKEND': 'app.instrumentation.StatsdSink', 'OPTIONS': {'host': '127.0.0.1', 'port': 8125}},
+    ]
+
+"""
+import contextlib
+import functools
+import logging
+import socket
+import time
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection
+from django.dispatch import Signal, receiver
+from django.utils.module_loading import import_string
+
+# 処理の時間を計測したら送られます。sender=ビューのクラス、timing=StageTiming、request=リクエスト
+stage_timed = Signal()
+
+logger = logging.getLogger(__name__)
+
+
+class StageTiming:
+    """1つの処理の計測結果"""
+    __slots__ = ('view', 'stage', 'duration', 'queries', 'rows')
+
+    def __init__(self, view, stage):
+        self.view = view  # ビューのクラス名
+        self.stage = stage
+        self.duration = 0.0  # 秒
+        self.queries = None  # 非同期の処理では、クエリは別のスレッドで実行されるので数えません
+        self.rows = None
+
+    def __repr__(self):
+        return '<StageTiming {}.{} {:.2f}ms>'.format(self.view, self.stage, self.duration * 1000)
+
+
+@contextlib.contextmanager
+def time_stage(view, stage, count_queries=True):
+    """withの中の時間とクエリ数を計測し、stage_timedシグナルで送る
+
+    StageTimingをasで受け取り、rowsに行数を入れることもできます。
+    ビューにstage_timingsのリストがあれば、そこにも加えます(Server-Timingヘッダで使います)。
+
+    """
+    timing = StageTiming(type(view).__name__, stage)
+    queries = [0]
+
+    def count(execute, sql, params, many, context):
+        queries[0] += 1
+        return execute(sql, params, many, context)
+
+    began = time.perf_counter()
+    try:
+        if count_queries:
+            with connection.execute_wrapper(count):
+                yield timing
+            timing.queries = queries[0]
+        else:
+            yield timing
+    finally:
+        timing.duration = time.perf_counter() - began
+        stage_timings = getattr(view, 'stage_timings', None)
+        if stage_timings is not None:
+            stage_timings.append(timing)
+        stage_timed.send(sender=type(view), timing=timing, request=getattr(view, 'request', None))
+
+
+def timed(stage):
+    """メソッドの時間とクエリ数を計測するデコレータ"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with time_stage(self, stage):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class LoggingSink:
+    """計測結果を、ログに書き込むシンク"""
+
+    def __init__(self, logger_name=__name__, level=logging.INFO):
+        self.logger = logging.getLogger(logger_name)
+        self.level = level
+
+    def __call__(self, timing):
+        self.logger.log(
+            self.level, '%s.%s %.2fms queries=%s rows=%s',
+            timing.view, timing.stage, timing.duration * 1000, timing.queries, timing.rows,
+        )
+
+
+class StatsdSink:
+    """計測結果を、StatsDのプロトコル(UDP)でコレクタに送るシンク
+
+    prefix.ビュー.処理 の時間と、prefix.ビュー.処理.queries のクエリ数を、タイマー(|ms)で送ります。
+    タイマーなので、コレクタ側でp95などの分位数を出せます。
+    UDPは送りっぱなしなので、コレクタが止まっていても、ビューが遅くなったりエラーになったりはしません。
+
+    """
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='calendar'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def get_lines(self, timing):
+        name = '{}.{}.{}'.format(self.prefix, timing.view, timing.stage)
+        lines = ['{}:{:.3f}|ms'.format(name, timing.duration * 1000)]
+        if timing.queries is not None:
+            lines.append('{}.queries:{}|ms'.format(name, timing.queries))
+        if timing.rows is not None:
+            lines.append('{}.rows:{}|ms'.format(name, timing.rows))
+        return lines
+
+    def __call__(self, timing):
+        try:
+            self.socket.sendto('\n'.join(self.get_lines(timing)).encode(), self.address)
+        except OSError:
+            logger.debug('StatsDに送れませんでした: %s', self.address, exc_info=True)
+
+
+@functools.lru_cache(maxsize=None)
+def get_sinks():
+    """settings.CALENDAR_TIMING_SINKSのシンクを作って返す"""
+    sinks = []
+    for config in getattr(settings, 'CALENDAR_TIMING_SINKS', []):
+        sink_class = import_string(config['BACKEND'])
+        sinks.append(sink_class(**config.get('OPTIONS', {})))
+    return sinks
+
+
+@receiver(setting_changed)
+def reset_sinks(setting, **kwargs):
+    if setting == 'CALENDAR_TIMING_SINKS':
+        get_sinks.cache_clear()
+
+
+@receiver(stage_timed)
+def send_to_sinks(sender, timing, **kwargs):
+    for sink in get_sinks():
+        sink(timing)
+
+
+def get_server_timing(stage_timings):
+    """Server-Timingヘッダの値を返す。例えば、grid;dur=0.12, query;dur=3.40;desc="queries=1 rows=40" """
+    metrics = []
+    for timing in stage_timings:
+        metric = '{};dur={:.2f}'.format(timing.stage, timing.duration * 1000)
+        descriptions = [
+            '{}={}'.format(name, value)
+            for name, value in (('queries', timing.queries), ('rows', timing.rows)) if value is not None
+        ]
+        if descriptions:
+            metric += ';desc="{}"'.format(' '.join(descriptions))
+        metrics.append(metric)
+    return ', '.join(metrics)
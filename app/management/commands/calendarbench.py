@@ -0,0 +1,173 @@
+"""カレンダーのMixinやビューの、処理時間を計測するコマンド
+
+テスト用のデータベースを作ってScheduleのデータを入れ、各処理のレイテンシの分位数、クエリ数、
+メモリ使用量のピークを計測して、JSONで出力します。::
+
+    python manage.py calendarbench --rows 100000 --repeat 50 --output bench.json
+
+"""
+import datetime
+import json
+import platform
+import random
+import time
+import tracemalloc
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, RequestFactory
+from django.test.utils import setup_test_environment, teardown_test_environment
+from app import views
+from app.models import Calendar, Schedule
+
+
+def percentile(values, percent):
+    """ソート済みのvaluesの、percent%点を線形補間で返す"""
+    if len(values) == 1:
+        return values[0]
+    position = (len(values) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class Command(BaseCommand):
+    help = 'カレンダーのMixinやビューの、レイテンシ・クエリ数・メモリ使用量を計測し、JSONで出力します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='作成するスケジュールの数')
+        parser.add_argument('--days', type=int, default=365, help='スケジュールを散らばらせる日数')
+        parser.add_argument('--start', default='2019-01-01', help='スケジュールを作る最初の日')
+        parser.add_argument('--repeat', type=int, default=20, help='1つの処理を計測する回数')
+        parser.add_argument('--batch-size', type=int, default=5000, help='bulk_createで一度に作成する数')
+        parser.add_argument('--seed', type=int, default=0, help='乱数のシード')
+        parser.add_argument('--output', help='結果を書き込むファイル。省略すると標準出力です')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            start = datetime.date.fromisoformat(options['start'])
+            self.seed(start, options['rows'], options['days'], options['batch_size'], options['seed'])
+            results = self.run_benchmarks(start, options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'rows': options['rows'],
+            'days': options['days'],
+            'repeat': options['repeat'],
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'results': results,
+        }
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+
+    def seed(self, start, rows, days, batch_size, seed):
+        """start〜start+daysの範囲に、rows件のスケジュールを作る"""
+        rng = random.Random(seed)
+        # 全員が見られるカレンダーに入れます(マイグレーションで作られています)
+        calendar = Calendar.objects.filter(owner__isnull=True).first() or Calendar.objects.create(name='ベンチマーク')
+        with transaction.atomic():
+            for offset in range(0, rows, batch_size):
+                schedules = []
+                for i in range(offset, min(offset + batch_size, rows)):
+                    hour = rng.randrange(0, 23)
+                    date = start + datetime.timedelta(days=rng.randrange(days))
+                    schedules.append(Schedule(
+                        calendar=calendar,
+                        summary='予定{}'.format(i),
+                        description='詳細' * rng.randrange(0, 50),
+                        date=date,
+                        end_date=date,  # bulk_createでは、save()で埋められないため
+                        start_time=datetime.time(hour, 0),
+                        end_time=datetime.time(hour + 1, 0),
+                    ))
+                Schedule.objects.bulk_create(schedules)
+
+    def get_cases(self, start):
+        """{計測名: 計測する関数} を返す"""
+        factory = RequestFactory()
+        client = Client()
+        month_kwargs = {'year': start.year, 'month': start.month}
+        week_kwargs = {'year': start.year, 'month': start.month, 'day': start.day}
+
+        def mixin_case(view_class, method_name, kwargs):
+            def run():
+                view = view_class()
+                view.setup(factory.get('/'), **kwargs)
+                return getattr(view, method_name)()
+            return run
+
+        def view_case(url_name, kwargs):
+            url = '/{}/{}/'.format(url_name, '/'.join(str(value) for value in kwargs.values()))
+
+            def run():
+                response = client.get(url)
+                assert response.status_code == 200, url
+                return response
+            return run
+
+        return {
+            'get_month_calendar': mixin_case(views.MonthCalendar, 'get_month_calendar', month_kwargs),
+            'get_week_calendar': mixin_case(views.WeekCalendar, 'get_week_calendar', week_kwargs),
+            'get_month_schedules': mixin_case(views.MonthWithScheduleCalendar, 'get_month_calendar', month_kwargs),
+            'get_week_schedules': mixin_case(views.WeekWithScheduleCalendar, 'get_week_calendar', week_kwargs),
+            'get_month_forms': mixin_case(views.MonthWithFormsCalendar, 'get_month_calendar', month_kwargs),
+            'view:month': view_case('month', month_kwargs),
+            'view:week': view_case('week', week_kwargs),
+            'view:month_with_schedule': view_case('month_with_schedule', month_kwargs),
+            'view:week_with_schedule': view_case('week_with_schedule', week_kwargs),
+            'view:mycalendar': view_case('mycalendar', week_kwargs),
+            'view:month_with_forms': view_case('month_with_forms', month_kwargs),
+        }
+
+    def run_benchmarks(self, start, repeat):
+        results = {}
+        for name, run in self.get_cases(start).items():
+            run()  # 最初の1回は、グリッドのキャッシュなどを温めるためのもので、計測しません
+
+            durations = []
+            for _ in range(repeat):
+                began = time.perf_counter()
+                run()
+                durations.append((time.perf_counter() - began) * 1000)
+            durations.sort()
+
+            # CaptureQueriesContextは、テストクライアントのリクエスト開始時にクエリの記録が消されるため使いません
+            queries = []
+
+            def count_query(execute, sql, params, many, context):
+                queries.append(sql)
+                return execute(sql, params, many, context)
+
+            with connection.execute_wrapper(count_query):
+                run()
+
+            # tracemallocは処理を遅くするので、時間の計測とは別に1回だけ実行します
+            tracemalloc.start()
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            results[name] = {
+                'min_ms': round(durations[0], 3),
+                'p50_ms': round(percentile(durations, 50), 3),
+                'p90_ms': round(percentile(durations, 90), 3),
+                'p95_ms': round(percentile(durations, 95), 3),
+                'p99_ms': round(percentile(durations, 99), 3),
+                'max_ms': round(durations[-1], 3),
+                'mean_ms': round(sum(durations) / len(durations), 3),
+                'queries': len(queries),
+                'peak_memory_bytes': peak,
+            }
+            self.stderr.write('{}: p50 {:.3f}ms'.format(name, results[name]['p50_ms']))
+        return results
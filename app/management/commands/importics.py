@@ -0,0 +1,160 @@
+"""iCalendar(.ics)ファイルのイベントを、スケジュールとして読み込むコマンド
+
+ファイルは1行ずつ読み、イベントはbatch-size件ずつbulk_createするので、何十万件あってもメモリの使用量は一定です。::
+
+    python manage.py importics calendar.ics --calendar 1
+    curl https://example.com/calendar.ics | python manage.py importics -
+
+RRULEの付いたイベントは、繰り返しのスケジュール(RecurringSchedule)になります。
+イベントのUIDは、スケジュールに保存します。同じカレンダーに読み込み済みのUIDのイベントは、もう一度は読み込みません。
+同じファイルを何度読み込んでも、増えるのは新しいイベントだけです(読み込み済みのイベントは更新しません)。
+対応していない繰り返しや、settings.CALENDAR_MAX_SCHEDULE_DAYSより長いイベントなど、
+読み込めないイベントは読み飛ばし、最後に件数を出力します。
+
+"""
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from app import cache, ical
+from app.models import Calendar, RecurrenceException, RecurringSchedule, Schedule, get_max_schedule_days
+from app.signals import bulk_saved, get_partitions
+
+UID_QUERY_SIZE = 500  # 読み込み済みのUIDを調べる、1回のクエリのUIDの数
+
+
+class Command(BaseCommand):
+    help = 'iCalendar(.ics)ファイルのイベントを、スケジュールとして読み込みます'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='読み込む.icsファイル。-なら標準入力です')
+        parser.add_argument('--calendar', type=int, help='入れるカレンダーのID。省略すると、全員が見られるカレンダーです')
+        parser.add_argument('--batch-size', type=int, default=5000, help='bulk_createで一度に作成する数')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        calendar = self.get_calendar(options['calendar'])
+        if options['path'] == '-':
+            file = sys.stdin
+        else:
+            try:
+                file = open(options['path'], encoding='utf-8-sig', newline='')
+            except OSError as e:
+                raise CommandError(e)
+
+        began = time.perf_counter()
+        try:
+            with transaction.atomic():
+                counts, span = self.import_events(file, calendar, options['batch_size'])
+                if span is not None:
+                    partitions = get_partitions(calendar.pk)
+                    transaction.on_commit(lambda: cache.evict_spans(Schedule, [span], partitions))
+        finally:
+            if file is not sys.stdin:
+                file.close()
+        elapsed = time.perf_counter() - began
+
+        total = counts['schedules'] + counts['recurring_schedules']
+        self.stdout.write(self.style.SUCCESS(
+            '{schedules}件のスケジュールと、{recurring_schedules}件の繰り返しのスケジュールを読み込みました'
+            '(読み飛ばし: {skipped}件、読み込み済み: {imported}件)'.format(**counts)
+        ))
+        self.stdout.write('{:.2f}秒、{:.0f}件/秒'.format(elapsed, total / elapsed if elapsed else 0))
+
+    def get_calendar(self, calendar_id):
+        """読み込んだスケジュールを入れるカレンダーを返す"""
+        if calendar_id is not None:
+            try:
+                return Calendar.objects.get(pk=calendar_id)
+            except Calendar.DoesNotExist:
+                raise CommandError('ID:{}のカレンダーはありません'.format(calendar_id))
+        calendar = Calendar.objects.filter(owner__isnull=True).order_by('pk').first()
+        if calendar is None:
+            raise CommandError('全員が見られるカレンダーがありません。--calendarを指定してください')
+        return calendar
+
+    def import_events(self, file, calendar, batch_size):
+        """イベントを読み込み、({種類: 件数}, 作成したスケジュールの(最初の日, 最後の日))を返す"""
+        counts = {'schedules': 0, 'recurring_schedules': 0, 'skipped': 0, 'imported': 0}
+        first = last = None
+        schedules = []
+        for event in ical.iter_events(file):
+            try:
+                values = ical.parse_event(event)
+                if (values['end_date'] - values['date']).days >= get_max_schedule_days():
+                    raise ValueError('{}日より長いイベントです: {}'.format(get_max_schedule_days(), values['summary']))
+            except (ical.UnsupportedEvent, ValueError) as e:
+                counts['skipped'] += 1
+                if self.verbosity >= 2:
+                    self.stderr.write('読み飛ばしました: {}'.format(e))
+                continue
+
+            rrule = values.pop('rrule')
+            exdates = values.pop('exdates')
+            if rrule is not None:
+                if self.create_recurring_schedule(calendar, values, rrule, exdates):
+                    counts['recurring_schedules'] += 1
+                else:
+                    counts['imported'] += 1
+                continue
+
+            # bulk_createでは、save()もシグナルも呼ばれないので、キャッシュは最後にまとめて消します
+            schedules.append(Schedule(calendar=calendar, **values))
+            first = values['date'] if first is None else min(first, values['date'])
+            last = values['end_date'] if last is None else max(last, values['end_date'])
+            if len(schedules) >= batch_size:
+                self.save_schedules(calendar, schedules, counts)
+                schedules = []
+
+        if schedules:
+            self.save_schedules(calendar, schedules, counts)
+        return counts, None if first is None else (first, last)
+
+    def get_imported_uids(self, model, calendar, uids):
+        """uidsのうち、calendarに読み込み済みのUIDの集合を返す"""
+        uids = list(uids)
+        imported = set()
+        for offset in range(0, len(uids), UID_QUERY_SIZE):
+            imported.update(model.objects.filter(
+                calendar=calendar, uid__in=uids[offset:offset + UID_QUERY_SIZE]
+            ).values_list('uid', flat=True))
+        return imported
+
+    def save_schedules(self, calendar, schedules, counts):
+        """読み込み済みのUID以外のスケジュールをまとめて保存し、countsに件数を足す"""
+        imported = self.get_imported_uids(Schedule, calendar, {schedule.uid for schedule in schedules if schedule.uid})
+        new_schedules = []
+        for schedule in schedules:
+            if schedule.uid:
+                if schedule.uid in imported:
+                    counts['imported'] += 1
+                    continue
+                imported.add(schedule.uid)  # 同じバッチの中で、同じUIDが繰り返された場合
+            new_schedules.append(schedule)
+        schedules = new_schedules
+        Schedule.objects.bulk_create(schedules)
+        # 日毎の件数は、まとめて足します
+        bulk_saved.send(sender=Schedule, created=schedules, updated=[], previous={})
+        counts['schedules'] += len(schedules)
+
+    def create_recurring_schedule(self, calendar, values, rrule, exdates):
+        """繰り返しのスケジュールを作り、作ったならTrueを返す。最後の日を計算するため、bulk_createではなくsave()します"""
+        if values['uid'] and RecurringSchedule.objects.filter(calendar=calendar, uid=values['uid']).exists():
+            return False
+        recurring_schedule = RecurringSchedule(
+            calendar=calendar,
+            uid=values['uid'],
+            summary=values['summary'],
+            description=values['description'],
+            start_time=values['start_time'],
+            end_time=values['end_time'],
+            start_date=values['date'],
+            **rrule
+        )
+        recurring_schedule.save()
+        if exdates:
+            RecurrenceException.objects.bulk_create(
+                [RecurrenceException(recurring_schedule=recurring_schedule, date=date) for date in set(exdates)],
+                ignore_conflicts=True,
+            )
+        return True
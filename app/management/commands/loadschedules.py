@@ -0,0 +1,235 @@
+"""大量のスケジュールを、作成したり、CSV・NDJSONから読み込んだりするコマンド
+
+テストや検証用の環境に、何百万件ものスケジュールを入れるのに使います。::
+
+    python manage.py loadschedules --generate 1000000 --start 2019-01-01 --days 365 --sqlite-tune
+    python manage.py loadschedules schedules.csv --calendar 1
+    curl 'http://localhost:8000/api/schedules/?start=2019-01-01&end=2019-12-31' | python manage.py loadschedules - --format ndjson
+
+CSVは1行目に、NDJSONは各行のキーに、summary、description、date、end_date、start_time、end_timeを指定してください。
+日付と時間はISO形式です。dateとsummary以外は省略でき、それ以外のキー(idなど)は無視します。
+/api/schedules/で書き出したNDJSONも、そのまま読み込めます。
+
+スケジュールは、batch-size件ずつ、それぞれのトランザクションでbulk_createします。
+ファイルも作成するスケジュールも少しずつ扱うので、何百万件あってもメモリの使用量は一定です。
+
+"""
+import csv
+import datetime
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from app import cache
+from app.models import Calendar, Schedule, get_max_schedule_days
+from app.signals import bulk_saved, get_partitions
+
+FIELDS = ('summary', 'description', 'date', 'end_date', 'start_time', 'end_time')
+SUMMARIES = ('会議', '打ち合わせ', '面談', '出張', '研修', '締め切り', '資料作成', 'レビュー', '定例', 'ランチ')
+WORDS = ('予定', '資料', '確認', '連絡', '準備', '共有', '議事録', '対応', '調整', '報告')
+
+
+class Command(BaseCommand):
+    help = 'スケジュールを大量に作成するか、CSV・NDJSONから読み込みます'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='読み込むCSV・NDJSONファイル。-なら標準入力です')
+        parser.add_argument('--format', choices=('csv', 'ndjson'), help='ファイルの形式。省略すると、拡張子から決めます')
+        parser.add_argument('--generate', type=int, metavar='ROWS', help='ファイルを読まずに、ROWS件のスケジュールを作成します')
+        parser.add_argument('--calendar', type=int, help='入れるカレンダーのID。省略すると、全員が見られるカレンダーです')
+        parser.add_argument('--batch-size', type=int, default=5000, help='bulk_createで一度に作成する数')
+        parser.add_argument(
+            '--sqlite-tune', action='store_true',
+            help='SQLiteなら、journal_mode=WAL、synchronous=NORMALにして書き込みを速くします(WALはファイルに残ります)',
+        )
+        parser.add_argument(
+            '--no-signals', action='store_true',
+            help='日毎の件数と全文検索の索引を更新しません。後でrebuildschedulestatsとrebuildschedulesearchを実行してください',
+        )
+        group = parser.add_argument_group('--generateの設定')
+        group.add_argument('--start', default='2019-01-01', help='スケジュールを作る最初の日')
+        group.add_argument('--days', type=int, default=365, help='スケジュールを散らばらせる日数')
+        group.add_argument(
+            '--weekend-ratio', type=float, default=0.3, help='土日のスケジュールの数の、平日に対する割合。1なら均等です'
+        )
+        group.add_argument('--hours', default='9-18', help='スケジュールを始める時間帯。9-18なら、9時〜17時台に始まります')
+        group.add_argument('--max-minutes', type=int, default=120, help='スケジュールの長さの最大(分)。15分単位です')
+        group.add_argument('--multi-day-ratio', type=float, default=0.0, help='複数日のスケジュールの割合')
+        group.add_argument('--max-span-days', type=int, default=3, help='複数日のスケジュールの、最長の日数')
+        group.add_argument('--description-length', type=int, default=100, help='詳細な説明の最大の文字数')
+        group.add_argument('--seed', type=int, default=0, help='乱数のシード')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        if (options['path'] is None) == (options['generate'] is None):
+            raise CommandError('読み込むファイルか、--generateのどちらかを指定してください')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-sizeには、1以上を指定してください')
+        if not 1 <= options['max_span_days'] <= get_max_schedule_days():
+            raise CommandError('--max-span-daysには、1〜{}を指定してください'.format(get_max_schedule_days()))
+        calendar = self.get_calendar(options['calendar'])
+        if options['sqlite_tune']:
+            self.tune_sqlite()
+
+        file = None
+        if options['generate'] is not None:
+            rows = self.generate_rows(options)
+        else:
+            file, rows = self.open_rows(options['path'], options['format'])
+
+        began = time.perf_counter()
+        try:
+            counts = self.load(rows, calendar, options['batch_size'], not options['no_signals'])
+        finally:
+            if file is not None and file is not sys.stdin:
+                file.close()
+        elapsed = time.perf_counter() - began
+
+        self.stdout.write(self.style.SUCCESS(
+            '{created}件のスケジュールを作成しました(読み飛ばし: {skipped}件)'.format(**counts)
+        ))
+        self.stdout.write('{:.2f}秒、{:.0f}件/秒'.format(elapsed, counts['created'] / elapsed if elapsed else 0))
+
+    def get_calendar(self, calendar_id):
+        """スケジュールを入れるカレンダーを返す"""
+        if calendar_id is not None:
+            try:
+                return Calendar.objects.get(pk=calendar_id)
+            except Calendar.DoesNotExist:
+                raise CommandError('ID:{}のカレンダーはありません'.format(calendar_id))
+        calendar = Calendar.objects.filter(owner__isnull=True).order_by('pk').first()
+        if calendar is None:
+            raise CommandError('全員が見られるカレンダーがありません。--calendarを指定してください')
+        return calendar
+
+    def tune_sqlite(self):
+        """SQLiteの書き込みを速くする設定にする"""
+        if connection.vendor != 'sqlite':
+            self.stderr.write('SQLiteではないので、--sqlite-tuneは無視します')
+            return
+        with connection.cursor() as cursor:
+            # WALなら、コミットの度にデータベース全体を書き直さず、追記だけで済みます。
+            # synchronous=NORMALは、WALではコミット毎のfsyncを省きます。電源断では最後のコミットが失われることがありますが、壊れはしません
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.execute('PRAGMA cache_size=-65536')  # 64MB
+
+    def open_rows(self, path, file_format):
+        """(ファイル, 行のイテレータ)を返す。CSVなら{フィールド名: 文字列の値}、NDJSONならJSONの文字列の行です"""
+        if file_format is None:
+            extension = os.path.splitext(path)[1].lower()
+            if path == '-' or extension not in ('.csv', '.ndjson', '.jsonl'):
+                raise CommandError('--formatで、csvかndjsonを指定してください')
+            file_format = 'csv' if extension == '.csv' else 'ndjson'
+        if path == '-':
+            file = sys.stdin
+        else:
+            try:
+                file = open(path, encoding='utf-8-sig', newline='')
+            except OSError as e:
+                raise CommandError(e)
+        if file_format == 'csv':
+            return file, csv.DictReader(file)
+        # JSONは、読み飛ばせるように、make_scheduleで1行ずつ読み込みます
+        return file, (line for line in file if line.strip())
+
+    def generate_rows(self, options):
+        """それらしいスケジュールの値を、options['generate']件作るイテレータを返す"""
+        rng = random.Random(options['seed'])
+        start = datetime.date.fromisoformat(options['start'])
+        try:
+            first_hour, last_hour = (int(hour) for hour in options['hours'].split('-'))
+        except ValueError:
+            raise CommandError('--hoursは、9-18のように指定してください')
+        if not 0 <= first_hour < last_hour <= 24:
+            raise CommandError('--hoursは、0〜24の範囲で、始まりを終わりより前にしてください')
+
+        # 日付は、曜日の重みを付けて選びます。累積の重みを先に計算しておけば、choicesは二分探索で済みます
+        dates = [start + datetime.timedelta(days=offset) for offset in range(options['days'])]
+        cumulative = list(itertools.accumulate(
+            options['weekend_ratio'] if date.weekday() >= 5 else 1 for date in dates
+        ))
+        starts = [datetime.time(hour, minute) for hour in range(first_hour, last_hour) for minute in (0, 15, 30, 45)]
+        words = ''.join(WORDS)
+        max_quarters = max(options['max_minutes'] // 15, 1)
+
+        for i in range(options['generate']):
+            date = rng.choices(dates, cum_weights=cumulative)[0]
+            start_time = rng.choice(starts)
+            # 長さは15分単位で、日をまたがないように23:59までにします
+            minutes = start_time.hour * 60 + start_time.minute + 15 * rng.randint(1, max_quarters)
+            end_time = datetime.time(*divmod(min(minutes, 24 * 60 - 1), 60))
+            end_date = date
+            # --max-span-days 1なら、1日だけのスケジュールしか作りません
+            if options['max_span_days'] > 1 and options['multi_day_ratio'] and rng.random() < options['multi_day_ratio']:
+                end_date = date + datetime.timedelta(days=rng.randint(1, options['max_span_days'] - 1))
+            length = rng.randint(0, options['description_length'])
+            yield {
+                'summary': '{}{}'.format(rng.choice(SUMMARIES), i),
+                'description': (words * (length // len(words) + 1))[:length],
+                'date': date,
+                'end_date': end_date,
+                'start_time': start_time,
+                'end_time': end_time,
+            }
+
+    def make_schedule(self, calendar, row):
+        """行の値から、Scheduleを作る。値が正しくなければValueErrorです"""
+        if isinstance(row, str):
+            row = json.loads(row)
+        values = {}
+        for field in FIELDS:
+            value = row.get(field)
+            if value in (None, ''):
+                continue
+            if isinstance(value, str):
+                if field in ('date', 'end_date'):
+                    value = datetime.date.fromisoformat(value)
+                elif field in ('start_time', 'end_time'):
+                    value = datetime.time.fromisoformat(value)
+            values[field] = value
+        if 'date' not in values or not values.get('summary'):
+            raise ValueError('dateとsummaryは必須です: {}'.format(row))
+        values.setdefault('end_date', values['date'])  # bulk_createでは、save()で埋められないため
+        if values['end_date'] < values['date']:
+            raise ValueError('終了日が日付より前です: {}'.format(row))
+        if (values['end_date'] - values['date']).days >= get_max_schedule_days():
+            raise ValueError('{}日より長いスケジュールです: {}'.format(get_max_schedule_days(), row))
+        return Schedule(calendar=calendar, **values)
+
+    def load(self, rows, calendar, batch_size, send_signals):
+        """行を、batch_size件ずつ保存し、{種類: 件数}を返す"""
+        counts = {'created': 0, 'skipped': 0}
+        schedules = []
+        for row in rows:
+            try:
+                schedules.append(self.make_schedule(calendar, row))
+            except (ValueError, TypeError, AttributeError) as e:
+                counts['skipped'] += 1
+                if self.verbosity >= 2:
+                    self.stderr.write('読み飛ばしました: {}'.format(e))
+                continue
+            if len(schedules) >= batch_size:
+                counts['created'] += self.save_schedules(calendar, schedules, send_signals)
+                schedules = []
+                if self.verbosity >= 2:
+                    self.stdout.write('{}件...'.format(counts['created']))
+        if schedules:
+            counts['created'] += self.save_schedules(calendar, schedules, send_signals)
+        return counts
+
+    def save_schedules(self, calendar, schedules, send_signals):
+        """スケジュールを1つのトランザクションでまとめて保存し、保存した数を返す"""
+        with transaction.atomic():
+            Schedule.objects.bulk_create(schedules)
+            if send_signals:
+                # 日毎の件数と、全文検索の索引を、まとめて更新します
+                bulk_saved.send(sender=Schedule, created=schedules, updated=[], previous={})
+            span = min(schedule.date for schedule in schedules), max(schedule.end_date for schedule in schedules)
+            partitions = get_partitions(calendar.pk)
+            transaction.on_commit(lambda: cache.evict_spans(Schedule, [span], partitions))
+        return len(schedules)
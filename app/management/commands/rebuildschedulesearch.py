@@ -0,0 +1,22 @@
+"""スケジュールの全文検索の仮想テーブルを、Scheduleから作り直すコマンド
+
+シグナルの送られない方法(QuerySet.update()やloaddataなど)でスケジュールを変更した後に実行してください。::
+
+    python manage.py rebuildschedulesearch
+
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from app import search
+from app.models import Schedule
+
+
+class Command(BaseCommand):
+    help = 'スケジュールの全文検索の仮想テーブルを、作り直します'
+
+    def handle(self, *args, **options):
+        if not search.is_available(Schedule):
+            raise CommandError('全文検索の仮想テーブルがありません(SQLiteのFTS5が必要です)。検索はicontainsで行われます')
+        with transaction.atomic():
+            search.rebuild_index(Schedule)
+        self.stdout.write(self.style.SUCCESS('全文検索の仮想テーブルを作り直しました'))
@@ -0,0 +1,24 @@
+"""日毎のスケジュールの件数(DailyScheduleStats)を、Scheduleから作り直すコマンド
+
+シグナルの送られない方法(QuerySet.update()やloaddataなど)でスケジュールを変更した後に実行してください。::
+
+    python manage.py rebuildschedulestats
+
+"""
+import time
+from django.core.management.base import BaseCommand
+from app import stats
+
+
+class Command(BaseCommand):
+    help = '日毎のスケジュールの件数を、Scheduleから作り直します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='bulk_createで一度に作成する数')
+
+    def handle(self, *args, **options):
+        began = time.perf_counter()
+        rows = stats.rebuild(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            '{}日分の件数を作り直しました({:.2f}秒)'.format(rows, time.perf_counter() - began)
+        ))
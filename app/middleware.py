@@ -0,0 +1,47 @@
+"""ログインしているユーザーの、カレンダーの設定(CalendarPreference)を有効にするミドルウェア"""
+import zoneinfo
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone, translation
+from django.utils.deprecation import MiddlewareMixin
+
+
+def get_preference(user):
+    """ユーザーのCalendarPreferenceを返す。ログインしていないか、設定が無ければNone"""
+    if user is None or not user.is_authenticated:
+        return None
+    try:
+        return user.calendar_preference
+    except ObjectDoesNotExist:
+        return None
+
+
+class CalendarPreferenceMiddleware(MiddlewareMixin):
+    """ユーザーの設定を、request.calendar_preferenceに入れ、設定のタイムゾーンと言語を有効にする
+
+    設定はリクエスト毎に1回だけ読み込み、カレンダーのMixinはrequest.calendar_preferenceを使います。
+    AuthenticationMiddleware(LocaleMiddlewareを使うなら、それも)の後に置いてください。
+    ASGIでは、process_requestはスレッドで呼ばれますが、有効にしたタイムゾーンと言語は、非同期のビューにも引き継がれます。
+
+    """
+
+    def process_request(self, request):
+        preference = get_preference(getattr(request, 'user', None))
+        request.calendar_preference = preference
+        if preference is None:
+            return
+        if preference.time_zone:
+            timezone.activate(zoneinfo.ZoneInfo(preference.time_zone))
+        if preference.language:
+            request._calendar_previous_language = translation.get_language()
+            translation.activate(preference.language)
+            request.LANGUAGE_CODE = translation.get_language()
+
+    def process_response(self, request, response):
+        # 同じスレッドの次のリクエストに、このユーザーの設定が残らないよう、元に戻します
+        preference = getattr(request, 'calendar_preference', None)
+        if preference is not None:
+            if preference.time_zone:
+                timezone.deactivate()
+            if preference.language:
+                translation.activate(request._calendar_previous_language)
+        return response
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:28
+
+import datetime
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_schedule_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecurringSchedule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('summary', models.CharField(max_length=50, verbose_name='概要')),
+                ('description', models.TextField(blank=True, verbose_name='詳細な説明')),
+                ('start_time', models.TimeField(default=datetime.time(7, 0), verbose_name='開始時間')),
+                ('end_time', models.TimeField(default=datetime.time(7, 0), verbose_name='終了時間')),
+                ('frequency', models.CharField(choices=[('daily', '毎日'), ('weekly', '毎週'), ('monthly', '毎月')], default='weekly', max_length=10, verbose_name='繰り返し')),
+                ('interval', models.PositiveIntegerField(default=1, help_text='2なら、隔日・隔週・隔月になります', verbose_name='間隔')),
+                ('weekdays', models.CharField(blank=True, help_text='毎週の場合の曜日。0(月)〜6(日)をカンマ区切りで指定します。空なら開始日の曜日です', max_length=13, verbose_name='曜日')),
+                ('start_date', models.DateField(verbose_name='開始日')),
+                ('until', models.DateField(blank=True, null=True, verbose_name='終了日')),
+                ('count', models.PositiveIntegerField(blank=True, null=True, verbose_name='回数')),
+                ('end_date', models.DateField(blank=True, editable=False, null=True, verbose_name='最後の日')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='作成日')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['start_date', 'end_date'], name='app_recurring_bounds')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RecurrenceException',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='日付')),
+                ('recurring_schedule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exceptions', to='app.recurringschedule', verbose_name='繰り返しのスケジュール')),
+            ],
+            options={
+                'unique_together': {('recurring_schedule', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+def fill_end_date(apps, schema_editor):
+    """既存のスケジュールは、全て1日だけのスケジュールにする"""
+    Schedule = apps.get_model('app', 'Schedule')
+    Schedule.objects.update(end_date=models.F('date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_recurring_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='schedule',
+            name='end_date',
+            field=models.DateField(blank=True, help_text='空なら、日付と同じ日になります', null=True, verbose_name='終了日'),
+        ),
+        migrations.RunPython(fill_end_date, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='schedule',
+            name='end_date',
+            field=models.DateField(blank=True, help_text='空なら、日付と同じ日になります', verbose_name='終了日'),
+        ),
+        migrations.AddIndex(
+            model_name='schedule',
+            index=models.Index(fields=['end_date', 'date'], name='app_schedule_end_date'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:36
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_shared_calendar(apps, schema_editor):
+    """全員が見られるカレンダーを作り、既存のスケジュールを全てそこに入れる"""
+    Calendar = apps.get_model('app', 'Calendar')
+    Schedule = apps.get_model('app', 'Schedule')
+    RecurringSchedule = apps.get_model('app', 'RecurringSchedule')
+    calendar = Calendar.objects.create(name='カレンダー')
+    Schedule.objects.filter(calendar__isnull=True).update(calendar=calendar)
+    RecurringSchedule.objects.filter(calendar__isnull=True).update(calendar=calendar)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_schedule_end_date'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Calendar',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, verbose_name='名前')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='作成日')),
+                ('owner', models.ForeignKey(blank=True, help_text='空なら、全員が見られるカレンダーです', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='calendars', to=settings.AUTH_USER_MODEL, verbose_name='所有者')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='recurringschedule',
+            name='calendar',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='recurring_schedules', to='app.calendar', verbose_name='カレンダー'),
+        ),
+        migrations.AddField(
+            model_name='schedule',
+            name='calendar',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='schedules', to='app.calendar', verbose_name='カレンダー'),
+        ),
+        migrations.AddIndex(
+            model_name='recurringschedule',
+            index=models.Index(fields=['calendar', 'start_date', 'end_date'], name='app_recurring_cal_bounds'),
+        ),
+        migrations.AddIndex(
+            model_name='schedule',
+            index=models.Index(fields=['calendar', 'date', 'start_time'], name='app_schedule_cal_date'),
+        ),
+        migrations.AddIndex(
+            model_name='schedule',
+            index=models.Index(fields=['calendar', 'end_date', 'date'], name='app_schedule_cal_end_date'),
+        ),
+        migrations.RunPython(create_shared_calendar, migrations.RunPython.noop),
+    ]
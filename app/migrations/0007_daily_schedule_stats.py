@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:51
+
+import collections
+import datetime
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def count_schedules(apps, schema_editor):
+    """既存のスケジュールから、日毎の件数を作る"""
+    Schedule = apps.get_model('app', 'Schedule')
+    DailyScheduleStats = apps.get_model('app', 'DailyScheduleStats')
+    counts = collections.Counter()
+    schedules = Schedule.objects.filter(calendar__isnull=False).values_list('calendar_id', 'date', 'end_date')
+    for calendar_id, date, end_date in schedules.iterator(chunk_size=5000):
+        while date <= (end_date or date):
+            counts[calendar_id, date] += 1
+            date += datetime.timedelta(days=1)
+    DailyScheduleStats.objects.bulk_create(
+        [DailyScheduleStats(calendar_id=calendar_id, date=date, count=count)
+         for (calendar_id, date), count in counts.items()],
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_calendar'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyScheduleStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='日付')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='件数')),
+                ('calendar', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='app.calendar', verbose_name='カレンダー')),
+            ],
+            options={
+                'unique_together': {('calendar', 'date')},
+            },
+        ),
+        migrations.RunPython(count_schedules, migrations.RunPython.noop),
+    ]
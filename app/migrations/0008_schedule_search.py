@@ -0,0 +1,38 @@
+from django.db import migrations
+from django.db.utils import DatabaseError
+
+
+def create_search_table(apps, schema_editor):
+    """SQLiteなら、概要・詳細な説明を全文検索する、FTS5の仮想テーブルを作る
+
+    FTS5やtrigramトークナイザの無いSQLite(3.34より前)では作らず、検索はicontainsになります。
+
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE "app_schedule_search" USING fts5(summary, description, tokenize="trigram")'
+        )
+    except DatabaseError:
+        return
+    schema_editor.execute(
+        'INSERT INTO "app_schedule_search"(rowid, summary, description) '
+        'SELECT "id", "summary", "description" FROM "app_schedule"'
+    )
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS "app_schedule_search"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_daily_schedule_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
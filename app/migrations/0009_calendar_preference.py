@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:11
+
+import app.models
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_schedule_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarPreference',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('language', models.CharField(blank=True, help_text='ja、enなど。曜日の名前に使います', max_length=15, validators=[app.models.validate_language], verbose_name='言語')),
+                ('first_weekday', models.PositiveSmallIntegerField(blank=True, choices=[(0, '月曜日'), (1, '火曜日'), (2, '水曜日'), (3, '木曜日'), (4, '金曜日'), (5, '土曜日'), (6, '日曜日')], null=True, verbose_name='週の最初の曜日')),
+                ('time_zone', models.CharField(blank=True, help_text='Asia/Tokyo、America/New_Yorkなど。今日の日付に使います', max_length=63, validators=[app.models.validate_time_zone], verbose_name='タイムゾーン')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='calendar_preference', to=settings.AUTH_USER_MODEL, verbose_name='ユーザー')),
+            ],
+        ),
+    ]
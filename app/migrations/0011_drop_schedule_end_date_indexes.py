@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:24
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_schedule_version'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='schedule',
+            name='app_schedule_end_date',
+        ),
+        migrations.RemoveIndex(
+            model_name='schedule',
+            name='app_schedule_cal_end_date',
+        ),
+    ]
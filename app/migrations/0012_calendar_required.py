@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_calendar(apps, schema_editor):
+    """カレンダーの無いスケジュールを、全員が見られるカレンダーに入れる(どのカレンダーの表示にも出てこないため)"""
+    Calendar = apps.get_model('app', 'Calendar')
+    Schedule = apps.get_model('app', 'Schedule')
+    RecurringSchedule = apps.get_model('app', 'RecurringSchedule')
+    if not (Schedule.objects.filter(calendar__isnull=True).exists()
+            or RecurringSchedule.objects.filter(calendar__isnull=True).exists()):
+        return
+    calendar = Calendar.objects.filter(owner__isnull=True).order_by('pk').first()
+    if calendar is None:
+        calendar = Calendar.objects.create(name='カレンダー')
+    Schedule.objects.filter(calendar__isnull=True).update(calendar=calendar)
+    RecurringSchedule.objects.filter(calendar__isnull=True).update(calendar=calendar)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_drop_schedule_end_date_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_calendar, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='recurringschedule',
+            name='calendar',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='recurring_schedules', to='app.calendar', verbose_name='カレンダー'),
+        ),
+        migrations.AlterField(
+            model_name='schedule',
+            name='calendar',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='schedules', to='app.calendar', verbose_name='カレンダー'),
+        ),
+    ]
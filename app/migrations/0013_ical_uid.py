@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_calendar_required'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recurringschedule',
+            name='uid',
+            field=models.CharField(blank=True, help_text='.icsから読み込んだイベントのUID。同じカレンダーに、もう一度は読み込みません', max_length=255, verbose_name='UID'),
+        ),
+        migrations.AddField(
+            model_name='schedule',
+            name='uid',
+            field=models.CharField(blank=True, help_text='.icsから読み込んだイベントのUID。同じカレンダーに、もう一度は読み込みません', max_length=255, verbose_name='UID'),
+        ),
+        migrations.AddIndex(
+            model_name='recurringschedule',
+            index=models.Index(fields=['calendar', 'uid'], name='app_recurring_cal_uid'),
+        ),
+        migrations.AddIndex(
+            model_name='schedule',
+            index=models.Index(fields=['calendar', 'uid'], name='app_schedule_cal_uid'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+from django.db import migrations
+from django.db.utils import DatabaseError
+
+
+def create_external_content_table(apps, schema_editor):
+    """全文検索の仮想テーブルを、外部コンテンツ(content='app_schedule')で作り直す
+
+    今までの仮想テーブルは、概要・詳細な説明の文章をもう1つ保存していました。
+    外部コンテンツでは、文章はapp_scheduleから読むので、仮想テーブルには索引だけが入ります。
+
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS "app_schedule_search"')
+    try:
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE "app_schedule_search" USING fts5('
+            'summary, description, content="app_schedule", content_rowid="id", tokenize="trigram")'
+        )
+    except DatabaseError:
+        return
+    schema_editor.execute('INSERT INTO "app_schedule_search"("app_schedule_search") VALUES (\'rebuild\')')
+
+
+def create_content_table(apps, schema_editor):
+    """文章も保存する、今までの仮想テーブルに戻す"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS "app_schedule_search"')
+    try:
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE "app_schedule_search" USING fts5(summary, description, tokenize="trigram")'
+        )
+    except DatabaseError:
+        return
+    schema_editor.execute(
+        'INSERT INTO "app_schedule_search"(rowid, summary, description) '
+        'SELECT "id", "summary", "description" FROM "app_schedule"'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_ical_uid'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_external_content_table, create_content_table),
+    ]
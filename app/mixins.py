@@ -1,14 +1,52 @@
-import calendar
-from collections import deque
+import asyncio
 import datetime
-import itertools
+import hashlib
+import heapq
+import json
+from asgiref.sync import sync_to_async
 from django import forms
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count, F, Max, Prefetch, Q, Sum, Window
+from django.db.models.functions import RowNumber
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone, translation
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date
+from django.utils.http import http_date, quote_etag
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from . import cache, grid, ical, instrumentation, recurrence, search
+from .forms import LazyDayForm, LazyExtraModelFormSet
+from .models import ScheduleConflict, get_max_schedule_days
+from .signals import bulk_saved
 
 
 class BaseCalendarMixin:
-    """カレンダー関連Mixinの、基底クラス"""
+    """カレンダー関連Mixinの、基底クラス
+
+    ログインしているユーザーにカレンダーの設定(CalendarPreference)があれば、
+    CalendarPreferenceMiddlewareがタイムゾーンと言語を有効にし、ここでfirst_weekdayを置き換えます。
+    今日の日付は、有効なタイムゾーンでの日付です。
+
+    """
     first_weekday = 0  # 0は月曜から、1は火曜から。6なら日曜日からになります。お望みなら、継承したビューで指定してください。
-    week_names = ['月', '火', '水', '木', '金', '土', '日']  # これは、月曜日から書くことを想定します。['Mon', 'Tue'...
+    week_names = None  # 月曜日から書いた曜日の名前。['Mon', 'Tue'...]。Noneなら、有効な言語の略称です(日本語なら'月', '火'...)
+    use_calendar_preference = True  # Falseにすると、ユーザーの設定のfirst_weekdayを使いません
+    _today = None
+
+    def setup(self, request, *args, **kwargs):
+        super().setup(request, *args, **kwargs)
+        preference = getattr(request, 'calendar_preference', None)
+        if self.use_calendar_preference and preference is not None and preference.first_weekday is not None:
+            self.first_weekday = preference.first_weekday
+
+    def get_today(self):
+        """今日の日付を返す。有効なタイムゾーンでの日付を、1つのリクエストで1回だけ求めます"""
+        if self._today is None:
+            self._today = timezone.localdate() if settings.USE_TZ else datetime.date.today()
+        return self._today
 
     def setup_calendar(self):
         """内部カレンダーの設定処理
@@ -17,14 +55,19 @@ class BaseCalendarMixin:
         Calendarクラスのmonthdatescalendarメソッドを利用していますが、デフォルトが月曜日からで、
         火曜日から表示したい(first_weekday=1)、といったケースに対応するためのセットアップ処理です。
 
+        グリッドの計算はgridモジュールがキャッシュ付きで行うため、各Mixinからは呼ばれなくなりました。
+        self._calendarを直接使いたい場合のために残しています。
+
         """
-        self._calendar = calendar.Calendar(self.first_weekday)
+        self._calendar = grid.get_calendar(self.first_weekday)
 
     def get_week_names(self):
         """first_weekday(最初に表示される曜日)にあわせて、week_namesをシフトする"""
-        week_names = deque(self.week_names)
-        week_names.rotate(-self.first_weekday)  # リスト内の要素を右に1つずつ移動...なんてときは、dequeを使うと中々面白いです
-        return week_names
+        if self.week_names is None:
+            week_names = grid.get_locale_week_names(translation.get_language())
+        else:
+            week_names = tuple(self.week_names)
+        return grid.get_week_names(week_names, self.first_weekday)
 
 
 class MonthCalendarMixin(BaseCalendarMixin):
@@ -46,7 +89,7 @@ class MonthCalendarMixin(BaseCalendarMixin):
 
     def get_month_days(self, date):
         """その月の全ての日を返す"""
-        return self._calendar.monthdatescalendar(date.year, date.month)
+        return grid.get_month_grid(date.year, date.month, self.first_weekday).weeks
 
     def get_current_month(self):
         """現在の月を返す"""
@@ -55,15 +98,20 @@ class MonthCalendarMixin(BaseCalendarMixin):
         if month and year:
             month = datetime.date(year=int(year), month=int(month), day=1)
         else:
-            month = datetime.date.today().replace(day=1)
+            month = self.get_today().replace(day=1)
         return month
 
+    def get_calendar_range(self):
+        """表示するカレンダーの、最初の日と最後の日を返す"""
+        days = self.get_month_days(self.get_current_month())
+        return days[0][0], days[-1][-1]
+
+    @instrumentation.timed('grid')
     def get_month_calendar(self):
         """月間カレンダー情報の入った辞書を返す"""
-        self.setup_calendar()
         current_month = self.get_current_month()
         calendar_data = {
-            'now': datetime.date.today(),
+            'now': self.get_today(),
             'month_days': self.get_month_days(current_month),
             'month_current': current_month,
             'month_previous': self.get_previous_month(current_month),
@@ -76,28 +124,35 @@ class MonthCalendarMixin(BaseCalendarMixin):
 class WeekCalendarMixin(BaseCalendarMixin):
     """週間カレンダーの機能を提供するMixin"""
 
-    def get_week_days(self):
-        """その週の日を全て返す"""
+    def get_current_day(self):
+        """現在の日を返す"""
         month = self.kwargs.get('month')
         year = self.kwargs.get('year')
         day = self.kwargs.get('day')
         if month and year and day:
-            date = datetime.date(year=int(year), month=int(month), day=int(day))
-        else:
-            date = datetime.date.today()
+            return datetime.date(year=int(year), month=int(month), day=int(day))
+        return self.get_today()
 
-        for week in self._calendar.monthdatescalendar(date.year, date.month):
-            if date in week:  # 週ごとに取り出され、中身は全てdatetime.date型。該当の日が含まれていれば、それが今回表示すべき週です
-                return week
+    def get_week_days(self):
+        """その週の日を全て返す"""
+        date = self.get_current_day()
+
+        # 該当の日を含む週を、キャッシュされたグリッドから辞書で引きます
+        return grid.get_week_days(date, self.first_weekday)
 
+    def get_calendar_range(self):
+        """表示するカレンダーの、最初の日と最後の日を返す"""
+        days = self.get_week_days()
+        return days[0], days[-1]
+
+    @instrumentation.timed('grid')
     def get_week_calendar(self):
         """週間カレンダー情報の入った辞書を返す"""
-        self.setup_calendar()
         days = self.get_week_days()
         first = days[0]
         last = days[-1]
         calendar_data = {
-            'now': datetime.date.today(),
+            'now': self.get_today(),
             'week_days': days,
             'week_previous': first - datetime.timedelta(days=7),
             'week_next': first + datetime.timedelta(days=7),
@@ -108,74 +163,1014 @@ class WeekCalendarMixin(BaseCalendarMixin):
         return calendar_data
 
 
-class WeekWithScheduleMixin(WeekCalendarMixin):
-    """スケジュール付きの、週間カレンダーを提供するMixin"""
+class ScheduleScopeMixin:
+    """スケジュールを、表示するカレンダーのものだけに絞り込むMixin
 
-    def get_week_schedules(self, start, end, days):
-        """それぞれの日とスケジュールを返す"""
+    calendar_fieldを指定すると、?calendar=1&calendar=2 のように選んだカレンダー(無ければ、見られる全てのカレンダー)の
+    スケジュールだけを、1回のクエリでまとめて取得します。
+    見られるのは、ログインしているユーザーが所有者のカレンダーと、所有者の無いカレンダーです。
+
+    """
+    calendar_field = None  # カレンダーのForeignKeyのフィールド名
+    calendar_owner_field = 'owner'  # カレンダーモデルの、所有者のフィールド名
+    calendar_query_param = 'calendar'  # 表示するカレンダーを選ぶ、GETパラメータの名前
+    no_calendar_message = 'スケジュールを入れられるカレンダーがありません'  # 見られるカレンダーが無い場合の、フォームのエラー
+    _calendar_ids = None
+    _default_calendar_id = None
+
+    def get_schedule_queryset(self):
+        """スケジュールを取得する、基本のQuerySetを返す。所有者などで絞り込む場合は、ここを変えてください"""
+        queryset = self.model.objects.all()
+        if self.calendar_field:
+            # 例えば、Schedule.objects.filter(calendar__in=[1, 2]) になる
+            queryset = queryset.filter(**{'{}__in'.format(self.calendar_field): self.get_calendar_ids()})
+        return queryset
+
+    def get_calendar_queryset(self):
+        """見られるカレンダーを返す"""
+        calendar_model = self.model._meta.get_field(self.calendar_field).related_model
+        shared = Q(**{'{}__isnull'.format(self.calendar_owner_field): True})
+        user = getattr(self.request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return calendar_model.objects.filter(shared | Q(**{self.calendar_owner_field: user}))
+        return calendar_model.objects.filter(shared)
+
+    def get_selected_calendar_queryset(self):
+        """見られるカレンダーのうち、GETパラメータで選ばれたもの(無ければ全て)を返す"""
+        queryset = self.get_calendar_queryset()
+        selected = [value for value in self.request.GET.getlist(self.calendar_query_param) if value.isdigit()]
+        if selected:
+            queryset = queryset.filter(pk__in=selected)
+        return queryset.values_list('pk', flat=True)
+
+    def get_calendar_ids(self):
+        """表示するカレンダーの、idのリストを返す。リクエスト毎に1回だけ取得します"""
+        if self._calendar_ids is None:
+            self._calendar_ids = sorted(self.get_selected_calendar_queryset())
+        return self._calendar_ids
+
+    def get_default_calendar_id(self):
+        """新しいスケジュールを入れるカレンダーのidを返す
+
+        表示しているカレンダーのうち、ログインしているユーザーが所有者のものの先頭です。
+        無ければ、表示しているカレンダー(全員が見られるカレンダーなど)の先頭です。
+
+        """
+        if not self.calendar_field:
+            return None
+        if self._default_calendar_id is None:
+            calendar_ids = self.get_calendar_ids()
+            user = getattr(self.request, 'user', None)
+            owned_id = None
+            if calendar_ids and user is not None and user.is_authenticated:
+                owned_id = self.get_calendar_queryset().filter(
+                    pk__in=calendar_ids, **{self.calendar_owner_field: user}
+                ).order_by('pk').values_list('pk', flat=True).first()
+            self._default_calendar_id = owned_id if owned_id is not None else next(iter(calendar_ids), None)
+        return self._default_calendar_id
+
+    def validate_default_calendar(self, forms):
+        """新しいスケジュールを入れるカレンダーが無ければ、formsにエラーを加えてFalseを返す
+
+        カレンダーは必須なので、見られるカレンダーが1つも無いまま保存すると、データベースのエラーになるためです。
+
+        """
+        if not self.calendar_field or self.get_default_calendar_id() is not None:
+            return True
+        for form in forms:
+            form.add_error(None, self.no_calendar_message)
+        return False
+
+    def get_schedule_cache_partitions(self):
+        """キャッシュのバージョンを持つ区画を返す。表示しているカレンダー毎の区画です"""
+        if not self.calendar_field:
+            return '',
+        return [cache.get_calendar_partition(calendar_id) for calendar_id in self.get_calendar_ids()]
+
+
+class BaseScheduleMixin(ScheduleScopeMixin):
+    """スケジュール関連Mixinの、基底クラス
+
+    継承したビューで、model(Scheduleモデル等)とdate_field(日付フィールド名)を指定してください。
+
+    """
+    time_field = 'start_time'  # 同じ日のスケジュールを並べる順番に使うフィールド。Noneなら日付順だけになります
+    use_schedule_cache = False  # Trueにすると、取得したスケジュールをDjangoのキャッシュに保存します
+    schedule_cache_kind = cache.MONTH  # キャッシュする単位。cache.MONTH(月毎)か、cache.WEEK(ISO週毎)
+    schedule_cache_timeout = 60 * 60 * 24  # 保存・削除時にシグナルで消されるので、長めで大丈夫です
+    schedule_fragment_template = None  # 指定すると、カレンダー部分をこのテンプレートで描画し、HTMLもキャッシュします
+    updated_field = None  # 更新日時のフィールド名(auto_now=Trueのもの)。ConditionalScheduleMixinで使います
+    max_schedules_per_day = None  # 指定すると、1日に表示するスケジュールをこの数までにし、残りは「+K件」と数だけ表示します
+    schedule_fields = None  # 指定すると、表示に使うフィールドだけを取得し、モデルではなく名前付きタプルで扱います
+    end_date_field = None  # 終了日のフィールド名。指定すると、複数日のスケジュールが、重なる全ての日に表示されます
+    max_schedule_days = None  # 複数日のスケジュールの最長の日数。Noneなら、settings.CALENDAR_MAX_SCHEDULE_DAYS(31日)です
+    recurrence_model = None  # RecurringScheduleを指定すると、繰り返しのスケジュールも、表示する期間の中だけ展開して表示します
+
+    def get_schedule_ordering(self):
+        """スケジュールの並び順を返す。(date, start_time)のインデックスをそのまま使える順番です"""
+        if self.time_field:
+            return self.date_field, self.time_field
+        return self.date_field,
+
+    def get_max_schedule_days(self):
+        """複数日のスケジュールの、最長の日数を返す"""
+        return self.max_schedule_days or get_max_schedule_days()
+
+    def get_schedules(self, start, end):
+        """start〜endのスケジュールを、日付・時間順に返す。end_date_fieldがあれば、start〜endと重なるスケジュールです"""
         lookup = {
             # '例えば、date__range: (1日, 31日)'を動的に作る
             '{}__range'.format(self.date_field): (start, end)
         }
-        # 例えば、Schedule.objects.filter(date__range=(1日, 31日)) になる
-        queryset = self.model.objects.filter(**lookup)
+        if self.end_date_field:
+            # end_date >= 1日 AND date BETWEEN (1日 - 最長の日数 + 1) AND 31日。
+            # 開始日の範囲が決まるので、(date, start_time)のインデックスで、期間の前後の数日分だけを読みます
+            lookup = {
+                '{}__gte'.format(self.end_date_field): start,
+                '{}__range'.format(self.date_field): (
+                    start - datetime.timedelta(days=self.get_max_schedule_days() - 1), end
+                ),
+            }
+        # 例えば、Schedule.objects.filter(date__range=(1日, 31日)).order_by('date', 'start_time') になる
+        return self.get_schedule_queryset().filter(**lookup).order_by(*self.get_schedule_ordering())
+
+    def get_display_schedules(self, start, end):
+        """カレンダーに表示する、start〜endのスケジュールを返す
+
+        max_schedules_per_dayがあれば、ウィンドウ関数でそれぞれの日の先頭からその数だけを取得します。
+        それぞれのスケジュールには、その日のスケジュールの全件数(day_count)が付きます。
+        schedule_fieldsがあれば、そのフィールドだけをvalues_list(named=True)で取得します。
+        descriptionのような大きなフィールドを読み込まず、モデルのインスタンスも作らないので、軽くなります。
+
+        """
+        queryset = self.get_schedules(start, end)
+        if self.max_schedules_per_day:
+            queryset = self.limit_schedules_per_day(queryset)
+        if self.schedule_fields:
+            queryset = queryset.values_list(*self.get_schedule_fields(), named=True)
+        return queryset
+
+    def get_schedule_fields(self):
+        """schedule_fieldsに、日付などの必要なフィールドを加えて返す"""
+        fields = list(self.schedule_fields)
+        for field in self.get_schedule_ordering() + (self.end_date_field,):
+            # 並べる順番のフィールドは、繰り返しのスケジュールを混ぜる際にも使います
+            if field and field not in fields:
+                fields.append(field)
+        if self.max_schedules_per_day:
+            fields.append('day_count')
+        return fields
+
+    def limit_schedules_per_day(self, queryset):
+        """それぞれの日の、先頭からmax_schedules_per_day件だけを取得するようにする
+
+        複数日のスケジュールは、開始日の順位に関わらず全て取得します。
+        開始日では表示しきれなくても、2日目以降の日には表示される(数えられる)ことがあるためです。
+        表示する数は、set_more_countsで、それぞれの日毎に切り詰めます。
+
+        """
+        # ROW_NUMBER() OVER (PARTITION BY date ORDER BY start_time, id) <= N と、COUNT(*) OVER (PARTITION BY date)
+        partition_by = [F(self.date_field)]
+        order_by = [F(field).asc() for field in self.get_schedule_ordering() if field != self.date_field]
+        order_by.append(F('pk').asc())
+        condition = Q(day_position__lte=self.max_schedules_per_day)
+        if self.end_date_field:
+            condition |= Q(**{'{}__gt'.format(self.end_date_field): F(self.date_field)})
+        return queryset.annotate(
+            day_position=Window(RowNumber(), partition_by=partition_by, order_by=order_by),
+            day_count=Window(Count('pk'), partition_by=partition_by),
+        ).filter(condition)
+
+    def bucket_schedules(self, weeks, schedules):
+        """スケジュールを、それぞれの日の枠に振り分ける。[{1日: 1日のスケジュール...}, {8日: ...}, ...]"""
+        get_end_date = self.get_schedule_end_date if self.end_date_field else None
+        week_day_schedules = grid.bucket_rows(weeks, schedules, self.get_schedule_date, get_end_date)
+        if self.max_schedules_per_day:
+            self.set_more_counts(week_day_schedules)
+        return week_day_schedules
+
+    def set_more_counts(self, week_day_schedules):
+        """それぞれの日の、表示しきれなかったスケジュールの数を、DaySchedules.moreに入れる
+
+        繰り返しのスケジュールの各回は、SQLでは数えられないので、ここで数えて、多ければ切り詰めます。
+        複数日のスケジュールは、SQLでは開始日で数えられるので、2日目以降の日ではここで数えます。
+        複数日のスケジュールは全て取得しているので、どの日でも、max_schedules_per_day件より多ければここで切り詰めます。
+
+        """
+        for day_schedules in week_day_schedules:
+            for day, schedules in day_schedules.items():
+                total = 0
+                day_count = None
+                for schedule in schedules:
+                    if self.is_occurrence(schedule) or self.get_schedule_date(schedule) != day:
+                        total += 1
+                    elif day_count is None:
+                        day_count = self.get_schedule_value(schedule, 'day_count')
+                        total += day_count
+                del schedules[self.max_schedules_per_day:]
+                schedules.more = total - len(schedules)
+
+    def get_schedule_value(self, schedule, name):
+        """スケジュールの、nameフィールドの値を返す"""
+        return getattr(schedule, name)
+
+    def get_schedule_date(self, schedule):
+        """スケジュールの日付を返す"""
+        return self.get_schedule_value(schedule, self.date_field)
+
+    def get_schedule_end_date(self, schedule):
+        """スケジュールの終了日を返す。end_date_fieldが無いか、空なら、日付と同じ日です"""
+        if self.end_date_field:
+            end_date = self.get_schedule_value(schedule, self.end_date_field)
+            if end_date is not None:
+                return end_date
+        return self.get_schedule_date(schedule)
+
+    def get_schedule_sort_key(self, schedule):
+        """スケジュールを並べる順番の、キーを返す"""
+        if self.time_field:
+            return self.get_schedule_date(schedule), self.get_schedule_value(schedule, self.time_field)
+        return self.get_schedule_date(schedule),
+
+    def get_recurrences(self, start, end):
+        """start〜endと重なる、繰り返しのスケジュールを返す。(開始日, 最後の日)のインデックスで絞り込めます"""
+        exception_model = self.recurrence_model._meta.get_field('exceptions').related_model
+        queryset = self.recurrence_model.objects.all()
+        if self.calendar_field:
+            queryset = queryset.filter(**{'{}__in'.format(self.calendar_field): self.get_calendar_ids()})
+        return queryset.filter(
+            Q(end_date__isnull=True) | Q(end_date__gte=start), start_date__lte=end,
+        ).prefetch_related(
+            Prefetch('exceptions', queryset=exception_model.objects.filter(date__range=(start, end)))
+        )
+
+    def make_occurrence(self, recurring_schedule, date):
+        """繰り返しのスケジュールの、date日の回を作る"""
+        return recurrence.Occurrence(recurring_schedule, date)
+
+    def is_occurrence(self, schedule):
+        """繰り返しのスケジュールの回ならTrue"""
+        return isinstance(schedule, recurrence.Occurrence)
+
+    def get_occurrences(self, start, end):
+        """start〜endの中にある、繰り返しのスケジュールの各回を、日付・時間順に返す"""
+        return self.expand_occurrences(self.get_recurrences(start, end), start, end)
+
+    def expand_occurrences(self, recurring_schedules, start, end):
+        """繰り返しのスケジュールを、start〜endの中の各回に展開し、日付・時間順に返す"""
+        occurrences = []
+        for recurring_schedule in recurring_schedules:
+            exceptions = {exception.date for exception in recurring_schedule.exceptions.all()}
+            occurrences.extend(
+                self.make_occurrence(recurring_schedule, date)
+                for date in recurrence.iter_occurrence_dates(recurring_schedule, start, end, exceptions)
+            )
+        occurrences.sort(key=self.get_schedule_sort_key)
+        return occurrences
+
+    def merge_occurrences(self, schedules, start, end):
+        """日付・時間順のschedulesに、繰り返しのスケジュールの各回を、順番を保ったまま混ぜる"""
+        if self.recurrence_model is None:
+            return schedules
+        return heapq.merge(schedules, self.get_occurrences(start, end), key=self.get_schedule_sort_key)
+
+    def get_schedule_validator(self, start, end):
+        """start〜endのスケジュールが変わったかを調べるための、(最後の更新日時, 件数)を返す
+
+        1回の集計クエリだけで済みます。スケジュールが削除された場合は、件数が変わります。
+
+        """
+        results = [self.get_schedules(start, end).order_by().aggregate(**self.get_validator_aggregates())]
+        if self.recurrence_model is not None:
+            results.append(self.get_recurrences(start, end).order_by().aggregate(**self.get_validator_aggregates()))
+        return self.combine_validators(results)
+
+    def get_validator_aggregates(self):
+        """get_schedule_validatorで集計する値"""
+        return {'last_modified': Max(self.updated_field), 'count': Count('pk')}
+
+    def combine_validators(self, results):
+        """スケジュールと繰り返しのスケジュールの集計結果を、1つの(最後の更新日時, 件数)にまとめる"""
+        last_modified = max(filter(None, [result['last_modified'] for result in results]), default=None)
+        return last_modified, sum(result['count'] for result in results)
+
+    def get_schedule_cache_scope(self):
+        """キャッシュのキーを分けるための文字列を返す。get_schedulesで絞り込み条件を追加したら、ここも変えてください"""
+        scope = []
+        if self.max_schedules_per_day:
+            scope.append('max{}'.format(self.max_schedules_per_day))
+        if self.schedule_fields:
+            scope.append('fields:{}'.format(','.join(self.schedule_fields)))
+        if self.calendar_field:
+            scope.append('calendars:{}'.format(','.join(str(pk) for pk in self.get_calendar_ids())))
+        return ':'.join(scope)
+
+    def fetch_schedules(self, start, end):
+        """カレンダーに表示する、start〜endのスケジュールを返す
+
+        use_schedule_cacheがTrueなら、キャッシュを使います。
+        繰り返しのスケジュールの各回は、キャッシュせずに毎回展開し、日付・時間順に混ぜます。
+
+        """
+        if not self.use_schedule_cache:
+            schedules = self.get_display_schedules(start, end)
+        else:
+            schedules = cache.get_rows(
+                self.model, self.schedule_cache_kind, start, end,
+                fetch=self.get_display_schedules,
+                get_date=self.get_schedule_date,
+                timeout=self.schedule_cache_timeout,
+                scope=self.get_schedule_cache_scope(),
+                get_end_date=self.get_schedule_end_date if self.end_date_field else None,
+                partitions=self.get_schedule_cache_partitions(),
+            )
+        return self.merge_occurrences(schedules, start, end)
+
+    def timed_fetch_schedules(self, start, end):
+        """fetch_schedulesの結果をリストにして返す。クエリは、ここで実行されます
+
+        取得にかかった時間・クエリ数・行数を、'query'として計測します。
+
+        """
+        with instrumentation.time_stage(self, 'query') as timing:
+            schedules = list(self.fetch_schedules(start, end))
+            timing.rows = len(schedules)
+        return schedules
+
+    def get_calendar_fragment(self, start, end, calendar_context, context_name, get_day_schedules):
+        """schedule_fragment_templateで描画した、カレンダー部分のHTMLを返す
+
+        キャッシュに無い場合だけ、get_day_schedules()でスケジュールを取得し、calendar_context[context_name]に入れて描画します。
+
+        """
+        if not self.use_schedule_cache:
+            calendar_context[context_name] = get_day_schedules()
+            return render_to_string(self.schedule_fragment_template, calendar_context, self.request)
+
+        key = self.get_calendar_fragment_key(start, end, calendar_context)
+        store = cache.get_cache()
+        html = store.get(key)
+        if html is None:
+            calendar_context[context_name] = get_day_schedules()
+            html = render_to_string(self.schedule_fragment_template, calendar_context, self.request)
+            store.set(key, str(html), self.schedule_cache_timeout)
+        return mark_safe(html)
+
+    def get_calendar_fragment_key(self, start, end, calendar_context):
+        """start〜endのカレンダー部分のHTMLの、キャッシュのキーを返す"""
+        return cache.get_fragment_key(
+            self.model, self.schedule_cache_kind, start, end,
+            self.schedule_fragment_template, calendar_context['now'], self.first_weekday,
+            calendar_context['week_names'], self.get_schedule_cache_scope(),
+            # 繰り返しのスケジュールは、どれか1つでも変われば、全てのHTMLを作り直します
+            self.recurrence_model and cache.get_model_version(self.recurrence_model),
+            partitions=self.get_schedule_cache_partitions(),
+        )
+
+
+class ConditionalScheduleMixin:
+    """スケジュールが変わっていなければ、カレンダーを作らずに304 Not Modifiedを返すMixin
+
+    スケジュール付きのMixinと一緒に使い、updated_fieldを指定してください。
+    表示する範囲のスケジュールの、最後の更新日時と件数、今日の日付からETagとLast-Modifiedを作ります。
+
+    """
+    representation_params = ('format',)  # 同じURLで、レスポンスの形式を変えるGETパラメータ(ETagに入れます)
+
+    @instrumentation.timed('validators')
+    def get_calendar_validators(self):
+        """(ETag, Last-Modifiedのタイムスタンプ)を返す"""
+        start, end = self.get_calendar_range()
+        last_modified, count = self.get_schedule_validator(start, end)
+        return self.make_calendar_validators(start, end, last_modified, count)
+
+    def make_calendar_validators(self, start, end, last_modified, count):
+        """start〜endのスケジュールの、最後の更新日時と件数から、(ETag, Last-Modifiedのタイムスタンプ)を作る"""
+        today = self.get_today()
+
+        # 今日の日付は強調表示されるので、日付が変われば内容も変わったことになります
+        today_start = datetime.datetime.combine(today, datetime.time.min)
+        if settings.USE_TZ:
+            today_start = timezone.make_aware(today_start)
+        if last_modified is None or last_modified < today_start:
+            last_modified = today_start
+
+        source = repr((
+            type(self).__qualname__, start, end, last_modified, count, today, self.first_weekday,
+            self.get_week_names(), self.get_schedule_cache_scope(), self.get_representation(),
+        ))
+        etag = quote_etag(hashlib.md5(source.encode()).hexdigest())
+        return etag, int(last_modified.timestamp())
+
+    def get_representation(self):
+        """レスポンスの形式を返す。JSONとNDJSONのように、同じURLの別の形式が、同じETagにならないようにします"""
+        return tuple(self.request.GET.get(name, '') for name in self.representation_params)
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+
+        etag, last_modified = self.get_calendar_validators()
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+        return self.set_validator_headers(response, etag, last_modified)
+
+    def set_validator_headers(self, response, etag, last_modified):
+        """レスポンスに、ETagとLast-Modifiedを付ける"""
+        if not response.has_header('ETag'):
+            response['ETag'] = etag
+        if not response.has_header('Last-Modified'):
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class ServerTimingMixin:
+    """カレンダーの各処理の時間を計測し、Server-Timingヘッダで返すMixin
+
+    一番左に継承してください。グリッド、スケジュールの取得(query)、振り分け(bucket)、フォームセット(forms)、
+    テンプレートの描画(render)、ビュー全体(view)の時間が、ブラウザの開発者ツールで見られます。
+    計測結果は、ヘッダを付けない場合もinstrumentation.stage_timedシグナルで送られます。
+
+    """
+    server_timing = None  # ヘッダを付けるか。Noneなら、settings.CALENDAR_SERVER_TIMING(省略時はDEBUG)に従います
+
+    def dispatch(self, request, *args, **kwargs):
+        self.stage_timings = []
+        if self.view_is_async:
+            return self.adispatch_timed(request, *args, **kwargs)
+        with instrumentation.time_stage(self, 'view'):
+            response = self.render_timed(super().dispatch(request, *args, **kwargs))
+        return self.set_server_timing_header(response)
+
+    async def adispatch_timed(self, request, *args, **kwargs):
+        with instrumentation.time_stage(self, 'view', count_queries=False):
+            response = self.render_timed(await super().dispatch(request, *args, **kwargs))
+        return self.set_server_timing_header(response)
+
+    def render_timed(self, response):
+        """TemplateResponseなら、ここで描画して時間を計測する"""
+        if hasattr(response, 'render') and not response.is_rendered:
+            with instrumentation.time_stage(self, 'render'):
+                response.render()
+        return response
+
+    def use_server_timing(self):
+        if self.server_timing is not None:
+            return self.server_timing
+        return getattr(settings, 'CALENDAR_SERVER_TIMING', settings.DEBUG)
+
+    def set_server_timing_header(self, response):
+        if self.use_server_timing() and self.stage_timings:
+            response['Server-Timing'] = instrumentation.get_server_timing(self.stage_timings)
+        return response
+
+
+class WeekWithScheduleMixin(BaseScheduleMixin, WeekCalendarMixin):
+    """スケジュール付きの、週間カレンダーを提供するMixin
+
+    prefetch_neighbour_weeksをTrueにすると、前週と次週のスケジュールも、その週と一緒に1回のクエリで取得します。
+    前週と次週の情報はweek_neighboursに入るので、ページを移動せずに、ブラウザ側で週を切り替えられます。
+    schedule_fragment_templateとuse_schedule_cacheを指定していれば、前週と次週のHTMLもキャッシュに入るので、
+    移動した先の週では、新しく隣になった週の分だけを取得・描画します。
+
+    """
+    schedule_cache_kind = cache.WEEK
+    prefetch_neighbour_weeks = False  # Trueにすると、前週と次週のスケジュールも取得し、week_neighboursに入れます
+
+    def use_neighbour_prefetch(self):
+        """前週と次週のスケジュールも取得するならTrue"""
+        return self.prefetch_neighbour_weeks
+
+    def get_calendar_range(self):
+        start, end = super().get_calendar_range()
+        if self.use_neighbour_prefetch():
+            # ETagなども、前週と次週のスケジュールを含めて計算します
+            return start - datetime.timedelta(days=7), end + datetime.timedelta(days=7)
+        return start, end
+
+    def get_week_schedules(self, start, end, days):
+        """それぞれの日とスケジュールを返す"""
+        schedules = self.timed_fetch_schedules(start, end)
 
         # {1日のdatetime: 1日のスケジュール全て, 2日のdatetime: 2日の全て...}のような辞書を作る
-        day_schedules = {day: [] for day in days}
-        for schedule in queryset:
-            schedule_date = getattr(schedule, self.date_field)
-            day_schedules[schedule_date].append(schedule)
-        return day_schedules
+        with instrumentation.time_stage(self, 'bucket'):
+            return self.bucket_schedules([days], schedules)[0]
+
+    def get_weeks_schedules(self, weeks):
+        """連続した週の、週毎のそれぞれの日とスケジュールのリストを返す。全ての週のスケジュールを、1回で取得します"""
+        schedules = self.timed_fetch_schedules(weeks[0][0], weeks[-1][-1])
+        with instrumentation.time_stage(self, 'bucket'):
+            return self.bucket_schedules(weeks, schedules)
+
+    def get_neighbour_weeks(self, calendar_context):
+        """前週と次週の、週間カレンダー情報の辞書を返す"""
+        neighbours = []
+        for date in (calendar_context['week_previous'], calendar_context['week_next']):
+            days = grid.get_week_days(date, self.first_weekday)
+            neighbours.append({
+                'week_days': days,
+                'week_previous': days[0] - datetime.timedelta(days=7),
+                'week_next': days[0] + datetime.timedelta(days=7),
+                'week_first': days[0],
+                'week_last': days[-1],
+            })
+        return neighbours
+
+    def set_week_fragments(self, calendar_context, week_contexts):
+        """連続した週のそれぞれに、schedule_fragment_templateで描画したHTML(calendar_fragment)を入れる
+
+        キャッシュに無い週の分だけ、スケジュールを1回で取得して描画し、まとめてキャッシュに入れます。
+
+        """
+        keys = [None] * len(week_contexts)
+        fragments = {}
+        if self.use_schedule_cache:
+            keys = [
+                self.get_calendar_fragment_key(week_context['week_first'], week_context['week_last'], calendar_context)
+                for week_context in week_contexts
+            ]
+            fragments = cache.get_cache().get_many(keys)
+
+        missing = [index for index, key in enumerate(keys) if key not in fragments]
+        if missing:
+            # 無い週の間の週も含め、連続した範囲を1回で取得します
+            first, last = missing[0], missing[-1]
+            weeks_day_schedules = self.get_weeks_schedules(
+                [week_context['week_days'] for week_context in week_contexts[first:last + 1]]
+            )
+            rendered = {}
+            for index in missing:
+                week_context = week_contexts[index]
+                week_context['week_day_schedules'] = weeks_day_schedules[index - first]
+                html = render_to_string(
+                    self.schedule_fragment_template, dict(calendar_context, **week_context), self.request
+                )
+                fragments[keys[index]] = rendered[keys[index]] = str(html)
+            if self.use_schedule_cache:
+                cache.get_cache().set_many(rendered, self.schedule_cache_timeout)
+
+        for week_context, key in zip(week_contexts, keys):
+            week_context['calendar_fragment'] = mark_safe(fragments[key])
+
+    def set_neighbour_weeks(self, calendar_context, weeks_day_schedules=None):
+        """前週・その週・次週のスケジュールを取得し、前週と次週の情報をweek_neighboursに入れる
+
+        非同期版では、取得済みの3週分のスケジュールを、weeks_day_schedulesで渡します。
+
+        """
+        previous, following = self.get_neighbour_weeks(calendar_context)
+        week_contexts = [previous, calendar_context, following]
+        if self.schedule_fragment_template:
+            self.set_week_fragments(calendar_context, week_contexts)
+        else:
+            if weeks_day_schedules is None:
+                weeks_day_schedules = self.get_weeks_schedules(
+                    [week_context['week_days'] for week_context in week_contexts]
+                )
+            for week_context, day_schedules in zip(week_contexts, weeks_day_schedules):
+                week_context['week_day_schedules'] = day_schedules
+        calendar_context['week_neighbours'] = [previous, following]
+        return calendar_context
 
     def get_week_calendar(self):
         calendar_context = super().get_week_calendar()
-        calendar_context['week_day_schedules'] = self.get_week_schedules(
-            calendar_context['week_first'],
-            calendar_context['week_last'],
-            calendar_context['week_days']
-        )
+        if self.use_neighbour_prefetch():
+            return self.set_neighbour_weeks(calendar_context)
+        week_first = calendar_context['week_first']
+        week_last = calendar_context['week_last']
+        week_days = calendar_context['week_days']
+        if self.schedule_fragment_template:
+            # スケジュールの取得と描画は、キャッシュに無い場合だけ行われます
+            calendar_context['calendar_fragment'] = self.get_calendar_fragment(
+                week_first, week_last, calendar_context, 'week_day_schedules',
+                lambda: self.get_week_schedules(week_first, week_last, week_days)
+            )
+        else:
+            calendar_context['week_day_schedules'] = self.get_week_schedules(week_first, week_last, week_days)
         return calendar_context
 
 
-class MonthWithScheduleMixin(MonthCalendarMixin):
+class ScheduleFragmentMixin(WeekWithScheduleMixin):
+    """1日のセル(<td>)や、1週間の行(<tr>)だけを描画して返すMixin
+
+    htmxなどで、スケジュールを保存した後にページ全体を描画し直さず、変わった日のセルだけを入れ替えるのに使います。
+    スケジュールは、描画する日の分だけを取得します。
+
+    """
+    day_fragment_template = 'app/includes/day_schedules.html'  # 1日のセル
+    week_fragment_template = 'app/includes/week_schedules.html'  # 1週間の行
+
+    def is_fragment_request(self):
+        """htmxからのリクエストならTrue"""
+        return self.request.headers.get('HX-Request') == 'true'
+
+    def get_fragment_days(self, instance):
+        """保存したスケジュールで、描画し直す日を返す。複数日のスケジュールなら、開始日を含む週の全ての日です"""
+        date = self.get_schedule_date(instance)
+        if self.get_schedule_end_date(instance) > date:
+            return grid.get_week_days(date, self.first_weekday)
+        return [date]
+
+    def get_fragment_context(self, days, day_schedules):
+        """セルや行の描画に使うコンテキストを返す"""
+        if len(days) == 1:
+            return {'day': days[0], 'schedules': day_schedules[days[0]]}
+        return {'week_first': days[0], 'week_day_schedules': day_schedules}
+
+    def render_schedules_fragment(self, days, day_schedules):
+        """1日ならセル、複数の日なら行を描画して返す。HX-Retargetで、入れ替える要素もhtmxに伝えます"""
+        if len(days) == 1:
+            template_name = self.day_fragment_template
+            target = '#schedules-{:%Y-%m-%d}'.format(days[0])
+        else:
+            template_name = self.week_fragment_template
+            target = '#week-schedules-{:%Y-%m-%d}'.format(days[0])
+        with instrumentation.time_stage(self, 'render'):
+            html = render_to_string(template_name, self.get_fragment_context(days, day_schedules), self.request)
+        response = HttpResponse(html)
+        response['HX-Retarget'] = target
+        response['HX-Reswap'] = 'outerHTML'
+        return response
+
+    def render_days_fragment(self, days):
+        """daysのスケジュールを取得し、セルか行を描画して返す"""
+        return self.render_schedules_fragment(days, self.get_week_schedules(days[0], days[-1], days))
+
+    def render_saved_fragment(self, instance):
+        """保存したスケジュールの日のセルか週の行を描画して返す。フォームの入力欄を空にするイベントも送ります"""
+        response = self.render_days_fragment(self.get_fragment_days(instance))
+        response['HX-Trigger'] = 'schedule-saved'
+        return response
+
+    def render_form_fragment(self, template_name, context):
+        """エラーのあるフォームだけを描画し、ページのフォーム(#schedule-form)と入れ替えるようにして返す"""
+        response = HttpResponse(render_to_string(template_name, context, self.request))
+        response['HX-Retarget'] = '#schedule-form'
+        response['HX-Reswap'] = 'outerHTML'
+        return response
+
+
+class MonthWithScheduleMixin(BaseScheduleMixin, MonthCalendarMixin):
     """スケジュール付きの、月間カレンダーを提供するMixin"""
 
     def get_month_schedules(self, start, end, days):
         """それぞれの日とスケジュールを返す"""
-        lookup = {
-            # '例えば、date__range: (1日, 31日)'を動的に作る
-            '{}__range'.format(self.date_field): (start, end)
-        }
-        # 例えば、Schedule.objects.filter(date__range=(1日, 31日)) になる
-        queryset = self.model.objects.filter(**lookup)
+        schedules = self.timed_fetch_schedules(start, end)
 
-        # {1日のdatetime: 1日のスケジュール全て, 2日のdatetime: 2日の全て...}のような辞書を作る
-        day_schedules = {day: [] for week in days for day in week}
-        for schedule in queryset:
-            schedule_date = getattr(schedule, self.date_field)
-            day_schedules[schedule_date].append(schedule)
-
-        # day_schedules辞書を、周毎に分割する。[{1日: 1日のスケジュール...}, {8日: 8日のスケジュール...}, ...]
-        # 7個ずつ取り出して分割しています。
-        size = len(day_schedules)
-        return [{key: day_schedules[key] for key in itertools.islice(day_schedules, i, i+7)} for i in range(0, size, 7)]
+        # 週毎に、{1日のdatetime: 1日のスケジュール全て, 2日のdatetime: 2日の全て...}のような辞書を作る
+        # [{1日: 1日のスケジュール...}, {8日: 8日のスケジュール...}, ...]
+        with instrumentation.time_stage(self, 'bucket'):
+            return self.bucket_schedules(days, schedules)
 
     def get_month_calendar(self):
         calendar_context = super().get_month_calendar()
         month_days = calendar_context['month_days']
         month_first = month_days[0][0]
         month_last = month_days[-1][-1]
-        calendar_context['month_day_schedules'] = self.get_month_schedules(
-            month_first,
-            month_last,
-            month_days
-        )
+        if self.schedule_fragment_template:
+            # スケジュールの取得と描画は、キャッシュに無い場合だけ行われます
+            calendar_context['calendar_fragment'] = self.get_calendar_fragment(
+                month_first, month_last, calendar_context, 'month_day_schedules',
+                lambda: self.get_month_schedules(month_first, month_last, month_days)
+            )
+        else:
+            calendar_context['month_day_schedules'] = self.get_month_schedules(
+                month_first,
+                month_last,
+                month_days
+            )
         return calendar_context
 
 
-class MonthWithFormsMixin(MonthCalendarMixin):
+class MonthWeekWithScheduleMixin(MonthCalendarMixin, WeekWithScheduleMixin):
+    """月間カレンダーと、スケジュール付きの週間カレンダーを、まとめて提供するMixin
+
+    get_month_calendarとget_week_calendarを別々に呼ぶと、今日の日付やグリッドをそれぞれで計算してしまいます。
+    get_month_week_calendarは、月のグリッドを1回だけ計算し、週はそのグリッドから取り出します。
+    スケジュールも、表示する範囲をまとめて1回で取得し、両方で共有します。
+
+    """
+    month_with_schedules = False  # Trueにすると、月間カレンダーにもスケジュールを付けます(month_day_schedules)
+
+    def get_month_week_calendar(self):
+        """月間カレンダーと週間カレンダー情報の入った辞書を返す"""
+        calendar_data = self.get_month_week_days()
+        start, end = self.get_month_week_range(calendar_data)
+        self.set_month_week_schedules(calendar_data, self.timed_fetch_schedules(start, end))
+        return calendar_data
+
+    @instrumentation.timed('grid')
+    def get_month_week_days(self):
+        """スケジュール以外の、月間カレンダーと週間カレンダー情報の入った辞書を返す"""
+        day = self.get_current_day()
+        current_month = day.replace(day=1)
+        month_grid = grid.get_month_grid(day.year, day.month, self.first_weekday)
+        week_days = month_grid.get_week(day)  # 表示する週は、必ずその月のグリッドに含まれています
+        week_first = week_days[0]
+        week_last = week_days[-1]
+        calendar_data = {
+            'now': self.get_today(),
+            'week_names': self.get_week_names(),
+            'month_days': month_grid.weeks,
+            'month_current': current_month,
+            'month_previous': self.get_previous_month(current_month),
+            'month_next': self.get_next_month(current_month),
+            'week_days': week_days,
+            'week_previous': week_first - datetime.timedelta(days=7),
+            'week_next': week_first + datetime.timedelta(days=7),
+            'week_first': week_first,
+            'week_last': week_last,
+        }
+        return calendar_data
+
+    def get_month_week_range(self, calendar_data):
+        """スケジュールを取得する範囲を返す
+
+        週は月のグリッドに含まれるので、月間カレンダーにもスケジュールを付けるなら、月の範囲だけを取得すれば十分です。
+
+        """
+        if self.month_with_schedules:
+            month_days = calendar_data['month_days']
+            return month_days[0][0], month_days[-1][-1]
+        return calendar_data['week_first'], calendar_data['week_last']
+
+    @instrumentation.timed('bucket')
+    def set_month_week_schedules(self, calendar_data, schedules):
+        """取得したスケジュールを、それぞれの日に振り分けてcalendar_dataに入れる"""
+        if self.month_with_schedules:
+            schedules = list(schedules)
+            calendar_data['month_day_schedules'] = self.bucket_schedules(calendar_data['month_days'], schedules)
+        calendar_data['week_day_schedules'] = self.bucket_schedules([calendar_data['week_days']], schedules)[0]
+
+
+class RangeCalendarMixin(BaseScheduleMixin, MonthCalendarMixin):
+    """四半期や1年など、任意の期間のスケジュール付きカレンダーを、月毎に提供するMixin
+
+    期間は、URLのyear(その年の1年間)か、?start=2019-01-01&end=2019-03-31 で指定します。
+    スケジュールは、期間全体を1回のクエリで少しずつ読み込みながら、それぞれの月の枠に振り分けます。
+
+    """
+    range_chunk_size = 2000  # データベースから一度に読み込む行数
+    max_range_days = 366 * 2  # 指定できる期間の最大の日数
+
+    def get_range(self):
+        """表示する期間の、最初の日と最後の日を返す"""
+        year = self.kwargs.get('year')
+        if year:
+            return datetime.date(int(year), 1, 1), datetime.date(int(year), 12, 31)
+
+        if 'start' not in self.request.GET and 'end' not in self.request.GET:
+            today = self.get_today()
+            return datetime.date(today.year, 1, 1), datetime.date(today.year, 12, 31)
+
+        try:
+            start = parse_date(self.request.GET.get('start', ''))
+            end = parse_date(self.request.GET.get('end', ''))
+        except ValueError:
+            start = end = None
+        if start is None or end is None or start > end:
+            raise Http404('start、endには、YYYY-MM-DD形式の日付を指定してください')
+        if (end - start).days >= self.max_range_days:
+            raise Http404('期間は{}日以内にしてください'.format(self.max_range_days))
+        return start, end
+
+    def get_range_months(self, start, end):
+        """期間に含まれる、全ての月(の1日)を返す"""
+        months = []
+        month = start.replace(day=1)
+        while month <= end:
+            months.append(month)
+            month = self.get_next_month(month)
+        return months
+
+    @instrumentation.timed('schedules')
+    def get_range_schedules(self, start, end, months):
+        """月毎に、[{1日: 1日のスケジュール...}, {8日: 8日のスケジュール...}, ...]を作り、そのリストを返す
+
+        それぞれのスケジュールは、その日が属する月のカレンダーにだけ入ります。
+        前後の月の日は、その月のカレンダーで表示されるためです。
+
+        """
+        grids = {
+            (month.year, month.month): grid.get_month_grid(month.year, month.month, self.first_weekday)
+            for month in months
+        }
+        slots = {
+            key: [[grid.DaySchedules() for day in week] for week in month_grid.weeks]
+            for key, month_grid in grids.items()
+        }
+
+        if self.use_schedule_cache:
+            schedules = self.fetch_schedules(start, end)
+        else:
+            schedules = self.get_display_schedules(start, end).iterator(chunk_size=self.range_chunk_size)
+            schedules = self.merge_occurrences(schedules, start, end)
+        for schedule in schedules:
+            schedule_start = self.get_schedule_date(schedule)
+            schedule_end = self.get_schedule_end_date(schedule)
+            for date in grid.iter_days(max(schedule_start, start), min(schedule_end, end)):
+                key = date.year, date.month
+                week_index, day_index = grids[key].positions[date]
+                slots[key][week_index][day_index].append(schedule)
+
+        month_schedules = [
+            [dict(zip(week, week_slots)) for week, week_slots in zip(grids[key].weeks, slots[key])]
+            for key in grids
+        ]
+        if self.max_schedules_per_day:
+            for week_day_schedules in month_schedules:
+                self.set_more_counts(week_day_schedules)
+        return month_schedules
+
+    def get_range_calendar(self):
+        """期間のカレンダー情報の入った辞書を返す"""
+        start, end = self.get_range()
+        months = self.get_range_months(start, end)
+        month_schedules = self.get_range_schedules(start, end, months)
+        calendar_data = {
+            'now': self.get_today(),
+            'week_names': self.get_week_names(),
+            'range_start': start,
+            'range_end': end,
+            'range_months': [
+                {'month_current': month, 'month_day_schedules': day_schedules}
+                for month, day_schedules in zip(months, month_schedules)
+            ],
+        }
+        if (start.month, start.day, end.month, end.day) == (1, 1, 12, 31) and start.year == end.year:
+            calendar_data['year_previous'] = start.year - 1
+            calendar_data['year_next'] = start.year + 1
+        return calendar_data
+
+
+class YearHeatmapMixin(ScheduleScopeMixin, MonthCalendarMixin):
+    """1年間の、日毎のスケジュールの件数をヒートマップで提供するMixin
+
+    modelには、Scheduleではなく日毎の件数の集計表(DailyScheduleStats)を指定してください。
+    集計表だけを読むので、スケジュールが何件あっても、読み込むのは(カレンダーの数×365)行までです。
+    年は、URLのyearで指定します。無ければ今年です。
+
+    """
+    date_field = 'date'
+    count_field = 'count'  # 件数のフィールド名
+    heatmap_levels = 4  # 色の濃さの段階。件数は、一番多い日を基準に1〜heatmap_levelsの段階になります(0件は0)
+
+    def get_year(self):
+        """表示する年を返す"""
+        year = self.kwargs.get('year')
+        if year:
+            return int(year)
+        return self.get_today().year
+
+    def get_day_counts(self, start, end):
+        """{日付: 件数} の辞書を返す。複数のカレンダーを表示する場合は、その合計です"""
+        queryset = self.get_schedule_queryset().filter(**{'{}__range'.format(self.date_field): (start, end)})
+        # GROUP BY dateで、カレンダー毎の行を1日1行にします
+        return dict(
+            queryset.order_by().values(self.date_field).annotate(total=Sum(self.count_field))
+            .values_list(self.date_field, 'total')
+        )
+
+    def get_level(self, count, max_count):
+        """件数の、色の濃さの段階を返す"""
+        if not count:
+            return 0
+        return max(1, -(-count * self.heatmap_levels // max_count))  # 切り上げ
+
+    @instrumentation.timed('heatmap')
+    def get_year_heatmap(self):
+        """年間のヒートマップの情報が入った辞書を返す"""
+        year = self.get_year()
+        start, end = datetime.date(year, 1, 1), datetime.date(year, 12, 31)
+        day_counts = self.get_day_counts(start, end)
+        max_count = max(day_counts.values(), default=0)
+
+        months = []
+        for month in range(1, 13):
+            month_grid = grid.get_month_grid(year, month, self.first_weekday)
+            months.append({
+                'month_current': datetime.date(year, month, 1),
+                # [[(日付, 件数, 段階), ...], ...]。前後の月の日は、件数をNoneにします
+                'month_day_counts': [
+                    [
+                        (day, day_counts.get(day, 0), self.get_level(day_counts.get(day, 0), max_count))
+                        if day.month == month else (day, None, 0)
+                        for day in week
+                    ]
+                    for week in month_grid.weeks
+                ],
+            })
+        return {
+            'now': self.get_today(),
+            'week_names': self.get_week_names(),
+            'year_current': year,
+            'year_previous': year - 1,
+            'year_next': year + 1,
+            'heatmap_months': months,
+            'heatmap_total': sum(day_counts.values()),
+            'heatmap_max': max_count,
+            'heatmap_levels': range(self.heatmap_levels + 1),
+        }
+
+
+class ScheduleSearchMixin(ScheduleScopeMixin):
+    """スケジュールを、概要や詳細な説明から検索するMixin
+
+    ?q=会議&start=2019-01-01&end=2019-12-31 のように、言葉(空白区切りで全てを含むもの)と、開始日の期間で検索します。
+    結果は日付・id順で、search_paginate_by件ずつ返します。次のページは、前のページの最後の(日付, id)より後の行を、
+    ?after=2019-01-05.123 で取得します(キーセット・ページネーション)。
+    OFFSETと違い、読み飛ばす行を数えないので、何ページ目でも同じ速さです。
+
+    """
+    date_field = 'date'
+    search_fields = search.SCHEDULE_FIELDS  # 検索するフィールド
+    search_query_param = 'q'
+    search_cursor_param = 'after'
+    search_paginate_by = 50
+
+    def get_search_text(self):
+        """検索する言葉を返す"""
+        return self.request.GET.get(self.search_query_param, '').strip()
+
+    def get_search_range(self):
+        """検索する期間の(最初の日, 最後の日)を返す。指定されていなければNoneです"""
+        dates = []
+        for name in ('start', 'end'):
+            try:
+                dates.append(parse_date(self.request.GET.get(name, '')))
+            except ValueError:
+                dates.append(None)
+        return tuple(dates)
+
+    def get_search_cursor(self):
+        """?after=2019-01-05.123 の、(日付, id)を返す。無いか、正しくなければNone"""
+        date, _, pk = self.request.GET.get(self.search_cursor_param, '').partition('.')
+        try:
+            date = parse_date(date)
+        except ValueError:
+            return None
+        if date is None or not pk.isdigit():
+            return None
+        return date, int(pk)
+
+    def make_search_cursor(self, schedule):
+        """スケジュールの、次のページを取得するための値を返す"""
+        if isinstance(schedule, dict):
+            return '{}.{}'.format(schedule[self.date_field].isoformat(), schedule['id'])
+        return '{}.{}'.format(getattr(schedule, self.date_field).isoformat(), schedule.pk)
+
+    def get_search_queryset(self, text, start=None, end=None, cursor=None):
+        """検索結果の、日付・id順のQuerySetを返す"""
+        queryset = search.filter_queryset(self.get_schedule_queryset(), text, self.search_fields)
+        if start is not None:
+            queryset = queryset.filter(**{'{}__gte'.format(self.date_field): start})
+        if end is not None:
+            queryset = queryset.filter(**{'{}__lte'.format(self.date_field): end})
+        if cursor is not None:
+            # (date, id) > (前のページの最後の日付, id)
+            date, pk = cursor
+            queryset = queryset.filter(
+                Q(**{'{}__gt'.format(self.date_field): date}) | Q(**{self.date_field: date, 'pk__gt': pk})
+            )
+        return queryset.order_by(self.date_field, 'pk')
+
+    @instrumentation.timed('search')
+    def search_schedules(self, text, start=None, end=None, cursor=None):
+        """(1ページ分の検索結果のリスト, 次のページのafterの値)を返す。次のページが無ければNoneです"""
+        queryset = self.get_search_queryset(text, start, end, cursor)
+        # 1件多く取得して、次のページがあるかを調べます
+        schedules = list(queryset[:self.search_paginate_by + 1])
+        if len(schedules) <= self.search_paginate_by:
+            return schedules, None
+        schedules = schedules[:self.search_paginate_by]
+        return schedules, self.make_search_cursor(schedules[-1])
+
+    def get_search_results(self):
+        """検索結果の入った辞書を返す。言葉が無ければ、検索しません"""
+        text = self.get_search_text()
+        start, end = self.get_search_range()
+        schedules, next_cursor = [], None
+        if text:
+            schedules, next_cursor = self.search_schedules(text, start, end, self.get_search_cursor())
+        return {
+            'search_text': text,
+            'search_start': start,
+            'search_end': end,
+            'search_schedules': schedules,
+            'search_next': next_cursor,
+        }
+
+
+class MonthWithFormsMixin(ScheduleScopeMixin, MonthCalendarMixin):
     """スケジュール付きの、月間カレンダーを提供するMixin"""
+    formset_bulk_save = False  # Trueにすると、save_month_formsetがbulk_create・bulk_updateでまとめて保存します
+    end_date_field = None  # 終了日のフィールド名。指定すると、保存時に複数日のスケジュールの全ての日のキャッシュを消します
+    lazy_forms = False  # Trueにすると、GETでは新規作成用のフォームを1つだけ描画し、各日で使い回します
+    version_field = None  # バージョンのフィールド名。指定すると、他の人が変更したスケジュールを上書きせず、ScheduleConflictにします
+    version_batch_size = 100  # バージョンを調べるUPDATEの、1回のWHEREに入れるインスタンスの数
 
+    @instrumentation.timed('forms')
     def get_month_forms(self, start, end, days):
         """それぞれの日と紐づくフォームを作成する"""
         lookup = {
@@ -183,9 +1178,10 @@ class MonthWithFormsMixin(MonthCalendarMixin):
             '{}__range'.format(self.date_field): (start, end)
         }
         # 例えば、Schedule.objects.filter(date__range=(1日, 31日)) になる
-        queryset = self.model.objects.filter(**lookup)
+        queryset = self.get_schedule_queryset().filter(**lookup)
         days_count = sum(len(week) for week in days)
-        FormClass = forms.modelformset_factory(self.model, self.form_class, extra=days_count)
+        formset_class = LazyExtraModelFormSet if self.lazy_forms else forms.BaseModelFormSet
+        FormClass = forms.modelformset_factory(self.model, self.form_class, formset=formset_class, extra=days_count)
         if self.request.method == 'POST':
             formset = self.month_formset = FormClass(self.request.POST, queryset=queryset)
         else:
@@ -195,9 +1191,18 @@ class MonthWithFormsMixin(MonthCalendarMixin):
         day_forms = {day: [] for week in days for day in week}
 
         # 各日に、新規作成用フォームを1つずつ配置
-        for empty_form, (date, empty_list) in zip(formset.extra_forms, day_forms.items()):
-            empty_form.initial = {self.date_field: date}
-            empty_list.append(empty_form)
+        if self.lazy_forms and not formset.is_bound:
+            # empty_formを1回だけ描画し、そのHTMLの番号と日付だけを置き換えて使い回します
+            prototype = formset.empty_form
+            prototype.initial = {self.date_field: LazyDayForm.value_placeholder}
+            prototype_html = prototype.as_p()
+            initial_count = formset.initial_form_count()
+            for i, (date, empty_list) in enumerate(day_forms.items()):
+                empty_list.append(LazyDayForm(prototype_html, initial_count + i, date.isoformat()))
+        else:
+            for empty_form, (date, empty_list) in zip(formset.extra_forms, day_forms.items()):
+                empty_form.initial = {self.date_field: date}
+                empty_list.append(empty_form)
 
         # スケジュールがある各日に、そのスケジュールの更新用フォームを配置
         for bound_form in formset.initial_forms:
@@ -205,9 +1210,8 @@ class MonthWithFormsMixin(MonthCalendarMixin):
             date = getattr(instance, self.date_field)
             day_forms[date].append(bound_form)
 
-        # day_forms辞書を、周毎に分割する。[{1日: 1日のフォーム...}, {8日: 8日のフォーム...}, ...]
-        # 7個ずつ取り出して分割しています。
-        return [{key: day_forms[key] for key in itertools.islice(day_forms, i, i+7)} for i in range(0, days_count, 7)]
+        # day_forms辞書を、週毎に分割する。[{1日: 1日のフォーム...}, {8日: 8日のフォーム...}, ...]
+        return [{day: day_forms[day] for day in week} for week in days]
 
     def get_month_calendar(self):
         calendar_context = super().get_month_calendar()
@@ -221,3 +1225,447 @@ class MonthWithFormsMixin(MonthCalendarMixin):
         )
         calendar_context['month_formset'] = self.month_formset
         return calendar_context
+
+    def save_month_formset(self, formset):
+        """検証済みのフォームセットを保存し、保存したインスタンスのリストを返す
+
+        formset_bulk_saveがTrueなら、新規作成はbulk_createで、更新はbulk_updateで、1つのトランザクション内でまとめて保存します。
+        どちらの場合も、変更されていないフォームは保存されません。
+        calendar_fieldがあれば、新しいスケジュールは、表示しているカレンダーの先頭に入ります。
+
+        読み込んだ後に他で変更されたスケジュールがあれば、何も保存せずに、それら全てを入れたScheduleConflictを送出します。
+        formset_bulk_saveがTrueならversion_fieldで調べ、Falseならモデルのsave()(Schedule.save)が調べます。
+
+        """
+        # commit=Falseなら、変更のあったフォームのインスタンスが作られるだけで、保存はされません
+        instances = formset.save(commit=False)
+        if self.calendar_field:
+            calendar_attname = self.model._meta.get_field(self.calendar_field).attname
+            calendar_id = self.get_default_calendar_id()
+            for instance in formset.new_objects:
+                setattr(instance, calendar_attname, calendar_id)
+        try:
+            if not self.formset_bulk_save:
+                return self.save_month_instances(instances)
+            return self.bulk_save_month_formset(formset)
+        except ScheduleConflict:
+            # 元に戻した新規作成のインスタンスに、pkが残らないようにします
+            for instance in formset.new_objects:
+                instance.pk = None
+                instance._state.adding = True
+            raise
+
+    def save_month_instances(self, instances):
+        """インスタンスを1つずつsave()する。他で変更されたものが1つでもあれば、全てを元に戻してScheduleConflictを送出します"""
+        conflicts = []
+        with transaction.atomic():
+            for instance in instances:
+                try:
+                    instance.save()
+                except ScheduleConflict as e:
+                    conflicts += e.instances
+            if conflicts:
+                raise ScheduleConflict(conflicts)
+        return instances
+
+    def bulk_save_month_formset(self, formset):
+        """フォームセットのインスタンスを、bulk_createとbulk_updateでまとめて保存する"""
+
+        new_objects = formset.new_objects
+        changed_objects = [instance for instance, changed_fields in formset.changed_objects]
+        update_fields = {field for instance, changed_fields in formset.changed_objects for field in changed_fields}
+
+        # bulk_updateでは、auto_now=Trueのフィールド(更新日時など)が更新されないので、自分で更新します
+        for field in self.model._meta.concrete_fields:
+            if changed_objects and getattr(field, 'auto_now', False):
+                for instance in changed_objects:
+                    field.pre_save(instance, add=False)
+                update_fields.add(field.name)
+        with transaction.atomic():
+            if changed_objects and self.version_field:
+                # 何かを保存する前に調べるので、衝突すれば、何も保存されません
+                self.bump_versions(changed_objects)
+            previous = {}
+            if changed_objects and bulk_saved.has_listeners(self.model):
+                previous = self.get_previous_instances(changed_objects)
+            if new_objects:
+                self.model.objects.bulk_create(new_objects)
+            if changed_objects:
+                self.model.objects.bulk_update(changed_objects, update_fields)
+            # 日毎の件数などを更新するためのシグナルです
+            bulk_saved.send(sender=self.model, created=new_objects, updated=changed_objects, previous=previous)
+
+            # bulk_createやbulk_updateではシグナルが送られないので、キャッシュは自分で消します
+            spans = [self.get_instance_span(instance) for instance in new_objects + changed_objects]
+            spans += [
+                (form.initial.get(self.date_field), form.initial.get(self.date_field))
+                for form in formset.initial_forms if form.has_changed()
+            ]
+            partitions = self.get_instance_partitions(new_objects + changed_objects)
+            transaction.on_commit(lambda: cache.evict_spans(self.model, spans, partitions))
+        return new_objects + changed_objects
+
+    def bump_versions(self, instances):
+        """インスタンスのバージョンが読み込んだ時のままなら、1つ増やす。トランザクションの中で呼んでください
+
+        (pk, バージョン)の組をUPDATEのWHEREで調べるので、同時に保存しても、先にUPDATEした方だけが成功します。
+        全て成功すれば、version_batch_size件毎に1回のUPDATEで済みます。
+        数が合わなければ、まとめたUPDATEを元に戻し、1件ずつUPDATEして、他で変更・削除された全てのインスタンスを調べます。
+
+        """
+        version_field = self.version_field
+        manager = self.model._base_manager
+
+        def bump(batch):
+            condition = Q()
+            for instance in batch:
+                condition |= Q(pk=instance.pk, **{version_field: getattr(instance, version_field)})
+            return manager.filter(condition).update(**{version_field: F(version_field) + 1})
+
+        savepoint = transaction.savepoint()
+        updated = sum(
+            bump(instances[offset:offset + self.version_batch_size])
+            for offset in range(0, len(instances), self.version_batch_size)
+        )
+        if updated != len(instances):
+            transaction.savepoint_rollback(savepoint)
+            raise ScheduleConflict([instance for instance in instances if not bump([instance])])
+        transaction.savepoint_commit(savepoint)
+        for instance in instances:
+            setattr(instance, version_field, getattr(instance, version_field) + 1)
+
+    def add_conflict_errors(self, formset, instances):
+        """他で変更されていたインスタンスの、フォームにエラーを加える"""
+        pks = {instance.pk for instance in instances}
+        for form in formset.initial_forms:
+            if form.instance.pk in pks:
+                form.add_error(None, '他の人が先に変更しました。ページを読み込み直してから、もう一度変更してください')
+
+    def get_previous_instances(self, instances):
+        """更新前のインスタンスを、{pk: インスタンス}で返す
+
+        日付・終了日・カレンダーだけでなく、全文検索の索引から消す概要なども使うので、全てのフィールドを読み込みます
+        (遅延読み込みのフィールドは、bulk_updateの後に更新後の値が読まれてしまいます)。
+
+        """
+        return self.model.objects.in_bulk([instance.pk for instance in instances])
+
+    def get_instance_span(self, instance):
+        """インスタンスの(日付, 終了日)を返す"""
+        date = getattr(instance, self.date_field)
+        if self.end_date_field:
+            return date, getattr(instance, self.end_date_field) or date
+        return date, date
+
+    def get_instance_partitions(self, instances):
+        """インスタンスのキャッシュが入っている、全ての区画を返す"""
+        partitions = {''}
+        if self.calendar_field:
+            calendar_attname = self.model._meta.get_field(self.calendar_field).attname
+            partitions.update(
+                cache.get_calendar_partition(getattr(instance, calendar_attname)) for instance in instances
+            )
+        return partitions
+
+
+def to_json_data(value):
+    """カレンダー情報を、JSONにできる形に変換する
+
+    日付をキーにした辞書は、JSONのキーにできないので、キーをISO形式の文字列にします。
+    日付や時間の値は、DjangoJSONEncoderがISO形式の文字列にします。
+
+    """
+    if isinstance(value, dict):
+        return {
+            key.isoformat() if isinstance(key, datetime.date) else key: to_json_data(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [to_json_data(item) for item in value]
+    return value
+
+
+class JSONCalendarMixin:
+    """カレンダー情報を、テンプレートを使わずにJSONで返すMixin
+
+    スケジュール付きのMixinと一緒に使うと、スケジュールはモデルのインスタンスを作らず、values()の辞書のまま返します。
+
+    """
+    json_fields = ()  # 返すスケジュールのフィールド。空なら全てのフィールドです
+    ndjson_chunk_size = 2000  # NDJSONで返す際に、データベースから一度に読み込む行数
+
+    def get_schedules(self, start, end):
+        return super().get_schedules(start, end).values(*self.json_fields)
+
+    def get_schedule_value(self, schedule, name):
+        return schedule[name]
+
+    def make_occurrence(self, recurring_schedule, date):
+        occurrence = {
+            'recurrence_id': recurring_schedule.pk,
+            self.date_field: date,
+            'summary': recurring_schedule.summary,
+            'description': recurring_schedule.description,
+            'start_time': recurring_schedule.start_time,
+            'end_time': recurring_schedule.end_time,
+        }
+        if self.end_date_field:
+            occurrence[self.end_date_field] = date
+        return occurrence
+
+    def is_occurrence(self, schedule):
+        return 'recurrence_id' in schedule
+
+    def get_schedule_cache_scope(self):
+        # インスタンスではなく辞書をキャッシュするので、キーを分けます
+        return 'values:{}:{}'.format(','.join(self.json_fields), super().get_schedule_cache_scope())
+
+    def render_to_json_response(self, calendar_context):
+        """カレンダー情報を、JSONのレスポンスにして返す"""
+        return JsonResponse(to_json_data(calendar_context), json_dumps_params={'ensure_ascii': False})
+
+    def render_to_ndjson_response(self, start, end):
+        """start〜endのスケジュールを、1行に1つずつのJSON(NDJSON)で少しずつ返す
+
+        iterator()で少しずつ読み込みながら書き出すので、1年分などの長い期間でも、メモリの使用量は一定です。
+
+        """
+        schedules = self.get_display_schedules(start, end).iterator(chunk_size=self.ndjson_chunk_size)
+        schedules = self.merge_occurrences(schedules, start, end)
+        lines = (
+            json.dumps(schedule, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n' for schedule in schedules
+        )
+        return StreamingHttpResponse(lines, content_type='application/x-ndjson; charset=utf-8')
+
+
+class ICalendarMixin:
+    """スケジュールを、iCalendar(.ics)で返すMixin
+
+    スケジュール付きのMixinと一緒に使ってください。
+    スケジュールは、iterator()で少しずつ読み込みながらVEVENTにして書き出すので、何年分でもメモリの使用量は一定です。
+    recurrence_modelがあれば、繰り返しのスケジュールは展開せず、RRULE付きのVEVENTにします。
+
+    """
+    ics_chunk_size = 2000  # データベースから一度に読み込む行数
+    ics_filename = 'schedules.ics'
+
+    def get_ics_recurrences(self, start, end):
+        """書き出す繰り返しのスケジュールを返す。RRULEは期間の外にも及ぶので、例外の日は全て読み込みます"""
+        if self.recurrence_model is None:
+            return ()
+        return self.get_recurrences(start, end).prefetch_related(None).prefetch_related('exceptions')
+
+    def render_to_ics_response(self, start, end):
+        """start〜endと重なるスケジュールを、.icsのレスポンスで少しずつ返す"""
+        schedules = self.get_schedules(start, end).values().iterator(chunk_size=self.ics_chunk_size)
+        lines = ical.iter_calendar(
+            schedules, self.get_ics_recurrences(start, end), uid_domain=self.request.get_host()
+        )
+        response = StreamingHttpResponse(lines, content_type='text/calendar; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(self.ics_filename)
+        return response
+
+
+class AsyncScheduleMixin:
+    """スケジュール付きのMixinに、非同期版のメソッドを加えるMixin
+
+    ASGIで動かす場合に、データベースを待つ間もスレッドを占有しないよう、非同期のORM(async for、aaggregate)を使います。
+    キャッシュを使う場合(use_schedule_cache)は、キャッシュの読み書きと、無かった場合の取得を、まとめてスレッドで行います。
+
+    """
+
+    async def aget_calendar_ids(self):
+        """get_calendar_idsの非同期版。取得したidは、同期版のget_calendar_idsでも使われます"""
+        if self._calendar_ids is None:
+            # request.userは、初めて使う時にユーザーを同期で読み込むので、QuerySetはスレッドで作ります
+            queryset = await sync_to_async(self.get_selected_calendar_queryset)()
+            self._calendar_ids = sorted([pk async for pk in queryset])
+        return self._calendar_ids
+
+    async def aget_default_calendar_id(self):
+        """get_default_calendar_idの非同期版。取得したidは、同期版のget_default_calendar_idでも使われます"""
+        if self.calendar_field and self._default_calendar_id is None:
+            await self.aget_calendar_ids()
+            # 所有者のカレンダーを探すクエリは同期版なので、スレッドで実行します
+            await sync_to_async(self.get_default_calendar_id)()
+        return self._default_calendar_id
+
+    async def aprepare_schedules(self):
+        """同期版のメソッドでQuerySetを作る際に、データベースを使わずに済むよう、必要な値を先に読み込んでおく"""
+        if self.calendar_field:
+            await self.aget_calendar_ids()
+
+    async def aget_occurrences(self, start, end):
+        """get_occurrencesの非同期版"""
+        if self.recurrence_model is None:
+            return []
+        # async forでも、prefetch_relatedした例外の日は、まとめて読み込まれます
+        recurring_schedules = [recurring_schedule async for recurring_schedule in self.get_recurrences(start, end)]
+        return self.expand_occurrences(recurring_schedules, start, end)
+
+    async def afetch_schedules(self, start, end):
+        """fetch_schedulesの非同期版。スケジュールのリストを返す
+
+        スケジュールと、繰り返しのスケジュールは、asyncio.gatherで同時に取得します。
+
+        """
+        await self.aprepare_schedules()
+        if self.use_schedule_cache:
+            return await sync_to_async(lambda: list(self.fetch_schedules(start, end)))()
+
+        async def get_schedules():
+            return [schedule async for schedule in self.get_display_schedules(start, end)]
+
+        schedules, occurrences = await asyncio.gather(get_schedules(), self.aget_occurrences(start, end))
+        if not occurrences:
+            return schedules
+        return list(heapq.merge(schedules, occurrences, key=self.get_schedule_sort_key))
+
+    async def atimed_fetch_schedules(self, start, end):
+        """timed_fetch_schedulesの非同期版。クエリは別のスレッドで実行されるので、時間と行数だけを計測します"""
+        with instrumentation.time_stage(self, 'query', count_queries=False) as timing:
+            schedules = await self.afetch_schedules(start, end)
+            timing.rows = len(schedules)
+        return schedules
+
+    async def aget_calendar_fragment(self, start, end, calendar_context, context_name, aget_day_schedules):
+        """get_calendar_fragmentの非同期版。aget_day_schedulesは、コルーチン関数です"""
+        if not self.use_schedule_cache:
+            calendar_context[context_name] = await aget_day_schedules()
+            return render_to_string(self.schedule_fragment_template, calendar_context, self.request)
+
+        key = await sync_to_async(self.get_calendar_fragment_key)(start, end, calendar_context)
+        store = cache.get_cache()
+        html = await store.aget(key)
+        if html is None:
+            calendar_context[context_name] = await aget_day_schedules()
+            html = render_to_string(self.schedule_fragment_template, calendar_context, self.request)
+            await store.aset(key, str(html), self.schedule_cache_timeout)
+        return mark_safe(html)
+
+    async def aget_schedule_validator(self, start, end):
+        """get_schedule_validatorの非同期版"""
+        await self.aprepare_schedules()
+        queries = [self.get_schedules(start, end).order_by().aaggregate(**self.get_validator_aggregates())]
+        if self.recurrence_model is not None:
+            queries.append(self.get_recurrences(start, end).order_by().aaggregate(**self.get_validator_aggregates()))
+        return self.combine_validators(await asyncio.gather(*queries))
+
+
+class AsyncConditionalScheduleMixin(ConditionalScheduleMixin):
+    """ConditionalScheduleMixinの非同期版。非同期のスケジュール付きMixinと、async defのビューと一緒に使ってください"""
+
+    async def aget_calendar_validators(self):
+        """get_calendar_validatorsの非同期版"""
+        start, end = self.get_calendar_range()
+        last_modified, count = await self.aget_schedule_validator(start, end)
+        return self.make_calendar_validators(start, end, last_modified, count)
+
+    async def dispatch(self, request, *args, **kwargs):
+        # 同期版のdispatchを飛ばして、ビューのdispatchを呼びます。async defのビューなら、コルーチンが返ります
+        view_dispatch = super(ConditionalScheduleMixin, self).dispatch
+        if request.method not in ('GET', 'HEAD'):
+            return await view_dispatch(request, *args, **kwargs)
+
+        with instrumentation.time_stage(self, 'validators', count_queries=False):
+            etag, last_modified = await self.aget_calendar_validators()
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = await view_dispatch(request, *args, **kwargs)
+        return self.set_validator_headers(response, etag, last_modified)
+
+
+class AsyncWeekWithScheduleMixin(AsyncScheduleMixin, WeekWithScheduleMixin):
+    """スケジュール付きの、週間カレンダーを提供するMixinの非同期版"""
+
+    async def aget_week_schedules(self, start, end, days):
+        """get_week_schedulesの非同期版"""
+        schedules = await self.atimed_fetch_schedules(start, end)
+        with instrumentation.time_stage(self, 'bucket'):
+            return self.bucket_schedules([days], schedules)[0]
+
+    async def aget_weeks_schedules(self, weeks):
+        """get_weeks_schedulesの非同期版"""
+        schedules = await self.atimed_fetch_schedules(weeks[0][0], weeks[-1][-1])
+        with instrumentation.time_stage(self, 'bucket'):
+            return self.bucket_schedules(weeks, schedules)
+
+    async def aset_neighbour_weeks(self, calendar_context):
+        """set_neighbour_weeksの非同期版"""
+        if self.schedule_fragment_template:
+            # キャッシュの読み書きと、無かった週の取得・描画は、まとめてスレッドで行います
+            return await sync_to_async(self.set_neighbour_weeks)(calendar_context)
+        weeks = [week_context['week_days'] for week_context in self.get_neighbour_weeks(calendar_context)]
+        weeks.insert(1, calendar_context['week_days'])
+        return self.set_neighbour_weeks(calendar_context, await self.aget_weeks_schedules(weeks))
+
+    async def aget_week_calendar(self):
+        """get_week_calendarの非同期版"""
+        # スケジュールの無い、週間カレンダーの情報です(データベースは使いません)
+        calendar_context = super(WeekWithScheduleMixin, self).get_week_calendar()
+        if self.use_neighbour_prefetch():
+            return await self.aset_neighbour_weeks(calendar_context)
+        week_first = calendar_context['week_first']
+        week_last = calendar_context['week_last']
+        week_days = calendar_context['week_days']
+        if self.schedule_fragment_template:
+            calendar_context['calendar_fragment'] = await self.aget_calendar_fragment(
+                week_first, week_last, calendar_context, 'week_day_schedules',
+                lambda: self.aget_week_schedules(week_first, week_last, week_days)
+            )
+        else:
+            calendar_context['week_day_schedules'] = await self.aget_week_schedules(week_first, week_last, week_days)
+        return calendar_context
+
+
+class AsyncScheduleFragmentMixin(AsyncWeekWithScheduleMixin, ScheduleFragmentMixin):
+    """ScheduleFragmentMixinの非同期版"""
+
+    async def arender_days_fragment(self, days):
+        """render_days_fragmentの非同期版"""
+        return self.render_schedules_fragment(days, await self.aget_week_schedules(days[0], days[-1], days))
+
+    async def arender_saved_fragment(self, instance):
+        """render_saved_fragmentの非同期版"""
+        response = await self.arender_days_fragment(self.get_fragment_days(instance))
+        response['HX-Trigger'] = 'schedule-saved'
+        return response
+
+
+class AsyncMonthWithScheduleMixin(AsyncScheduleMixin, MonthWithScheduleMixin):
+    """スケジュール付きの、月間カレンダーを提供するMixinの非同期版"""
+
+    async def aget_month_schedules(self, start, end, days):
+        """get_month_schedulesの非同期版"""
+        schedules = await self.atimed_fetch_schedules(start, end)
+        with instrumentation.time_stage(self, 'bucket'):
+            return self.bucket_schedules(days, schedules)
+
+    async def aget_month_calendar(self):
+        """get_month_calendarの非同期版"""
+        # スケジュールの無い、月間カレンダーの情報です(データベースは使いません)
+        calendar_context = super(MonthWithScheduleMixin, self).get_month_calendar()
+        month_days = calendar_context['month_days']
+        month_first = month_days[0][0]
+        month_last = month_days[-1][-1]
+        if self.schedule_fragment_template:
+            calendar_context['calendar_fragment'] = await self.aget_calendar_fragment(
+                month_first, month_last, calendar_context, 'month_day_schedules',
+                lambda: self.aget_month_schedules(month_first, month_last, month_days)
+            )
+        else:
+            calendar_context['month_day_schedules'] = await self.aget_month_schedules(
+                month_first, month_last, month_days
+            )
+        return calendar_context
+
+
+class AsyncMonthWeekWithScheduleMixin(AsyncScheduleMixin, MonthWeekWithScheduleMixin):
+    """月間カレンダーと、スケジュール付きの週間カレンダーを、まとめて提供するMixinの非同期版"""
+
+    async def aget_month_week_calendar(self):
+        """get_month_week_calendarの非同期版"""
+        calendar_data = self.get_month_week_days()
+        start, end = self.get_month_week_range(calendar_data)
+        self.set_month_week_schedules(calendar_data, await self.atimed_fetch_schedules(start, end))
+        return calendar_data
@@ -1,16 +1,282 @@
 import datetime
-from django.db import models
-from django.utils import timezone
+import zoneinfo
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models, router, transaction
+from django.utils import timezone, translation
+from . import recurrence
+
+
+DEFAULT_MAX_SCHEDULE_DAYS = 31
+
+
+def get_max_schedule_days():
+    """複数日のスケジュールの、最長の日数を返す。settings.CALENDAR_MAX_SCHEDULE_DAYSで変更できます
+
+    カレンダーは、期間と重なるスケジュールを「開始日 >= 最初の日 - (最長の日数 - 1)」でも絞り込むので、
+    長くするほど、1回の表示で読む日付のインデックスの範囲が広くなります。
+
+    """
+    return getattr(settings, 'CALENDAR_MAX_SCHEDULE_DAYS', DEFAULT_MAX_SCHEDULE_DAYS)
+
+
+class ScheduleConflict(Exception):
+    """保存しようとしたスケジュールが、読み込んだ後に他で変更・削除されていた場合に送出されます
+
+    instancesには、保存できなかった全てのインスタンスが入ります。
+
+    """
+
+    def __init__(self, instances):
+        self.instances = list(instances)
+        super().__init__('{}件のスケジュールが、他で変更されています'.format(len(self.instances)))
+
+
+class Calendar(models.Model):
+    """カレンダー。ユーザーやチーム毎に作り、スケジュールをまとめます"""
+    name = models.CharField('名前', max_length=50)
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL, verbose_name='所有者', on_delete=models.CASCADE,
+        null=True, blank=True, related_name='calendars', help_text='空なら、全員が見られるカレンダーです'
+    )
+    created_at = models.DateTimeField('作成日', default=timezone.now)
+
+    def __str__(self):
+        return self.name
 
 
 class Schedule(models.Model):
     """スケジュール"""
+    calendar = models.ForeignKey(
+        Calendar, verbose_name='カレンダー', on_delete=models.CASCADE,
+        related_name='schedules', db_index=False,  # 下の複合インデックスで、calendar_idだけの検索もできます
+    )
     summary = models.CharField('概要', max_length=50)
     description = models.TextField('詳細な説明', blank=True)
     start_time = models.TimeField('開始時間', default=datetime.time(7, 0, 0))
     end_time = models.TimeField('終了時間', default=datetime.time(7, 0, 0))
     date = models.DateField('日付')
+    end_date = models.DateField('終了日', blank=True, help_text='空なら、日付と同じ日になります')
+    created_at = models.DateTimeField('作成日', default=timezone.now)
+    updated_at = models.DateTimeField('更新日', auto_now=True)
+    version = models.PositiveIntegerField('バージョン', default=1, help_text='保存する度に1つ増えます。同時の編集を見つけるのに使います')
+    uid = models.CharField(
+        'UID', max_length=255, blank=True, help_text='.icsから読み込んだイベントのUID。同じカレンダーに、もう一度は読み込みません'
+    )
+
+    class Meta:
+        indexes = [
+            # カレンダーは、日付の範囲で絞り込み、日付・開始時間順に並べて表示します。
+            # 複数日のスケジュールも、date BETWEEN 最初の日 - (最長の日数 - 1) AND 最後の日 をこのインデックスで読み、
+            # end_date >= 最初の日 で、期間と重なるものに絞り込みます(get_max_schedule_days)
+            models.Index(fields=['date', 'start_time'], name='app_schedule_date_start'),
+            # カレンダー毎の表示では、calendar_idを先頭にして、そのカレンダーの行だけを読みます。
+            # テーブル全体が大きくなっても、1つのカレンダーの表示にかかる時間は変わりません
+            models.Index(fields=['calendar', 'date', 'start_time'], name='app_schedule_cal_date'),
+            # .icsの読み込みで、読み込み済みのUIDを調べます
+            models.Index(fields=['calendar', 'uid'], name='app_schedule_cal_uid'),
+        ]
+
+    def __str__(self):
+        return self.summary
+
+    @property
+    def start_datetime(self):
+        """開始日時"""
+        return datetime.datetime.combine(self.date, self.start_time)
+
+    @property
+    def end_datetime(self):
+        """終了日時"""
+        return datetime.datetime.combine(self.end_date or self.date, self.end_time)
+
+    def clean(self):
+        if self.end_date is None:
+            self.end_date = self.date
+        elif self.date is not None and self.end_date < self.date:
+            # 終了日の無いフォームでも使われるので、フィールドを指定しないエラーにします
+            raise ValidationError('終了日は、日付以降にしてください')
+        elif self.date is not None and (self.end_date - self.date).days >= get_max_schedule_days():
+            raise ValidationError(
+                '%(days)s日より長いスケジュールは登録できません', params={'days': get_max_schedule_days()}
+            )
+
+    def save(self, *args, **kwargs):
+        """保存する。既存のスケジュールなら、読み込んだ時からバージョンが変わっていない場合だけ保存します
+
+        バージョンは、UPDATEのWHEREで調べて1つ増やすので、同時に保存しても、成功するのは片方だけです。
+        もう片方は、上書きせずにScheduleConflictを送出します。行をロック(select_for_update)して待つ必要はありません。
+
+        """
+        if self.end_date is None:
+            self.end_date = self.date
+        if self._state.adding:
+            super().save(*args, **kwargs)
+            return
+
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            updated = type(self)._base_manager.using(using).filter(pk=self.pk, version=self.version).update(
+                version=models.F('version') + 1
+            )
+            if not updated:
+                raise ScheduleConflict([self])
+            self.version += 1
+            try:
+                super().save(*args, **kwargs)
+            except BaseException:
+                self.version -= 1
+                raise
+
+
+class RecurringSchedule(models.Model):
+    """繰り返しのスケジュール
+
+    毎日・毎週(曜日の指定も可)・毎月の繰り返しを、1行で表します。
+    カレンダーには、表示する期間の中の回だけが展開されて表示されます。
+
+    """
+    FREQUENCY_CHOICES = (
+        (recurrence.DAILY, '毎日'),
+        (recurrence.WEEKLY, '毎週'),
+        (recurrence.MONTHLY, '毎月'),
+    )
+    calendar = models.ForeignKey(
+        Calendar, verbose_name='カレンダー', on_delete=models.CASCADE,
+        related_name='recurring_schedules', db_index=False,
+    )
+    summary = models.CharField('概要', max_length=50)
+    description = models.TextField('詳細な説明', blank=True)
+    start_time = models.TimeField('開始時間', default=datetime.time(7, 0, 0))
+    end_time = models.TimeField('終了時間', default=datetime.time(7, 0, 0))
+    frequency = models.CharField('繰り返し', max_length=10, choices=FREQUENCY_CHOICES, default=recurrence.WEEKLY)
+    interval = models.PositiveIntegerField('間隔', default=1, help_text='2なら、隔日・隔週・隔月になります')
+    weekdays = models.CharField(
+        '曜日', max_length=13, blank=True,
+        help_text='毎週の場合の曜日。0(月)〜6(日)をカンマ区切りで指定します。空なら開始日の曜日です'
+    )
+    start_date = models.DateField('開始日')
+    until = models.DateField('終了日', null=True, blank=True)
+    count = models.PositiveIntegerField('回数', null=True, blank=True)
+    end_date = models.DateField('最後の日', null=True, blank=True, editable=False)  # untilとcountから、保存時に計算します
+    uid = models.CharField(
+        'UID', max_length=255, blank=True, help_text='.icsから読み込んだイベントのUID。同じカレンダーに、もう一度は読み込みません'
+    )
     created_at = models.DateTimeField('作成日', default=timezone.now)
+    updated_at = models.DateTimeField('更新日', auto_now=True)
+
+    class Meta:
+        indexes = [
+            # 表示する期間と重なる繰り返しだけを、開始日と最後の日で絞り込みます
+            models.Index(fields=['start_date', 'end_date'], name='app_recurring_bounds'),
+            models.Index(fields=['calendar', 'start_date', 'end_date'], name='app_recurring_cal_bounds'),
+            models.Index(fields=['calendar', 'uid'], name='app_recurring_cal_uid'),
+        ]
 
     def __str__(self):
         return self.summary
+
+    def get_weekdays(self):
+        """曜日のリストを返す"""
+        return [int(weekday) for weekday in self.weekdays.split(',') if weekday.strip()]
+
+    def clean(self):
+        try:
+            weekdays = self.get_weekdays()
+        except ValueError:
+            weekdays = None
+        if weekdays is None or any(not 0 <= weekday <= 6 for weekday in weekdays):
+            raise ValidationError({'weekdays': '曜日は、0〜6の数字をカンマ区切りで指定してください'})
+        if self.until is not None and self.until < self.start_date:
+            raise ValidationError({'until': '終了日は、開始日以降にしてください'})
+        if self.interval < 1:
+            raise ValidationError({'interval': '間隔は、1以上にしてください'})
+        if self.count is not None and self.count < 1:
+            raise ValidationError({'count': '回数は、1以上にしてください'})
+
+    def save(self, *args, **kwargs):
+        self.end_date = recurrence.get_last_date(
+            self.frequency, self.start_date, self.interval, self.get_weekdays(), self.until, self.count
+        )
+        super().save(*args, **kwargs)
+
+
+class RecurrenceException(models.Model):
+    """繰り返しのスケジュールを、お休みにする日"""
+    recurring_schedule = models.ForeignKey(
+        RecurringSchedule, verbose_name='繰り返しのスケジュール', on_delete=models.CASCADE, related_name='exceptions'
+    )
+    date = models.DateField('日付')
+
+    class Meta:
+        unique_together = ('recurring_schedule', 'date')
+
+    def __str__(self):
+        return '{} {}'.format(self.recurring_schedule, self.date)
+
+
+class DailyScheduleStats(models.Model):
+    """カレンダー毎・日毎の、スケジュールの件数
+
+    年間のヒートマップなどで、何万件ものScheduleを数えずに済むよう、件数だけを持っておく集計表です。
+    Scheduleの保存・削除時に、シグナルで増減させます(app.statsモジュール)。
+    複数日のスケジュールは、全ての日で数えます。繰り返しのスケジュールは含みません。
+    ずれてしまった場合は、rebuildschedulestatsコマンドで作り直してください。
+
+    """
+    calendar = models.ForeignKey(
+        Calendar, verbose_name='カレンダー', on_delete=models.CASCADE, related_name='daily_stats', db_index=False,
+    )
+    date = models.DateField('日付')
+    count = models.PositiveIntegerField('件数', default=0)
+
+    class Meta:
+        # (calendar, date)のユニークなインデックスで、カレンダーの1年分の行だけを読みます
+        unique_together = ('calendar', 'date')
+
+    def __str__(self):
+        return '{} {} {}件'.format(self.calendar_id, self.date, self.count)
+
+
+WEEKDAY_CHOICES = [
+    (0, '月曜日'), (1, '火曜日'), (2, '水曜日'), (3, '木曜日'), (4, '金曜日'), (5, '土曜日'), (6, '日曜日'),
+]
+
+
+def validate_language(value):
+    """settings.LANGUAGESにある言語か調べる"""
+    try:
+        translation.get_supported_language_variant(value)
+    except LookupError:
+        raise ValidationError('「%(value)s」という言語はありません', params={'value': value})
+
+
+def validate_time_zone(value):
+    """Asia/Tokyoのような、タイムゾーンの名前か調べる"""
+    try:
+        zoneinfo.ZoneInfo(value)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        raise ValidationError('「%(value)s」というタイムゾーンはありません', params={'value': value})
+
+
+class CalendarPreference(models.Model):
+    """ユーザー毎の、カレンダーの表示の設定
+
+    CalendarPreferenceMiddlewareが、リクエスト毎に言語とタイムゾーンを有効にし、カレンダーのMixinがfirst_weekdayを使います。
+    空の項目は、ビューやサイトの設定(first_weekday、LANGUAGE_CODE、TIME_ZONE)のままです。
+
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, verbose_name='ユーザー', on_delete=models.CASCADE, related_name='calendar_preference',
+    )
+    language = models.CharField(
+        '言語', max_length=15, blank=True, validators=[validate_language], help_text='ja、enなど。曜日の名前に使います'
+    )
+    first_weekday = models.PositiveSmallIntegerField('週の最初の曜日', null=True, blank=True, choices=WEEKDAY_CHOICES)
+    time_zone = models.CharField(
+        'タイムゾーン', max_length=63, blank=True, validators=[validate_time_zone],
+        help_text='Asia/Tokyo、America/New_Yorkなど。今日の日付に使います',
+    )
+
+    def __str__(self):
+        return str(self.user)
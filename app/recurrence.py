@@ -0,0 +1,173 @@
+"""繰り返しのスケジュール(RecurringSchedule)を、それぞれの日の予定(Occurrence)に展開するモジュール
+
+展開は、指定した期間の中だけで、ジェネレータで少しずつ行います。
+期間の最初の日より前の繰り返しは、計算で飛ばすので、何年前に始まった繰り返しでも手間は変わりません。
+
+"""
+import calendar
+import datetime
+import math
+
+DAILY = 'daily'
+WEEKLY = 'weekly'
+MONTHLY = 'monthly'
+
+
+class Occurrence:
+    """繰り返しのスケジュールの、ある日の1回分
+
+    テンプレートでは、Scheduleと同じようにsummaryやstart_timeを表示できます。
+
+    """
+    __slots__ = ('recurrence_id', 'date', 'end_date', 'summary', 'description', 'start_time', 'end_time')
+
+    def __init__(self, recurrence, date):
+        self.recurrence_id = recurrence.pk
+        self.date = date
+        self.end_date = date
+        self.summary = recurrence.summary
+        self.description = recurrence.description
+        self.start_time = recurrence.start_time
+        self.end_time = recurrence.end_time
+
+    def __str__(self):
+        return self.summary
+
+
+def _add_months(year, month, months):
+    """(year, month)のmonthsヶ月後の、(年, 月)を返す"""
+    index = year * 12 + month - 1 + months
+    return index // 12, index % 12 + 1
+
+
+def _iter_daily(first, interval, start):
+    if start > first:
+        # startより前の回は、計算で飛ばします
+        skip = -(-(start - first).days // interval)
+        first += datetime.timedelta(days=skip * interval)
+    step = datetime.timedelta(days=interval)
+    date = first
+    while True:
+        yield date
+        date += step
+
+
+def _iter_weekly(first, interval, weekdays, start):
+    anchor = first - datetime.timedelta(days=first.weekday())  # 最初の回がある週の月曜日
+    week = 0
+    if start > anchor:
+        week = (start - anchor).days // 7
+        week += -week % interval  # 間隔に合う週まで進める
+    while True:
+        monday = anchor + datetime.timedelta(weeks=week)
+        for weekday in weekdays:
+            date = monday + datetime.timedelta(days=weekday)
+            if date >= first:
+                yield date
+        week += interval
+
+
+def _iter_monthly(first, interval, start):
+    months = 0
+    if start > first:
+        months = (start.year - first.year) * 12 + start.month - first.month
+        months += -months % interval
+    while True:
+        year, month = _add_months(first.year, first.month, months)
+        try:
+            yield datetime.date(year, month, first.day)
+        except ValueError:
+            pass  # 31日など、その月に無い日は飛ばします(RFC 5545のRRULEと同じ)
+        months += interval
+
+
+def iter_rule_dates(frequency, first, interval=1, weekdays=(), start=None):
+    """繰り返しの日付を、start以降から順番に、際限なく返すジェネレータ
+
+    weekdaysは、毎週の場合の曜日(0が月曜日)です。空なら、firstの曜日になります。
+
+    """
+    start = start or first
+    if frequency == DAILY:
+        return _iter_daily(first, interval, start)
+    if frequency == WEEKLY:
+        return _iter_weekly(first, interval, sorted(set(weekdays)) or [first.weekday()], start)
+    if frequency == MONTHLY:
+        return _iter_monthly(first, interval, start)
+    raise ValueError('不明な繰り返しです: {}'.format(frequency))
+
+
+def _get_nth_weekly(first, interval, weekdays, n):
+    anchor = first - datetime.timedelta(days=first.weekday())
+    first_week = [weekday for weekday in weekdays if weekday >= first.weekday()]  # 最初の週は、firstより後の曜日だけです
+    if n <= len(first_week):
+        return anchor + datetime.timedelta(days=first_week[n - 1])
+    weeks, index = divmod(n - len(first_week) - 1, len(weekdays))
+    return anchor + datetime.timedelta(weeks=(weeks + 1) * interval, days=weekdays[index])
+
+
+def _get_nth_monthly(first, interval, n):
+    if first.day <= 28:
+        steps = n - 1
+    else:
+        # 29日〜31日が無い月は飛ばします。グレゴリオ暦は400年(4800ヶ月)で繰り返すので、1周分だけ調べて計算します
+        period = 4800 // math.gcd(4800, interval)
+        valid_steps = [
+            step for step in range(period)
+            if first.day <= calendar.monthrange(*_add_months(first.year, first.month, step * interval))[1]
+        ]
+        cycles, index = divmod(n - 1, len(valid_steps))
+        steps = cycles * period + valid_steps[index]
+    year, month = _add_months(first.year, first.month, steps * interval)
+    if year > datetime.MAXYEAR:
+        raise OverflowError('{}年は、扱える範囲を超えています'.format(year))
+    return datetime.date(year, month, first.day)
+
+
+def get_nth_date(frequency, first, interval=1, weekdays=(), n=1):
+    """繰り返しのn回目(1から数えます)の日付を返す
+
+    回を1つずつ数えずに計算するので、nがどれだけ大きくても時間は変わりません。
+    9999年より後になる場合は、OverflowErrorです。
+
+    """
+    if n < 1:
+        raise ValueError('回数は、1以上にしてください')
+    if frequency == DAILY:
+        return first + datetime.timedelta(days=(n - 1) * interval)
+    if frequency == WEEKLY:
+        return _get_nth_weekly(first, interval, sorted(set(weekdays)) or [first.weekday()], n)
+    if frequency == MONTHLY:
+        return _get_nth_monthly(first, interval, n)
+    raise ValueError('不明な繰り返しです: {}'.format(frequency))
+
+
+def get_last_date(frequency, first, interval=1, weekdays=(), until=None, count=None):
+    """繰り返しの最後の日を返す。終わりが無ければNone
+
+    回数(count)で終わる場合は、count回目の日を計算します。.icsから読み込んだ大きなCOUNTでも、すぐに終わります。
+    count回目が9999年より後なら、countでは終わらないものとして扱います。
+
+    """
+    if count is None:
+        return until
+    try:
+        last = get_nth_date(frequency, first, interval, weekdays, count)
+    except OverflowError:
+        return until
+    if until is not None and last > until:
+        return until
+    return last
+
+
+def iter_occurrence_dates(recurrence, start, end, exceptions=()):
+    """start〜endの中にある、recurrence(RecurringSchedule)の各回の日付を順番に返すジェネレータ"""
+    last = end if recurrence.end_date is None else min(end, recurrence.end_date)
+    dates = iter_rule_dates(
+        recurrence.frequency, recurrence.start_date, recurrence.interval, recurrence.get_weekdays(), start
+    )
+    for date in dates:
+        if date > last:
+            return
+        if date >= start and date not in exceptions:
+            yield date
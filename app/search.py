@@ -0,0 +1,134 @@
+"""スケジュールの概要・詳細な説明を、全文検索するモジュール
+
+SQLiteでは、FTS5の仮想テーブル(app_schedule_search)を、trigramトークナイザで作ります。
+3文字ずつの索引なので、日本語のように単語の区切りが無い文章でも、icontainsと同じ部分一致で検索できます。
+仮想テーブルは外部コンテンツ(content='app_schedule')なので、文章はScheduleのテーブルにだけ保存され、仮想テーブルには索引だけが入ります。
+仮想テーブルは、Scheduleの保存・削除時にシグナルで更新します(app.signals)。
+索引から消すには、索引に入れた時の値が必要です。変更後の値で消すと索引が壊れるので、
+更新では変更前の値を渡し、削除ではScheduleの行を消す前にunindex()を呼びます。
+
+FTS5が使えないデータベース(SQLite以外や、FTS5の無いSQLite)や、2文字以下の言葉は、icontainsで検索します。
+
+"""
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+MIN_TERM_LENGTH = 3  # trigramで検索できる、最短の言葉の長さ
+SCHEDULE_FIELDS = ('summary', 'description')  # Scheduleの、検索するフィールド
+
+_available = set()
+
+
+def get_table(model):
+    """modelの、全文検索の仮想テーブルの名前を返す"""
+    return '{}_search'.format(model._meta.db_table)
+
+
+def is_available(model, using=None):
+    """modelの全文検索の仮想テーブルが、使えるならTrue"""
+    using = using or router.db_for_read(model)
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    key = using, get_table(model)
+    if key not in _available:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1 FROM sqlite_master WHERE name = %s', [get_table(model)])
+            if cursor.fetchone() is None:
+                return False  # マイグレーション前かもしれないので、覚えておきません
+        _available.add(key)
+    return True
+
+
+def rebuild_index(model, using=None):
+    """仮想テーブルの索引を、modelのテーブルから作り直す"""
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    table = connection.ops.quote_name(get_table(model))
+    with connection.cursor() as cursor:
+        cursor.execute("INSERT INTO {0}({0}) VALUES ('rebuild')".format(table))
+
+
+def index_rows(model, fields, rows, using=None, previous_rows=()):
+    """(pk, フィールドの値...)の行を、仮想テーブルの索引に入れる
+
+    previous_rowsには、索引に入っている行の(pk, 変更前のフィールドの値...)を渡してください。先に索引から消します。
+
+    """
+    using = using or router.db_for_write(model)
+    if not (rows or previous_rows) or not is_available(model, using):
+        return
+    quote = connections[using].ops.quote_name
+    table = quote(get_table(model))
+    columns = ', '.join(quote(field) for field in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    # トランザクションの外で呼ばれても、1行毎にコミットされないようにします
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        if previous_rows:
+            # 外部コンテンツの仮想テーブルでは、'delete'コマンドに索引に入れた時の値を渡して消します
+            cursor.executemany("INSERT INTO {0}({0}, rowid, {1}) VALUES ('delete', %s, {2})".format(
+                table, columns, placeholders
+            ), previous_rows)
+        cursor.executemany('INSERT INTO {}(rowid, {}) VALUES (%s, {})'.format(table, columns, placeholders), rows)
+
+
+def index_instances(model, fields, instances, using=None, previous=None):
+    """インスタンスを、仮想テーブルの索引に入れる
+
+    更新したインスタンスは、previousに{pk: 変更前のインスタンス}を渡すと、変更前の値を索引から消してから入れます。
+
+    """
+    previous = previous or {}
+    rows = []
+    previous_rows = []
+    for instance in instances:
+        if instance.pk is None:
+            continue
+        rows.append([instance.pk] + [getattr(instance, field) for field in fields])
+        if instance.pk in previous:
+            previous_rows.append([instance.pk] + [getattr(previous[instance.pk], field) for field in fields])
+    index_rows(model, fields, rows, using, previous_rows)
+
+
+def unindex(model, pks, using=None):
+    """仮想テーブルの索引から、pksの行を消す
+
+    索引から消す値はmodelのテーブルから読まれるので、行を削除・変更する前に呼んでください。
+
+    """
+    using = using or router.db_for_write(model)
+    if not pks or not is_available(model, using):
+        return
+    table = connections[using].ops.quote_name(get_table(model))
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.executemany('DELETE FROM {} WHERE rowid = %s'.format(table), [[pk] for pk in pks])
+
+
+def make_match_query(terms):
+    """言葉のリストを、全ての言葉を含む行を探すMATCHの検索式にする"""
+    # "で囲むと、記号や演算子(ANDなど)もただの文字として扱われます。"は""にします
+    return ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+def filter_queryset(queryset, text, fields):
+    """textの全ての言葉を、fieldsのどれかに含む行に絞り込む"""
+    terms = text.split()
+    if not terms:
+        return queryset
+    model = queryset.model
+    fts_terms = []
+    if is_available(model, queryset.db):
+        fts_terms = [term for term in terms if len(term) >= MIN_TERM_LENGTH]
+    if fts_terms:
+        table = connections[queryset.db].ops.quote_name(get_table(model))
+        queryset = queryset.filter(pk__in=RawSQL(
+            'SELECT rowid FROM {0} WHERE {0} MATCH %s'.format(table), (make_match_query(fts_terms),)
+        ))
+    for term in terms:
+        if term not in fts_terms:
+            condition = Q()
+            for field in fields:
+                condition |= Q(**{'{}__icontains'.format(field): term})
+            queryset = queryset.filter(condition)
+    return queryset
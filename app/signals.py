@@ -0,0 +1,143 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+from . import cache, search, stats
+from .models import RecurrenceException, RecurringSchedule, Schedule
+
+# bulk_create・bulk_updateでまとめて保存した後に、自分で送るシグナルです(それらではpost_saveが送られないため)
+# sender=モデル、created=作成したインスタンスのリスト、updated=更新したインスタンスのリスト、
+# previous={pk: 更新前のインスタンス}(updatedの、更新前の日付やカレンダー、概要などが入っています)
+bulk_saved = Signal()
+
+
+@receiver(pre_save, sender=Schedule)
+def remember_previous_date(sender, instance, raw, update_fields, **kwargs):
+    """更新前の(日付, 終了日, カレンダー)を覚えておく
+
+    日付やカレンダーが変更された場合は、元の日・カレンダーのキャッシュも消す必要があるためです。
+
+    """
+    instance._previous = None
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and not {'date', 'end_date', 'calendar'} & set(update_fields):
+        return
+    instance._previous = sender._default_manager.filter(pk=instance.pk).values_list(
+        'date', 'end_date', 'calendar_id'
+    ).first()
+
+
+def get_partitions(*calendar_ids):
+    """カレンダーで分けていないキャッシュと、それぞれのカレンダーのキャッシュの区画を返す"""
+    return [''] + [
+        cache.get_calendar_partition(calendar_id) for calendar_id in calendar_ids if calendar_id is not None
+    ]
+
+
+@receiver(post_save, sender=Schedule)
+def evict_saved_schedule(sender, instance, **kwargs):
+    """保存されたスケジュールの日(と、更新前の日)のキャッシュを消す"""
+    previous_date, previous_end_date, previous_calendar_id = getattr(instance, '_previous', None) or (None,) * 3
+    spans = [(instance.date, instance.end_date), (previous_date, previous_end_date)]
+    partitions = get_partitions(instance.calendar_id, previous_calendar_id)
+    transaction.on_commit(lambda: cache.evict_spans(sender, spans, partitions))
+
+
+@receiver(post_delete, sender=Schedule)
+def evict_deleted_schedule(sender, instance, **kwargs):
+    """削除されたスケジュールの日のキャッシュを消す"""
+    spans = [(instance.date, instance.end_date)]
+    partitions = get_partitions(instance.calendar_id)
+    transaction.on_commit(lambda: cache.evict_spans(sender, spans, partitions))
+
+
+@receiver(post_save, sender=Schedule)
+def count_saved_schedule(sender, instance, created, raw, **kwargs):
+    """日毎の件数を、更新前の日から引き、保存された日に足す"""
+    if raw:
+        return  # loaddataなどでは、rebuildschedulestatsで数え直してください
+    previous = getattr(instance, '_previous', None)
+    if not created and previous is None:
+        return  # 日付もカレンダーも変わっていません
+    counts = stats.count_days([stats.get_span(instance)])
+    if previous is not None:
+        previous_date, previous_end_date, previous_calendar_id = previous
+        stats.count_days([(previous_calendar_id, previous_date, previous_end_date)], -1, counts)
+    stats.update_counts(counts)
+
+
+@receiver(post_delete, sender=Schedule)
+def count_deleted_schedule(sender, instance, **kwargs):
+    """日毎の件数を、削除されたスケジュールの日から引く"""
+    stats.update_counts(stats.count_days([stats.get_span(instance)], -1))
+
+
+@receiver(bulk_saved, sender=Schedule)
+def count_bulk_saved_schedules(sender, created=(), updated=(), previous=None, **kwargs):
+    """まとめて保存されたスケジュールの、日毎の件数を増減させる"""
+    counts = stats.count_days(stats.get_span(instance) for instance in list(created) + list(updated))
+    previous = previous or {}
+    stats.count_days(
+        (stats.get_span(previous[instance.pk]) for instance in updated if instance.pk in previous), -1, counts
+    )
+    stats.update_counts(counts)
+
+
+@receiver(pre_save, sender=Schedule)
+def remember_previous_search_values(sender, instance, raw, update_fields, **kwargs):
+    """更新前の、全文検索するフィールドの値を覚えておく
+
+    外部コンテンツの仮想テーブルでは、索引から消す時に、索引に入れた時の値が必要なためです。
+
+    """
+    instance._previous_search_values = None
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and not set(search.SCHEDULE_FIELDS) & set(update_fields):
+        return
+    instance._previous_search_values = sender._default_manager.filter(pk=instance.pk).values_list(
+        *search.SCHEDULE_FIELDS
+    ).first()
+
+
+@receiver(post_save, sender=Schedule)
+def index_saved_schedule(sender, instance, raw, update_fields, using, **kwargs):
+    """保存されたスケジュールを、全文検索の仮想テーブルに入れ直す"""
+    if raw or update_fields is not None and not set(search.SCHEDULE_FIELDS) & set(update_fields):
+        return
+    previous_rows = []
+    previous_values = getattr(instance, '_previous_search_values', None)
+    if previous_values is not None:
+        previous_rows.append([instance.pk, *previous_values])
+    row = [instance.pk] + [getattr(instance, field) for field in search.SCHEDULE_FIELDS]
+    search.index_rows(sender, search.SCHEDULE_FIELDS, [row], using, previous_rows)
+
+
+@receiver(pre_delete, sender=Schedule)
+def unindex_deleted_schedule(sender, instance, using, **kwargs):
+    """削除されるスケジュールを、全文検索の仮想テーブルから消す(索引から消す値を読むので、行を削除する前に消します)"""
+    search.unindex(sender, [instance.pk], using)
+
+
+@receiver(bulk_saved, sender=Schedule)
+def index_bulk_saved_schedules(sender, created=(), updated=(), previous=None, **kwargs):
+    """まとめて保存されたスケジュールを、全文検索の仮想テーブルに入れ直す(更新したものは、previousの値を索引から消します)"""
+    search.index_instances(sender, search.SCHEDULE_FIELDS, list(created) + list(updated), previous=previous)
+
+
+@receiver(post_save, sender=RecurrenceException)
+@receiver(post_delete, sender=RecurrenceException)
+def touch_recurring_schedule(sender, instance, raw=False, **kwargs):
+    """例外の日が変われば、繰り返しのスケジュールも更新されたことにする(ETagを変えるため)"""
+    if not raw:
+        RecurringSchedule.objects.filter(pk=instance.recurring_schedule_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=RecurringSchedule)
+@receiver(post_delete, sender=RecurringSchedule)
+@receiver(post_save, sender=RecurrenceException)
+@receiver(post_delete, sender=RecurrenceException)
+def evict_recurrences(sender, **kwargs):
+    """繰り返しのスケジュールはどの日に影響するか分からないので、繰り返しに関する全てのキャッシュを消す"""
+    transaction.on_commit(lambda: cache.evict_model(RecurringSchedule))
@@ -0,0 +1,74 @@
+"""日毎のスケジュールの件数(DailyScheduleStats)を、増減させるモジュール
+
+件数は、{(カレンダーのid, 日付): 増減} の辞書(Counter)で集めてから、まとめてデータベースに反映します。
+行の無い日は件数0で作ってから足すので、同時に同じ日の行を作ろうとしても、件数がずれることはありません。
+
+"""
+import collections
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+from . import grid
+from .models import DailyScheduleStats, Schedule
+
+
+def count_days(schedules, delta=1, counts=None):
+    """スケジュールの全ての日に、deltaを足したCounterを返す。schedulesは、(カレンダーのid, 日付, 終了日)のイテラブル"""
+    if counts is None:
+        counts = collections.Counter()
+    for calendar_id, date, end_date in schedules:
+        if calendar_id is None or date is None:
+            continue
+        for day in grid.iter_days(date, end_date or date):
+            counts[calendar_id, day] += delta
+    return counts
+
+
+def get_span(schedule):
+    """Scheduleの、(カレンダーのid, 日付, 終了日)を返す"""
+    return schedule.calendar_id, schedule.date, schedule.end_date
+
+
+def update_counts(counts, batch_size=500):
+    """{(カレンダーのid, 日付): 増減} を、DailyScheduleStatsに反映する"""
+    counts = {key: delta for key, delta in counts.items() if delta}
+    if not counts:
+        return
+    # 同じ増減の日は、1回のUPDATEでまとめて足します
+    groups = collections.defaultdict(list)
+    for (calendar_id, date), delta in counts.items():
+        groups[calendar_id, delta].append(date)
+
+    with transaction.atomic():
+        DailyScheduleStats.objects.bulk_create(
+            [DailyScheduleStats(calendar_id=calendar_id, date=date) for (calendar_id, date), delta in counts.items()
+             if delta > 0],
+            batch_size=batch_size, ignore_conflicts=True,
+        )
+        for (calendar_id, delta), dates in groups.items():
+            for offset in range(0, len(dates), batch_size):
+                DailyScheduleStats.objects.filter(
+                    calendar_id=calendar_id, date__in=dates[offset:offset + batch_size]
+                ).update(count=Greatest(F('count') + delta, 0))  # ずれていても、マイナスにはしません
+
+
+def rebuild(batch_size=5000):
+    """Scheduleから、DailyScheduleStatsを全て作り直し、作った行の数を返す"""
+    with transaction.atomic():
+        # 1日だけのスケジュールはデータベースで数え、複数日のスケジュールだけを読み込んで、それぞれの日に足します
+        single_days = Schedule.objects.filter(end_date=F('date')).order_by().values(
+            'calendar_id', 'date'
+        ).annotate(count=Count('pk')).values_list('calendar_id', 'date', 'count')
+        counts = collections.Counter({(calendar_id, date): count for calendar_id, date, count in single_days})
+        spans = Schedule.objects.filter(end_date__gt=F('date')).values_list(
+            'calendar_id', 'date', 'end_date'
+        )
+        count_days(spans.iterator(chunk_size=batch_size), counts=counts)
+
+        DailyScheduleStats.objects.all().delete()
+        DailyScheduleStats.objects.bulk_create(
+            [DailyScheduleStats(calendar_id=calendar_id, date=date, count=count)
+             for (calendar_id, date), count in counts.items() if count > 0],
+            batch_size=batch_size,
+        )
+    return len(counts)
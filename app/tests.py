@@ -1,3 +1,1409 @@
-from django.test import TestCase
+import asyncio
+import calendar
+import datetime
+import html.parser
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import F
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone, translation
+from django.urls import include, path
+from . import cache, grid, instrumentation, recurrence, search
+from .forms import BS4ScheduleForm
+from .models import Calendar, CalendarPreference, DailyScheduleStats, RecurrenceException, RecurringSchedule, Schedule, ScheduleConflict
+from .signals import bulk_saved
+from .views import (
+    AsyncMonthWithScheduleCalendar, MonthCalendar, MonthWithFormsCalendar, MonthWithScheduleCalendar, MyCalendar,
+    WeekWithScheduleCalendar,
+)
 
-# Create your tests here.
+
+# 非同期版のビューのテストで使う、ASGIの場合のURLconfです(ROOT_URLCONF='app.tests')
+urlpatterns = [
+    path('', include('app.async_urls')),
+]
+
+
+def create_schedule(summary, date, start_time, end_time, end_date=None, calendar=None):
+    """テスト用のスケジュールを作る。カレンダーを省略すると、全員が見られるカレンダーです"""
+    if calendar is None:
+        calendar = Calendar.objects.filter(owner__isnull=True).order_by('pk').first()
+    return Schedule.objects.create(
+        calendar=calendar, summary=summary, date=date, end_date=end_date,
+        start_time=datetime.time(*start_time), end_time=datetime.time(*end_time),
+    )
+
+
+def get_day_schedules(calendar_context, key, day):
+    """カレンダーの、dayのDaySchedulesを返す"""
+    for day_schedules in calendar_context[key]:
+        if day in day_schedules:
+            return day_schedules[day]
+    raise KeyError(day)
+
+
+class MaxSchedulesPerDayTests(TestCase):
+    """1日に表示するスケジュールの数の制限(max_schedules_per_day)"""
+
+    def get_month(self):
+        return self.client.get('/month_with_schedule/2019/3/').context
+
+    def test_limit_and_more(self):
+        for hour in range(9, 14):
+            create_schedule('予定{}'.format(hour), datetime.date(2019, 3, 4), (hour, 0), (hour, 30))
+        day_schedules = get_day_schedules(self.get_month(), 'month_day_schedules', datetime.date(2019, 3, 4))
+        self.assertEqual([schedule.summary for schedule in day_schedules], ['予定9', '予定10', '予定11'])
+        self.assertEqual(day_schedules.more, 2)
+
+    def test_only_limited_rows_are_fetched(self):
+        """表示しきれないスケジュールは、データベースから読み込まない"""
+        for hour in range(9, 14):
+            create_schedule('予定{}'.format(hour), datetime.date(2019, 3, 4), (hour, 0), (hour, 30))
+        view = MonthWithScheduleCalendar()
+        view.setup(RequestFactory().get('/month_with_schedule/'))
+        schedules = list(view.get_display_schedules(datetime.date(2019, 3, 1), datetime.date(2019, 3, 31)))
+        self.assertEqual([schedule.summary for schedule in schedules], ['予定9', '予定10', '予定11'])
+        self.assertEqual({schedule.day_count for schedule in schedules}, {5})
+
+    def test_range_calendar_shows_more(self):
+        for hour in range(9, 13):
+            create_schedule('予定{}'.format(hour), datetime.date(2019, 3, 4), (hour, 0), (hour, 30))
+        response = self.client.get('/year/2019/')
+        month = response.context['range_months'][2]
+        day_schedules = get_day_schedules(month, 'month_day_schedules', datetime.date(2019, 3, 4))
+        self.assertEqual([schedule.summary for schedule in day_schedules], ['予定9', '予定10'])
+        self.assertEqual(day_schedules.more, 2)
+        self.assertContains(response, '+2件')
+
+    def test_multi_day_schedule_outside_limit_on_first_day(self):
+        """開始日で表示しきれない複数日のスケジュールも、2日目以降の日には表示される"""
+        for hour in range(9, 13):
+            create_schedule('予定{}'.format(hour), datetime.date(2019, 3, 4), (hour, 0), (hour, 30))
+        create_schedule('出張', datetime.date(2019, 3, 4), (13, 0), (18, 0), end_date=datetime.date(2019, 3, 6))
+        context = self.get_month()
+
+        day_schedules = get_day_schedules(context, 'month_day_schedules', datetime.date(2019, 3, 4))
+        self.assertEqual(len(day_schedules), 3)
+        self.assertEqual(day_schedules.more, 2)
+        for day in (datetime.date(2019, 3, 5), datetime.date(2019, 3, 6)):
+            day_schedules = get_day_schedules(context, 'month_day_schedules', day)
+            self.assertEqual([schedule.summary for schedule in day_schedules], ['出張'])
+            self.assertEqual(day_schedules.more, 0)
+
+    def test_multi_day_schedules_are_capped_on_later_days(self):
+        """2日目以降の日でも、複数日のスケジュールが多ければ切り詰めて数える"""
+        for hour in range(9, 14):
+            create_schedule(
+                '研修{}'.format(hour), datetime.date(2019, 3, 4), (hour, 0), (hour, 30), end_date=datetime.date(2019, 3, 5)
+            )
+        day_schedules = get_day_schedules(self.get_month(), 'month_day_schedules', datetime.date(2019, 3, 5))
+        self.assertEqual([schedule.summary for schedule in day_schedules], ['研修9', '研修10', '研修11'])
+        self.assertEqual(day_schedules.more, 2)
+
+
+class MultiDayScheduleTests(TestCase):
+    """複数日のスケジュールの取得と、長さの制限"""
+
+    def test_overlapping_schedules_are_shown(self):
+        create_schedule('出張', datetime.date(2019, 2, 20), (9, 0), (18, 0), end_date=datetime.date(2019, 3, 5))
+        context = self.client.get('/month_with_schedule/2019/3/').context
+        day_schedules = get_day_schedules(context, 'month_day_schedules', datetime.date(2019, 3, 5))
+        self.assertEqual([schedule.summary for schedule in day_schedules], ['出張'])
+
+    @override_settings(CALENDAR_MAX_SCHEDULE_DAYS=3)
+    def test_too_long_schedule_is_rejected(self):
+        schedule = Schedule(summary='休暇', date=datetime.date(2019, 3, 4), end_date=datetime.date(2019, 3, 7))
+        with self.assertRaises(ValidationError):
+            schedule.clean()
+        schedule.end_date = datetime.date(2019, 3, 6)
+        schedule.clean()
+
+    @override_settings(CALENDAR_MAX_SCHEDULE_DAYS=3)
+    def test_query_has_lower_bound_on_date(self):
+        """開始日にも下限を付けて、日付のインデックスの範囲を狭くする"""
+        view = MonthWithScheduleCalendar()
+        view.setup(RequestFactory().get('/month_with_schedule/'))
+        queryset = view.get_schedules(datetime.date(2019, 3, 1), datetime.date(2019, 3, 31))
+        self.assertIn('"app_schedule"."date" BETWEEN 2019-02-27 AND 2019-03-31', str(queryset.query))
+
+
+class GridTests(TestCase):
+    """月・週のグリッド(app.grid)"""
+
+    def test_same_as_calendar_module(self):
+        for first_weekday in range(7):
+            for year, month in ((2019, 1), (2019, 3), (2019, 9), (2020, 2), (2020, 12)):
+                with self.subTest(year=year, month=month, first_weekday=first_weekday):
+                    month_grid = grid.get_month_grid(year, month, first_weekday)
+                    expected = calendar.Calendar(first_weekday).monthdatescalendar(year, month)
+                    self.assertEqual([list(week) for week in month_grid.weeks], expected)
+                    self.assertTrue(all(week[0].weekday() == first_weekday for week in month_grid.weeks))
+
+    def test_six_week_months(self):
+        september = grid.get_month_grid(2019, 9)
+        self.assertEqual(len(september.weeks), 6)
+        self.assertEqual((september.first, september.last), (datetime.date(2019, 8, 26), datetime.date(2019, 10, 6)))
+        # 日曜日からなら、2019年3月が6週になります
+        march = grid.get_month_grid(2019, 3, 6)
+        self.assertEqual(len(march.weeks), 6)
+        self.assertEqual((march.first, march.last), (datetime.date(2019, 2, 24), datetime.date(2019, 4, 6)))
+        self.assertEqual(len(grid.get_month_grid(2019, 3).weeks), 5)
+
+    def test_week_days(self):
+        self.assertEqual(
+            grid.get_week_days(datetime.date(2019, 3, 31)),
+            tuple(datetime.date(2019, 3, day) for day in range(25, 32)),
+        )
+        # 日曜日からなら、3月31日の週は4月にまたがります
+        self.assertEqual(
+            grid.get_week_days(datetime.date(2019, 3, 31), 6),
+            (datetime.date(2019, 3, 31),) + tuple(datetime.date(2019, 4, day) for day in range(1, 7)),
+        )
+        self.assertEqual(grid.get_week_days(datetime.date(2019, 3, 6), 2)[0], datetime.date(2019, 3, 6))
+
+    def test_grid_is_shared_and_read_only(self):
+        month_grid = grid.get_month_grid(2019, 3, 0)
+        self.assertIs(grid.get_month_grid(2019, 3, 0), month_grid)
+        self.assertIsNot(grid.get_month_grid(2019, 3, 6), month_grid)
+        self.assertEqual(grid.get_month_grid.cache_info().maxsize, grid.GRID_CACHE_SIZE)
+        self.assertIsInstance(month_grid.weeks, tuple)
+        self.assertEqual(month_grid.positions[datetime.date(2019, 3, 6)], (1, 2))
+        with self.assertRaises(TypeError):
+            month_grid.positions[datetime.date(2019, 3, 6)] = (0, 0)
+
+    def test_week_names_by_language_and_first_weekday(self):
+        """曜日の名前のキャッシュは、言語と最初の曜日の両方で分かれる"""
+        self.assertEqual(grid.get_week_names(grid.get_locale_week_names('ja'), 0)[:2], ('月', '火'))
+        self.assertEqual(grid.get_week_names(grid.get_locale_week_names('en'), 0)[:2], ('Mon', 'Tue'))
+        self.assertEqual(grid.get_week_names(grid.get_locale_week_names('en'), 6)[:2], ('Sun', 'Mon'))
+        self.assertEqual(grid.get_week_names(grid.get_locale_week_names('ja'), 6)[:2], ('日', '月'))
+
+    def test_month_calendar_view(self):
+        request = RequestFactory().get('/month/2019/3/')
+        request.user = AnonymousUser()
+        view = MonthCalendar()
+        view.setup(request, year=2019, month=3)
+        view.first_weekday = 6
+        with translation.override('en'):
+            calendar_context = view.get_month_calendar()
+        self.assertEqual(len(calendar_context['month_days']), 6)
+        self.assertEqual(calendar_context['month_days'][0][0], datetime.date(2019, 2, 24))
+        self.assertEqual(calendar_context['week_names'][0], 'Sun')
+
+
+class BucketingTests(TestCase):
+    """スケジュールの、それぞれの日への振り分け"""
+
+    def test_bucket_rows(self):
+        weeks = grid.get_month_grid(2019, 3, 6).weeks
+        rows = [
+            (datetime.date(2019, 2, 23), '範囲外'),
+            (datetime.date(2019, 2, 24), '最初の日'),
+            (datetime.date(2019, 3, 6), '1件目'),
+            (datetime.date(2019, 3, 6), '2件目'),
+            (datetime.date(2019, 4, 6), '最後の日'),
+            (datetime.date(2019, 4, 7), '範囲外'),
+        ]
+        week_day_schedules = grid.bucket_rows(weeks, rows, lambda row: row[0])
+        self.assertEqual(len(week_day_schedules), 6)
+        self.assertEqual([list(day_schedules) for day_schedules in week_day_schedules], [list(week) for week in weeks])
+        self.assertEqual(week_day_schedules[0][datetime.date(2019, 2, 24)], [rows[1]])
+        self.assertEqual(week_day_schedules[1][datetime.date(2019, 3, 6)], [rows[2], rows[3]])
+        self.assertEqual(week_day_schedules[5][datetime.date(2019, 4, 6)], [rows[4]])
+        self.assertEqual(sum(len(schedules) for week in week_day_schedules for schedules in week.values()), 4)
+        self.assertEqual(week_day_schedules[1][datetime.date(2019, 3, 7)].more, 0)
+
+    def test_bucket_multi_day_rows(self):
+        """複数日の行は、グリッドの中の重なる全ての日に入る"""
+        weeks = grid.get_month_grid(2019, 3).weeks
+        rows = [
+            (datetime.date(2019, 2, 20), datetime.date(2019, 2, 26), '前の月から'),
+            (datetime.date(2019, 3, 30), datetime.date(2019, 4, 2), '次の週へ'),
+        ]
+        week_day_schedules = grid.bucket_rows(weeks, rows, lambda row: row[0], lambda row: row[1])
+        days = [
+            day for week in week_day_schedules for day, schedules in week.items() if schedules
+        ]
+        self.assertEqual(days, [
+            datetime.date(2019, 2, 25), datetime.date(2019, 2, 26),
+            datetime.date(2019, 3, 30), datetime.date(2019, 3, 31),
+        ])
+        self.assertEqual(week_day_schedules[4][datetime.date(2019, 3, 31)], [rows[1]])
+
+    def test_six_week_month_in_one_query(self):
+        """6週の月でも、前後の月の日を含めて1回のクエリで取得し、振り分ける"""
+        for day in (datetime.date(2019, 8, 25), datetime.date(2019, 8, 26), datetime.date(2019, 9, 15),
+                    datetime.date(2019, 10, 6), datetime.date(2019, 10, 7)):
+            create_schedule(str(day), day, (9, 0), (10, 0))
+        create_schedule('月をまたぐ', datetime.date(2019, 9, 29), (9, 0), (10, 0), end_date=datetime.date(2019, 10, 2))
+        request = RequestFactory().get('/month_with_schedule/2019/9/')
+        request.user = AnonymousUser()
+        view = MonthWithScheduleCalendar()
+        view.setup(request, year=2019, month=9)
+        month_grid = grid.get_month_grid(2019, 9)
+        with CaptureQueriesContext(connection) as queries:
+            week_day_schedules = view.get_month_schedules(month_grid.first, month_grid.last, month_grid.weeks)
+        schedule_queries = [query for query in queries if 'FROM "app_schedule"' in query['sql']]
+        self.assertEqual(len(schedule_queries), 1)
+        self.assertEqual(len(week_day_schedules), 6)
+        summaries = {
+            day: [schedule.summary for schedule in schedules]
+            for week in week_day_schedules for day, schedules in week.items() if schedules
+        }
+        self.assertEqual(summaries, {
+            datetime.date(2019, 8, 26): ['2019-08-26'],
+            datetime.date(2019, 9, 15): ['2019-09-15'],
+            datetime.date(2019, 9, 29): ['月をまたぐ'],
+            datetime.date(2019, 9, 30): ['月をまたぐ'],
+            datetime.date(2019, 10, 1): ['月をまたぐ'],
+            datetime.date(2019, 10, 2): ['月をまたぐ'],
+            datetime.date(2019, 10, 6): ['2019-10-06'],
+        })
+
+    def test_first_weekday_in_view(self):
+        """最初の曜日を変えても、同じスケジュールが同じ日に入る"""
+        create_schedule('日曜日', datetime.date(2019, 3, 31), (9, 0), (10, 0))
+        create_schedule('土曜日', datetime.date(2019, 4, 6), (9, 0), (10, 0))
+        request = RequestFactory().get('/month_with_schedule/2019/3/')
+        request.user = AnonymousUser()
+        view = MonthWithScheduleCalendar()
+        view.setup(request, year=2019, month=3)
+        view.first_weekday = 6
+        calendar_context = view.get_month_calendar()
+        self.assertEqual(len(calendar_context['month_day_schedules']), 6)
+        sunday = get_day_schedules(calendar_context, 'month_day_schedules', datetime.date(2019, 3, 31))
+        saturday = get_day_schedules(calendar_context, 'month_day_schedules', datetime.date(2019, 4, 6))
+        self.assertEqual([schedule.summary for schedule in sunday], ['日曜日'])
+        self.assertEqual([schedule.summary for schedule in saturday], ['土曜日'])
+        self.assertIn(datetime.date(2019, 3, 31), calendar_context['month_day_schedules'][5])
+
+
+class GridCacheTests(TestCase):
+    """グリッドと曜日の名前のキャッシュ"""
+
+    def test_week_names_are_cached(self):
+        for function in (grid.get_locale_week_names, grid.get_week_names):
+            self.assertIsNotNone(function.cache_info().maxsize)
+            self.assertFalse(hasattr(function.__wrapped__, 'cache_info'))
+        week_names = grid.get_locale_week_names('ja')
+        self.assertEqual(week_names[0], '月')
+        self.assertIs(grid.get_week_names(week_names, 6), grid.get_week_names(week_names, 6))
+        self.assertEqual(grid.get_week_names(week_names, 6)[0], '日')
+
+
+class ScheduleCacheEvictionTests(TestCase):
+    """保存・削除時に、そのスケジュールの日を含むバケツのキャッシュだけを消す"""
+    months = [(2019, 2), (2019, 3), (2019, 4)]
+    weeks = [datetime.date(2019, 3, 4), datetime.date(2019, 3, 11), datetime.date(2019, 3, 25), datetime.date(2019, 4, 1)]
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.shared = Calendar.objects.filter(owner__isnull=True).order_by('pk').first()
+        self.other = Calendar.objects.create(name='別')
+        self.partitions = ['', cache.get_calendar_partition(self.shared.pk), cache.get_calendar_partition(self.other.pk)]
+
+    def get_versions(self):
+        """{(区画, 種類, バケツ): バージョン}を返す"""
+        versions = {}
+        for partition in self.partitions:
+            for kind, buckets in ((cache.MONTH, self.months), (cache.WEEK, self.weeks)):
+                for bucket, version in cache.get_versions(Schedule, kind, buckets, (partition,)).items():
+                    versions[partition, kind, bucket] = version
+        return versions
+
+    def get_evicted(self, operation):
+        """operationの後にバージョンが変わった、(区画, 種類, バケツ)の集合を返す"""
+        before = self.get_versions()
+        with self.captureOnCommitCallbacks(execute=True):
+            operation()
+        after = self.get_versions()
+        return {key for key in before if before[key] != after[key]}
+
+    def get_keys(self, calendar, months, weeks):
+        keys = set()
+        for partition in ('', cache.get_calendar_partition(calendar.pk)):
+            keys.update((partition, cache.MONTH, month) for month in months)
+            keys.update((partition, cache.WEEK, week) for week in weeks)
+        return keys
+
+    def create_schedule(self, *args, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return create_schedule(*args, **kwargs)
+
+    def test_save_evicts_only_its_buckets(self):
+        schedule = self.create_schedule('会議', datetime.date(2019, 3, 4), (10, 0), (11, 0))
+        schedule.summary = '打ち合わせ'
+        evicted = self.get_evicted(schedule.save)
+        self.assertEqual(evicted, self.get_keys(self.shared, [(2019, 3)], [datetime.date(2019, 3, 4)]))
+
+    def test_move_evicts_previous_and_new_buckets(self):
+        schedule = self.create_schedule('会議', datetime.date(2019, 3, 4), (10, 0), (11, 0))
+        schedule.date = schedule.end_date = datetime.date(2019, 4, 1)
+        schedule.calendar = self.other
+        evicted = self.get_evicted(schedule.save)
+        # 移動元と移動先のどちらのカレンダーでも、両方の日のバケツが消えます
+        months, weeks = [(2019, 3), (2019, 4)], [datetime.date(2019, 3, 4), datetime.date(2019, 4, 1)]
+        self.assertEqual(evicted, self.get_keys(self.shared, months, weeks) | self.get_keys(self.other, months, weeks))
+
+    def test_delete_evicts_only_its_buckets(self):
+        schedule = self.create_schedule('会議', datetime.date(2019, 3, 11), (10, 0), (11, 0), calendar=self.other)
+        evicted = self.get_evicted(schedule.delete)
+        self.assertEqual(evicted, self.get_keys(self.other, [(2019, 3)], [datetime.date(2019, 3, 11)]))
+
+    def test_evict_spans_covers_multi_day_schedules(self):
+        evicted = self.get_evicted(lambda: cache.evict_spans(
+            Schedule, [(datetime.date(2019, 3, 30), datetime.date(2019, 4, 2))], ('', self.partitions[1])
+        ))
+        self.assertEqual(
+            evicted,
+            self.get_keys(self.shared, [(2019, 3), (2019, 4)], [datetime.date(2019, 3, 25), datetime.date(2019, 4, 1)]),
+        )
+
+    def test_multi_day_schedule_save_evicts_all_its_buckets(self):
+        schedule = self.create_schedule(
+            '出張', datetime.date(2019, 2, 27), (10, 0), (11, 0), end_date=datetime.date(2019, 3, 5)
+        )
+        schedule.summary = '研修'
+        evicted = self.get_evicted(schedule.save)
+        self.assertEqual(evicted, self.get_keys(self.shared, [(2019, 2), (2019, 3)], [datetime.date(2019, 3, 4)]))
+
+
+class CalendarPreferenceMiddlewareTests(TestCase):
+    """ユーザー毎の言語・タイムゾーン・週の最初の曜日"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('user', password='password')
+        CalendarPreference.objects.create(user=self.user, language='en', time_zone='America/New_York', first_weekday=6)
+        self.other = User.objects.create_user('other', password='password')
+
+    def get_month(self, user):
+        """ユーザーで/api/month/を取得し、(JSON, リクエスト中の言語とタイムゾーン)を返す"""
+        active = []
+
+        def receiver(sender, **kwargs):
+            active.append((translation.get_language(), timezone.get_current_timezone_name()))
+
+        instrumentation.stage_timed.connect(receiver)
+        self.addCleanup(instrumentation.stage_timed.disconnect, receiver)
+        self.client.force_login(user)
+        data = json.loads(self.client.get('/api/month/2019/3/').content)
+        instrumentation.stage_timed.disconnect(receiver)
+        return data, active[0]
+
+    def test_preference_is_applied_for_one_request(self):
+        language, time_zone = translation.get_language(), timezone.get_current_timezone_name()
+
+        data, active = self.get_month(self.user)
+        self.assertEqual(active, ('en', 'America/New_York'))
+        self.assertEqual(data['week_names'][:2], ['Sun', 'Mon'])
+        self.assertEqual(data['month_days'][0][0], '2019-02-24')
+        self.assertEqual((translation.get_language(), timezone.get_current_timezone_name()), (language, time_zone))
+
+        # 次のリクエストの、設定の無いユーザーには残りません
+        data, active = self.get_month(self.other)
+        self.assertEqual(active, (language, time_zone))
+        self.assertEqual(data['week_names'][:2], ['月', '火'])
+        self.assertEqual(data['month_days'][0][0], '2019-02-25')
+        self.assertEqual((translation.get_language(), timezone.get_current_timezone_name()), (language, time_zone))
+
+
+class DefaultCalendarTests(TestCase):
+    """新しいスケジュールを入れるカレンダー"""
+
+    def setUp(self):
+        self.shared = Calendar.objects.filter(owner__isnull=True).order_by('pk').first()
+        self.user = User.objects.create_user('user', password='password')
+
+    def get_view(self, user):
+        request = RequestFactory().get('/mycalendar/')
+        request.user = user
+        view = MyCalendar()
+        view.setup(request)
+        return view
+
+    def test_prefers_own_calendar(self):
+        own = Calendar.objects.create(name='自分', owner=self.user)
+        self.assertEqual(self.get_view(self.user).get_default_calendar_id(), own.pk)
+
+    def test_falls_back_to_shared_calendar(self):
+        self.assertEqual(self.get_view(self.user).get_default_calendar_id(), self.shared.pk)
+        self.assertEqual(self.get_view(AnonymousUser()).get_default_calendar_id(), self.shared.pk)
+
+    def test_mycalendar_saves_to_own_calendar(self):
+        own = Calendar.objects.create(name='自分', owner=self.user)
+        self.client.force_login(self.user)
+        response = self.client.post('/mycalendar/2019/3/4/', {
+            'summary': '会議', 'description': '', 'start_time': '10:00', 'end_time': '11:00', 'end_date': '',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Schedule.objects.get(summary='会議').calendar, own)
+
+    def test_no_visible_calendar_is_form_error(self):
+        Calendar.objects.all().delete()
+        response = self.client.post('/mycalendar/2019/3/4/', {
+            'summary': '会議', 'description': '', 'start_time': '10:00', 'end_time': '11:00', 'end_date': '',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(MyCalendar.no_calendar_message, response.context['form'].non_field_errors())
+        self.assertFalse(Schedule.objects.exists())
+
+    def test_no_visible_calendar_is_formset_error(self):
+        Calendar.objects.all().delete()
+        data = {
+            'form-TOTAL_FORMS': '1',
+            'form-INITIAL_FORMS': '0',
+            'form-MIN_NUM_FORMS': '0',
+            'form-MAX_NUM_FORMS': '1000',
+            'form-0-summary': '会議',
+            'form-0-date': '2019-01-07',
+            'form-0-version': '1',
+        }
+        response = self.client.post('/month_with_forms/2019/1/', data)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, MyCalendar.no_calendar_message)
+        self.assertFalse(Schedule.objects.exists())
+
+
+@override_settings(ROOT_URLCONF='app.tests')
+class AsyncDefaultCalendarTests(TestCase):
+    """非同期版のビューで、新しいスケジュールを入れるカレンダー"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('user', password='password')
+        self.own = Calendar.objects.create(name='自分', owner=self.user)
+        self.async_client.force_login(self.user)
+
+    async def test_get(self):
+        response = await self.async_client.get('/mycalendar/2019/3/4/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['form'].calendar_id, self.own.pk)
+
+    async def test_post_saves_to_own_calendar(self):
+        response = await self.async_client.post('/mycalendar/2019/3/4/', {
+            'summary': '会議', 'description': '', 'start_time': '10:00', 'end_time': '11:00', 'end_date': '',
+        })
+        self.assertEqual(response.status_code, 302)
+        schedule = await Schedule.objects.aget(summary='会議')
+        self.assertEqual(schedule.calendar_id, self.own.pk)
+
+    async def test_no_visible_calendar_is_form_error(self):
+        await Calendar.objects.all().adelete()
+        response = await self.async_client.post('/mycalendar/2019/3/4/', {
+            'summary': '会議', 'description': '', 'start_time': '10:00', 'end_time': '11:00', 'end_date': '',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(MyCalendar.no_calendar_message, response.context['form'].non_field_errors())
+        self.assertFalse(await Schedule.objects.aexists())
+
+
+@override_settings(ROOT_URLCONF='app.tests')
+class AsyncViewTests(TestCase):
+    """非同期版のビュー(app.async_urls)"""
+    paths = (
+        '/month/2019/3/', '/week/2019/3/4/', '/week_with_schedule/2019/3/4/', '/month_with_schedule/2019/3/',
+        '/mycalendar/2019/3/4/',
+    )
+
+    def setUp(self):
+        shared = Calendar.objects.filter(owner__isnull=True).order_by('pk').first()
+        self.user = User.objects.create_user('user', password='password')
+        RecurringSchedule.objects.create(
+            calendar=shared, summary='定例', frequency=recurrence.WEEKLY, start_date=datetime.date(2019, 1, 7),
+            start_time=datetime.time(10, 0), end_time=datetime.time(11, 0),
+        )
+        create_schedule('朝会', datetime.date(2019, 3, 4), (9, 0), (9, 30))
+        create_schedule('自分の予定', datetime.date(2019, 3, 4), (13, 0), (14, 0), calendar=Calendar.objects.create(
+            name='自分', owner=self.user
+        ))
+
+    async def assert_views_render(self, summaries):
+        for path in self.paths:
+            with self.subTest(path=path):
+                response = await self.async_client.get(path)
+                self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get('/month_with_schedule/2019/3/')
+        day_schedules = get_day_schedules(response.context, 'month_day_schedules', datetime.date(2019, 3, 4))
+        self.assertEqual([schedule.summary for schedule in day_schedules], summaries)
+
+    async def test_anonymous(self):
+        await self.assert_views_render(['朝会', '定例'])
+
+    async def test_logged_in(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        await self.assert_views_render(['朝会', '定例', '自分の予定'])
+
+    async def test_htmx_save_and_invalid_form(self):
+        data = {'summary': '新規', 'description': '', 'start_time': '12:00', 'end_time': '13:00', 'end_date': ''}
+        response = await self.async_client.post('/mycalendar/2019/3/4/', data, headers={'HX-Request': 'true'})
+        self.assertEqual(response['HX-Retarget'], '#schedules-2019-03-04')
+        self.assertEqual(response['HX-Trigger'], 'schedule-saved')
+        self.assertContains(response, '新規')
+        data.update(summary='エラー', end_time='11:00')
+        response = await self.async_client.post('/mycalendar/2019/3/4/', data, headers={'HX-Request': 'true'})
+        self.assertEqual(response['HX-Retarget'], '#schedule-form')
+        self.assertContains(response, '<form id="schedule-form"')
+
+    def get_view(self):
+        request = RequestFactory().get('/month_with_schedule/2019/3/')
+        request.user = AnonymousUser()
+        view = AsyncMonthWithScheduleCalendar()
+        view.setup(request, year=2019, month=3)
+        return view
+
+    async def test_gather_schedules_and_recurrences(self):
+        """スケジュールと繰り返しのスケジュールを同時に取得し、同期版と同じ順に混ぜる"""
+        start, end = datetime.date(2019, 3, 1), datetime.date(2019, 3, 31)
+        with mock.patch('app.mixins.asyncio.gather', wraps=asyncio.gather) as gather:
+            schedules = await self.get_view().afetch_schedules(start, end)
+        gather.assert_called_once()
+        sync_view = self.get_view()
+        expected = await sync_to_async(lambda: list(sync_view.fetch_schedules(start, end)))()
+        self.assertEqual(
+            [(schedule.date, schedule.summary) for schedule in schedules],
+            [(schedule.date, schedule.summary) for schedule in expected],
+        )
+        self.assertEqual([schedule.summary for schedule in schedules[:2]], ['朝会', '定例'])
+        self.assertEqual(len(schedules), 5)
+
+
+class NeighbourWeeksTests(TestCase):
+    """前週と次週のスケジュールの先読み(prefetch_neighbour_weeks)"""
+
+    def get_week_calendar(self, year, month, day):
+        request = RequestFactory().get('/week_with_schedule/')
+        request.user = AnonymousUser()
+        view = WeekWithScheduleCalendar()
+        view.setup(request, year=year, month=month, day=day)
+        with CaptureQueriesContext(connection) as queries:
+            calendar_context = view.get_week_calendar()
+        schedule_queries = [query for query in queries if 'FROM "app_schedule"' in query['sql']]
+        self.assertEqual(len(schedule_queries), 1)
+        return calendar_context
+
+    def get_summaries(self, week_context):
+        return {
+            day: [schedule.summary for schedule in schedules]
+            for day, schedules in week_context['week_day_schedules'].items() if schedules
+        }
+
+    def test_year_boundary(self):
+        create_schedule('前週', datetime.date(2019, 12, 29), (9, 0), (10, 0))
+        create_schedule('大晦日', datetime.date(2019, 12, 31), (9, 0), (10, 0))
+        create_schedule('年越し', datetime.date(2020, 1, 5), (22, 0), (9, 0), end_date=datetime.date(2020, 1, 7))
+        create_schedule('次週', datetime.date(2020, 1, 12), (9, 0), (10, 0))
+        create_schedule('範囲外', datetime.date(2020, 1, 13), (9, 0), (10, 0))
+        calendar_context = self.get_week_calendar(2020, 1, 1)
+        previous, following = calendar_context['week_neighbours']
+
+        self.assertEqual(calendar_context['week_first'], datetime.date(2019, 12, 30))
+        self.assertEqual((previous['week_first'], previous['week_last']), (datetime.date(2019, 12, 23), datetime.date(2019, 12, 29)))
+        self.assertEqual((following['week_first'], following['week_last']), (datetime.date(2020, 1, 6), datetime.date(2020, 1, 12)))
+        self.assertEqual(self.get_summaries(previous), {datetime.date(2019, 12, 29): ['前週']})
+        self.assertEqual(self.get_summaries(calendar_context), {
+            datetime.date(2019, 12, 31): ['大晦日'], datetime.date(2020, 1, 5): ['年越し'],
+        })
+        # 週をまたぐスケジュールは、次週の日にも入ります
+        self.assertEqual(self.get_summaries(following), {
+            datetime.date(2020, 1, 6): ['年越し'], datetime.date(2020, 1, 7): ['年越し'], datetime.date(2020, 1, 12): ['次週'],
+        })
+
+    def test_month_boundary(self):
+        create_schedule('2月', datetime.date(2019, 2, 28), (9, 0), (10, 0))
+        create_schedule('3月', datetime.date(2019, 3, 1), (9, 0), (10, 0))
+        create_schedule('月曜', datetime.date(2019, 3, 4), (9, 0), (10, 0))
+        calendar_context = self.get_week_calendar(2019, 3, 6)
+        previous, following = calendar_context['week_neighbours']
+        self.assertEqual(self.get_summaries(previous), {
+            datetime.date(2019, 2, 28): ['2月'], datetime.date(2019, 3, 1): ['3月'],
+        })
+        self.assertEqual(self.get_summaries(calendar_context), {datetime.date(2019, 3, 4): ['月曜']})
+        self.assertEqual(self.get_summaries(following), {})
+
+
+class RecordingSink:
+    """テスト用の、受け取った計測結果を覚えておくシンク"""
+
+    def __init__(self, name=''):
+        self.name = name
+        self.timings = []
+
+    def __call__(self, timing):
+        self.timings.append(timing)
+
+
+class InstrumentationTests(TestCase):
+    """処理時間の計測と、Server-Timingヘッダ"""
+    path = '/month_with_schedule/2019/3/'
+
+    def setUp(self):
+        create_schedule('会議', datetime.date(2019, 3, 4), (10, 0), (11, 0))
+
+    def get_stages(self, header):
+        return [metric.split(';')[0] for metric in header.split(', ')]
+
+    def test_no_header_by_default(self):
+        # テストはDEBUG = Falseで動きます
+        self.assertNotIn('Server-Timing', self.client.get(self.path))
+
+    @override_settings(DEBUG=True)
+    def test_header_when_debug(self):
+        response = self.client.get(self.path)
+        self.assertIn('query', self.get_stages(response['Server-Timing']))
+        with self.settings(CALENDAR_SERVER_TIMING=False):
+            self.assertNotIn('Server-Timing', self.client.get(self.path))
+
+    @override_settings(CALENDAR_SERVER_TIMING=True)
+    def test_header_when_enabled(self):
+        header = self.client.get(self.path)['Server-Timing']
+        stages = self.get_stages(header)
+        for stage in ('validators', 'grid', 'query', 'bucket', 'render', 'view'):
+            self.assertIn(stage, stages)
+        self.assertRegex(header, r'query;dur=[\d.]+;desc="queries=\d+ rows=1"')
+
+    def test_stage_timed_signal(self):
+        received = []
+
+        def receiver(sender, timing, request, **kwargs):
+            received.append((sender, timing.stage, request.path))
+
+        instrumentation.stage_timed.connect(receiver)
+        self.addCleanup(instrumentation.stage_timed.disconnect, receiver)
+        self.client.get(self.path)
+        self.assertEqual({sender for sender, stage, path in received}, {MonthWithScheduleCalendar})
+        self.assertEqual({path for sender, stage, path in received}, {self.path})
+        stages = [stage for sender, stage, path in received]
+        self.assertEqual(stages[-1], 'view')
+        for stage in ('grid', 'query', 'bucket', 'render'):
+            self.assertIn(stage, stages)
+
+    @override_settings(CALENDAR_TIMING_SINKS=[{'BACKEND': 'app.tests.RecordingSink', 'OPTIONS': {'name': 'test'}}])
+    def test_sinks_are_loaded_from_settings(self):
+        sinks = instrumentation.get_sinks()
+        self.assertEqual(len(sinks), 1)
+        self.assertIsInstance(sinks[0], RecordingSink)
+        self.assertEqual(sinks[0].name, 'test')
+        self.client.get(self.path)
+        self.assertIn('query', [timing.stage for timing in sinks[0].timings])
+
+    def test_sinks_are_reset_on_setting_change(self):
+        self.assertEqual(instrumentation.get_sinks(), [])
+        with self.settings(CALENDAR_TIMING_SINKS=[{'BACKEND': 'app.instrumentation.LoggingSink'}]):
+            self.assertIsInstance(instrumentation.get_sinks()[0], instrumentation.LoggingSink)
+            with self.assertLogs('app.instrumentation', 'INFO') as logs:
+                self.client.get(self.path)
+            self.assertTrue(any('MonthWithScheduleCalendar.query' in line for line in logs.output))
+        self.assertEqual(instrumentation.get_sinks(), [])
+
+    def test_statsd_lines(self):
+        timing = instrumentation.StageTiming('MonthWithScheduleCalendar', 'query')
+        timing.duration, timing.queries, timing.rows = 0.0015, 1, 40
+        sink = instrumentation.StatsdSink(prefix='calendar')
+        self.addCleanup(sink.socket.close)
+        self.assertEqual(sink.get_lines(timing), [
+            'calendar.MonthWithScheduleCalendar.query:1.500|ms',
+            'calendar.MonthWithScheduleCalendar.query.queries:1|ms',
+            'calendar.MonthWithScheduleCalendar.query.rows:40|ms',
+        ])
+
+
+class ScheduleFragmentTests(TestCase):
+    """セルや行だけを返すビューと、htmxからの登録"""
+
+    def setUp(self):
+        create_schedule('会議', datetime.date(2019, 3, 4), (10, 0), (11, 0))
+        create_schedule('研修', datetime.date(2019, 3, 6), (13, 0), (14, 0))
+
+    def post_schedule(self, **data):
+        values = {'summary': '新規', 'description': '', 'start_time': '12:00', 'end_time': '13:00', 'end_date': ''}
+        values.update(data)
+        return self.client.post('/mycalendar/2019/3/4/', values, HTTP_HX_REQUEST='true')
+
+    def test_day_fragment(self):
+        response = self.client.get('/fragment/day/2019/3/4/')
+        self.assertEqual(response['HX-Retarget'], '#schedules-2019-03-04')
+        self.assertEqual(response['HX-Reswap'], 'outerHTML')
+        self.assertContains(response, '<td id="schedules-2019-03-04">')
+        self.assertContains(response, '会議')
+        self.assertNotContains(response, '研修')
+
+    def test_week_fragment(self):
+        response = self.client.get('/fragment/week/2019/3/6/')
+        self.assertEqual(response['HX-Retarget'], '#week-schedules-2019-03-04')
+        self.assertContains(response, '<tr id="week-schedules-2019-03-04">')
+        self.assertContains(response, '<td id="schedules-2019-03-10">')
+        self.assertContains(response, '会議')
+        self.assertContains(response, '研修')
+
+    def test_htmx_save_returns_day_cell(self):
+        response = self.post_schedule()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['HX-Trigger'], 'schedule-saved')
+        self.assertEqual(response['HX-Retarget'], '#schedules-2019-03-04')
+        self.assertContains(response, '会議')
+        self.assertContains(response, '新規')
+        self.assertTrue(Schedule.objects.filter(summary='新規').exists())
+
+    def test_htmx_save_multi_day_returns_week_row(self):
+        response = self.post_schedule(end_date='2019-03-05')
+        self.assertEqual(response['HX-Retarget'], '#week-schedules-2019-03-04')
+        self.assertContains(response, '<tr id="week-schedules-2019-03-04">')
+
+    def test_htmx_invalid_form_returns_form(self):
+        response = self.post_schedule(start_time='12:00', end_time='11:00')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['HX-Retarget'], '#schedule-form')
+        self.assertNotIn('HX-Trigger', response)
+        self.assertContains(response, '<form id="schedule-form"')
+        self.assertContains(response, '終了時間は、開始時間よりも後にしてください')
+        self.assertNotContains(response, '<html')
+        self.assertFalse(Schedule.objects.filter(summary='新規').exists())
+
+    def test_without_htmx_redirects(self):
+        response = self.client.post('/mycalendar/2019/3/4/', {
+            'summary': '新規', 'description': '', 'start_time': '12:00', 'end_time': '13:00', 'end_date': '',
+        })
+        self.assertRedirects(response, '/mycalendar/2019/3/4/', fetch_redirect_response=False)
+
+    def test_htmx_script_is_pinned(self):
+        response = self.client.get('/mycalendar/2019/3/4/')
+        self.assertRegex(
+            response.content.decode(), r'<script src="https://unpkg\.com/htmx\.org@[\d.]+/dist/htmx\.min\.js"\s+'
+            r'integrity="sha384-[A-Za-z0-9+/=]+"\s+crossorigin="anonymous">'
+        )
+
+
+class ScheduleConflictTests(TestCase):
+    """同時編集の検出(Schedule.versionと、フォームセットの保存)"""
+
+    def setUp(self):
+        self.schedules = [
+            create_schedule('予定{}'.format(day), datetime.date(2019, 1, day), (9, 0), (10, 0)) for day in range(1, 6)
+        ]
+
+    def test_save_stale_instance_raises_conflict(self):
+        first = Schedule.objects.get(pk=self.schedules[0].pk)
+        second = Schedule.objects.get(pk=self.schedules[0].pk)
+        first.summary = '先'
+        first.save()
+        self.assertEqual(first.version, 2)
+
+        second.summary = '後'
+        with self.assertRaises(ScheduleConflict) as cm:
+            second.save()
+        self.assertEqual(cm.exception.instances, [second])
+        self.assertEqual(second.version, 1)
+        schedule = Schedule.objects.get(pk=first.pk)
+        self.assertEqual((schedule.summary, schedule.version), ('先', 2))
+
+    def get_formset(self):
+        return self.client.get('/month_with_forms/2019/1/').context['month_formset']
+
+    def make_post_data(self, formset, edits, new_summary=None):
+        """読み込んだフォームセットの値に、{pk: 概要}の変更を加えたPOSTデータを作る"""
+        forms = formset.initial_forms
+        data = {
+            'form-TOTAL_FORMS': str(len(forms) + (1 if new_summary else 0)),
+            'form-INITIAL_FORMS': str(len(forms)),
+            'form-MIN_NUM_FORMS': '0',
+            'form-MAX_NUM_FORMS': '1000',
+        }
+        for i, form in enumerate(forms):
+            instance = form.instance
+            data['form-{}-id'.format(i)] = str(instance.pk)
+            data['form-{}-summary'.format(i)] = edits.get(instance.pk, instance.summary)
+            data['form-{}-date'.format(i)] = instance.date.isoformat()
+            data['form-{}-version'.format(i)] = str(instance.version)
+        if new_summary:
+            data['form-{}-summary'.format(len(forms))] = new_summary
+            data['form-{}-date'.format(len(forms))] = '2019-01-20'
+            data['form-{}-version'.format(len(forms))] = '1'
+        return data
+
+    def assert_stale_post_saves_nothing(self, path):
+        first, second, third = (schedule.pk for schedule in self.schedules[1:4])
+        stale_formset = self.get_formset()
+        response = self.client.post(path, self.make_post_data(self.get_formset(), {first: '先', second: '先'}))
+        self.assertEqual(response.status_code, 302)
+
+        # 古いフォームセットで、他の人が変更した2件と、変更されていない1件を変更し、新しいスケジュールも作る
+        before = list(Schedule.objects.order_by('pk').values_list('summary', 'version'))
+        response = self.client.post(
+            path, self.make_post_data(stale_formset, {first: '後', second: '後', third: '後'}, new_summary='新規')
+        )
+        self.assertEqual(response.status_code, 200)
+        conflicts = [
+            form.instance.pk for form in response.context['month_formset'].initial_forms if form.non_field_errors()
+        ]
+        self.assertEqual(sorted(conflicts), [first, second])
+        self.assertEqual(list(Schedule.objects.order_by('pk').values_list('summary', 'version')), before)
+        self.assertFalse(Schedule.objects.filter(summary='新規').exists())
+
+    def test_bulk_save_stale_post_saves_nothing(self):
+        self.assert_stale_post_saves_nothing('/month_with_forms/2019/1/')
+
+    def test_save_stale_post_saves_nothing(self):
+        with mock.patch.object(MonthWithFormsCalendar, 'formset_bulk_save', False):
+            self.assert_stale_post_saves_nothing('/month_with_forms/2019/1/')
+
+    def test_unchanged_stale_form_does_not_conflict(self):
+        """他で変更されていても、このフォームで変更していなければ衝突にしない"""
+        stale_formset = self.get_formset()
+        Schedule.objects.filter(pk=self.schedules[0].pk).update(version=F('version') + 1)
+        response = self.client.post(
+            '/month_with_forms/2019/1/', self.make_post_data(stale_formset, {self.schedules[1].pk: '変更'})
+        )
+        self.assertEqual(response.status_code, 302)
+        schedule = Schedule.objects.get(pk=self.schedules[1].pk)
+        self.assertEqual((schedule.summary, schedule.version), ('変更', 2))
+
+
+class ConditionalScheduleTests(TestCase):
+    """スケジュールが変わっていなければ304を返す、ETagとLast-Modified"""
+
+    def setUp(self):
+        self.schedule = create_schedule('会議', datetime.date(2019, 3, 4), (10, 0), (11, 0))
+
+    def get_etag(self, path, **extra):
+        response = self.client.get(path, **extra)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_not_modified(self):
+        etag = self.get_etag('/month_with_schedule/2019/3/')
+        response = self.client.get('/month_with_schedule/2019/3/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_save_changes_etag(self):
+        etag = self.get_etag('/month_with_schedule/2019/3/')
+        self.schedule.summary = '打ち合わせ'
+        self.schedule.save()
+        response = self.client.get('/month_with_schedule/2019/3/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_calendar_scope_changes_etag(self):
+        user = User.objects.create_user('user', password='password')
+        own = Calendar.objects.create(name='自分', owner=user)
+        self.client.force_login(user)
+        etag = self.get_etag('/month_with_schedule/2019/3/')
+        self.assertNotEqual(self.get_etag('/month_with_schedule/2019/3/', data={'calendar': own.pk}), etag)
+        self.assertEqual(self.get_etag('/month_with_schedule/2019/3/'), etag)
+
+    def test_format_changes_etag(self):
+        path = '/api/month_with_schedule/2019/3/'
+        etag = self.get_etag(path)
+        ndjson_etag = self.get_etag(path, data={'format': 'ndjson'})
+        self.assertNotEqual(ndjson_etag, etag)
+        response = self.client.get(path, {'format': 'ndjson'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(
+            self.get_etag('/api/week_with_schedule/2019/3/4/', data={'neighbours': '1'}),
+            self.get_etag('/api/week_with_schedule/2019/3/4/'),
+        )
+
+
+class FormInputParser(html.parser.HTMLParser):
+    """HTMLの、フォームの<input>の{name: value}を集める"""
+
+    def __init__(self):
+        super().__init__()
+        self.values = {}
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'input' and attrs.get('name', '').startswith('form-'):
+            self.values[attrs['name']] = attrs.get('value') or ''
+
+
+class LazyFormsTests(TestCase):
+    """新規作成用のフォームを使い回す、LazyExtraModelFormSetとLazyDayForm"""
+
+    def setUp(self):
+        self.schedule = create_schedule('会議', datetime.date(2019, 1, 7), (10, 0), (11, 0))
+
+    def get_form_html(self, lazy_forms):
+        with mock.patch.object(MonthWithFormsCalendar, 'lazy_forms', lazy_forms):
+            context = self.client.get('/month_with_forms/2019/1/').context
+        return [
+            str(form.as_p()) for week_day_forms in context['month_day_forms']
+            for forms in week_day_forms.values() for form in forms
+        ]
+
+    def test_same_html_as_eager_formset(self):
+        lazy = self.get_form_html(True)
+        self.assertEqual(lazy, self.get_form_html(False))
+        # 2018/12/31〜2019/2/3の35日分の新規作成用と、1件の更新用です
+        self.assertEqual(len(lazy), 36)
+        self.assertIn('name="form-1-date" value="2018-12-31"', lazy[0])
+        self.assertIn('name="form-35-date" value="2019-02-03"', lazy[-1])
+
+    def test_post_lazy_forms(self):
+        response = self.client.get('/month_with_forms/2019/1/')
+        parser = FormInputParser()
+        parser.feed(response.content.decode())
+        data = parser.values
+        self.assertEqual(data['form-TOTAL_FORMS'], '36')
+        new_index = next(
+            name.split('-')[1] for name, value in data.items() if name.endswith('-date') and value == '2019-01-09'
+        )
+        data['form-{}-summary'.format(new_index)] = '新規'
+        response = self.client.post('/month_with_forms/2019/1/', data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Schedule.objects.get(summary='新規').date, datetime.date(2019, 1, 9))
+        self.assertEqual(Schedule.objects.count(), 2)
+        self.assertEqual(Schedule.objects.get(pk=self.schedule.pk).version, 1)
+
+
+class JSONCalendarTests(TestCase):
+    """JSONとNDJSONのAPI"""
+
+    def setUp(self):
+        shared = Calendar.objects.filter(owner__isnull=True).order_by('pk').first()
+        RecurringSchedule.objects.create(
+            calendar=shared, summary='定例', frequency=recurrence.WEEKLY, start_date=datetime.date(2019, 3, 5),
+            start_time=datetime.time(10, 0), end_time=datetime.time(11, 0),
+        )
+        self.schedule = create_schedule('会議', datetime.date(2019, 3, 4), (10, 0), (11, 0))
+        create_schedule('前週', datetime.date(2019, 2, 27), (9, 0), (10, 0))
+
+    def get_json(self, path, data=None):
+        response = self.client.get(path, data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return json.loads(response.content)
+
+    def get_ndjson(self, path, data=None):
+        response = self.client.get(path, data)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_month_calendar(self):
+        data = self.get_json('/api/month/2019/3/')
+        self.assertEqual(data['month_days'][0], [
+            '2019-02-25', '2019-02-26', '2019-02-27', '2019-02-28', '2019-03-01', '2019-03-02', '2019-03-03',
+        ])
+        self.assertEqual(data['month_current'], '2019-03-01')
+        self.assertEqual(data['week_names'][0], '月')
+
+    def test_week_with_schedule(self):
+        data = self.get_json('/api/week_with_schedule/2019/3/4/')
+        self.assertEqual(data['week_days'][0], '2019-03-04')
+        schedule = data['week_day_schedules']['2019-03-04'][0]
+        self.assertEqual(
+            (schedule['id'], schedule['summary'], schedule['start_time'], schedule['date']),
+            (self.schedule.pk, '会議', '10:00:00', '2019-03-04'),
+        )
+        occurrence = data['week_day_schedules']['2019-03-05'][0]
+        self.assertEqual((occurrence['summary'], occurrence['date']), ('定例', '2019-03-05'))
+        self.assertIn('recurrence_id', occurrence)
+        self.assertNotIn('week_neighbours', data)
+
+    def test_week_neighbours(self):
+        data = self.get_json('/api/week_with_schedule/2019/3/4/', {'neighbours': '1'})
+        previous, following = data['week_neighbours']
+        self.assertEqual(previous['week_first'], '2019-02-25')
+        self.assertEqual(
+            [schedule['summary'] for schedule in previous['week_day_schedules']['2019-02-27']], ['前週']
+        )
+        self.assertEqual(following['week_first'], '2019-03-11')
+        self.assertEqual(
+            [schedule['summary'] for schedule in following['week_day_schedules']['2019-03-12']], ['定例']
+        )
+
+    def test_month_with_schedule(self):
+        data = self.get_json('/api/month_with_schedule/2019/3/')
+        day_schedules = data['month_day_schedules'][1]['2019-03-04']
+        self.assertEqual([schedule['summary'] for schedule in day_schedules], ['会議'])
+
+    def test_ndjson(self):
+        rows = self.get_ndjson('/api/month_with_schedule/2019/3/', {'format': 'ndjson'})
+        self.assertEqual(
+            [(row['date'], row['summary']) for row in rows],
+            [('2019-02-27', '前週'), ('2019-03-04', '会議')]
+            + [('2019-03-{:02d}'.format(day), '定例') for day in (5, 12, 19, 26)],
+        )
+        rows = self.get_ndjson('/api/week_with_schedule/2019/3/4/', {'format': 'ndjson'})
+        self.assertEqual([row['summary'] for row in rows], ['会議', '定例'])
+
+    def test_schedule_export(self):
+        rows = self.get_ndjson('/api/schedules/', {'start': '2019-03-01', 'end': '2019-03-31'})
+        self.assertEqual([row['summary'] for row in rows], ['会議'])
+        self.assertEqual(self.client.get('/api/schedules/', {'start': 'x'}).status_code, 400)
+
+
+class DailyScheduleStatsTests(TestCase):
+    """日毎の件数(DailyScheduleStats)の増減と、作り直し"""
+
+    def setUp(self):
+        self.shared = Calendar.objects.filter(owner__isnull=True).order_by('pk').first()
+        self.other = Calendar.objects.create(name='別')
+
+    def get_counts(self):
+        """{(カレンダーのid, 日付): 件数}を返す。0件の日は含みません"""
+        return {
+            (calendar_id, date): count for calendar_id, date, count
+            in DailyScheduleStats.objects.filter(count__gt=0).values_list('calendar_id', 'date', 'count')
+        }
+
+    def test_save_move_and_delete(self):
+        first = create_schedule('会議', datetime.date(2019, 3, 4), (10, 0), (11, 0))
+        create_schedule('朝会', datetime.date(2019, 3, 4), (9, 0), (9, 30))
+        create_schedule('出張', datetime.date(2019, 3, 5), (9, 0), (18, 0), end_date=datetime.date(2019, 3, 6))
+        shared = self.shared.pk
+        self.assertEqual(self.get_counts(), {
+            (shared, datetime.date(2019, 3, 4)): 2,
+            (shared, datetime.date(2019, 3, 5)): 1,
+            (shared, datetime.date(2019, 3, 6)): 1,
+        })
+
+        first.date = first.end_date = datetime.date(2019, 3, 6)
+        first.calendar = self.other
+        first.save()
+        self.assertEqual(self.get_counts(), {
+            (shared, datetime.date(2019, 3, 4)): 1,
+            (shared, datetime.date(2019, 3, 5)): 1,
+            (shared, datetime.date(2019, 3, 6)): 1,
+            (self.other.pk, datetime.date(2019, 3, 6)): 1,
+        })
+
+        first.summary = '打ち合わせ'
+        first.save(update_fields=['summary'])
+        first.delete()
+        self.assertEqual(self.get_counts(), {
+            (shared, datetime.date(2019, 3, 4)): 1,
+            (shared, datetime.date(2019, 3, 5)): 1,
+            (shared, datetime.date(2019, 3, 6)): 1,
+        })
+
+    def test_bulk_saved(self):
+        updated = create_schedule('会議', datetime.date(2019, 3, 4), (10, 0), (11, 0))
+        created = [
+            Schedule(calendar=self.other, summary='新規', date=datetime.date(2019, 3, 7), end_date=datetime.date(2019, 3, 8),
+                     start_time=datetime.time(10, 0), end_time=datetime.time(11, 0)),
+        ]
+        Schedule.objects.bulk_create(created)
+        previous = MonthWithFormsCalendar().get_previous_instances([updated])
+        updated.date = updated.end_date = datetime.date(2019, 3, 5)
+        Schedule.objects.bulk_update([updated], ['date', 'end_date'])
+        bulk_saved.send(sender=Schedule, created=created, updated=[updated], previous=previous)
+        self.assertEqual(self.get_counts(), {
+            (self.shared.pk, datetime.date(2019, 3, 5)): 1,
+            (self.other.pk, datetime.date(2019, 3, 7)): 1,
+            (self.other.pk, datetime.date(2019, 3, 8)): 1,
+        })
+
+    def test_rebuild_reproduces_counts(self):
+        create_schedule('会議', datetime.date(2019, 3, 4), (10, 0), (11, 0))
+        create_schedule('朝会', datetime.date(2019, 3, 4), (9, 0), (9, 30), calendar=self.other)
+        create_schedule('出張', datetime.date(2019, 3, 3), (9, 0), (18, 0), end_date=datetime.date(2019, 3, 6))
+        Schedule.objects.filter(summary='朝会').update(date=datetime.date(2019, 3, 10), end_date=datetime.date(2019, 3, 10))
+        counts = self.get_counts()
+        self.assertEqual(counts[self.other.pk, datetime.date(2019, 3, 4)], 1)  # update()では増減しません
+
+        call_command('rebuildschedulestats', stdout=io.StringIO())
+        expected = dict(counts)
+        del expected[self.other.pk, datetime.date(2019, 3, 4)]
+        expected[self.other.pk, datetime.date(2019, 3, 10)] = 1
+        self.assertEqual(self.get_counts(), expected)
+        self.assertEqual(expected[self.shared.pk, datetime.date(2019, 3, 4)], 2)
+
+        context = self.client.get('/heatmap/2019/').context
+        self.assertEqual(context['heatmap_total'], 6)
+        self.assertEqual(context['heatmap_max'], 2)
+
+
+class RecurrenceTests(TestCase):
+    """繰り返しのスケジュールの展開"""
+
+    def create_recurring_schedule(self, **kwargs):
+        values = {
+            'calendar': Calendar.objects.filter(owner__isnull=True).order_by('pk').first(),
+            'summary': '定例', 'start_time': datetime.time(10, 0), 'end_time': datetime.time(11, 0),
+        }
+        values.update(kwargs)
+        return RecurringSchedule.objects.create(**values)
+
+    def test_weekly_dates_in_range(self):
+        """何年前に始まった繰り返しでも、期間の中の回だけを返す"""
+        recurring_schedule = self.create_recurring_schedule(
+            frequency=recurrence.WEEKLY, interval=2, weekdays='0,2', start_date=datetime.date(2010, 1, 4)
+        )
+        dates = list(recurrence.iter_occurrence_dates(
+            recurring_schedule, datetime.date(2019, 3, 1), datetime.date(2019, 3, 31)
+        ))
+        self.assertEqual(dates, [
+            datetime.date(2019, 3, 4), datetime.date(2019, 3, 6),
+            datetime.date(2019, 3, 18), datetime.date(2019, 3, 20),
+        ])
+
+    def test_monthly_skips_missing_days(self):
+        dates = recurrence.iter_rule_dates(recurrence.MONTHLY, datetime.date(2019, 1, 31))
+        self.assertEqual([next(dates) for _ in range(3)], [
+            datetime.date(2019, 1, 31), datetime.date(2019, 3, 31), datetime.date(2019, 5, 31),
+        ])
+
+    def test_last_date(self):
+        recurring_schedule = self.create_recurring_schedule(
+            frequency=recurrence.DAILY, interval=3, start_date=datetime.date(2019, 3, 1), count=4
+        )
+        self.assertEqual(recurring_schedule.end_date, datetime.date(2019, 3, 10))
+        recurring_schedule.until = datetime.date(2019, 3, 5)
+        recurring_schedule.save()
+        self.assertEqual(recurring_schedule.end_date, datetime.date(2019, 3, 5))
+
+    def test_occurrences_are_merged_into_calendar(self):
+        recurring_schedule = self.create_recurring_schedule(
+            frequency=recurrence.WEEKLY, start_date=datetime.date(2019, 1, 7)
+        )
+        RecurrenceException.objects.create(recurring_schedule=recurring_schedule, date=datetime.date(2019, 3, 11))
+        create_schedule('朝会', datetime.date(2019, 3, 4), (9, 0), (9, 30))
+        create_schedule('昼', datetime.date(2019, 3, 4), (12, 0), (13, 0))
+        context = self.client.get('/month_with_schedule/2019/3/').context
+
+        day_schedules = get_day_schedules(context, 'month_day_schedules', datetime.date(2019, 3, 4))
+        self.assertEqual([schedule.summary for schedule in day_schedules], ['朝会', '定例', '昼'])
+        self.assertEqual(get_day_schedules(context, 'month_day_schedules', datetime.date(2019, 3, 11)), [])
+        self.assertEqual(
+            [schedule.summary for schedule in get_day_schedules(context, 'month_day_schedules', datetime.date(2019, 3, 18))],
+            ['定例'],
+        )
+
+
+class LoadSchedulesTests(TestCase):
+    """loadschedulesコマンドでの、作成と読み込み"""
+
+    def setUp(self):
+        self.calendar = Calendar.objects.create(name='読み込み先')
+
+    def load(self, *args, **options):
+        stdout = io.StringIO()
+        call_command('loadschedules', *args, calendar=self.calendar.pk, stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def write_file(self, suffix, content):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, encoding='utf-8', delete=False) as file:
+            file.write(content)
+        self.addCleanup(os.remove, file.name)
+        return file.name
+
+    def get_spans(self):
+        return [
+            (end_date - date).days
+            for date, end_date in Schedule.objects.filter(calendar=self.calendar).values_list('date', 'end_date')
+        ]
+
+    def test_generate(self):
+        output = self.load(generate=200, days=30, multi_day_ratio=0.5, max_span_days=3, batch_size=64)
+        self.assertIn('200件のスケジュールを作成しました', output)
+        self.assertEqual(set(self.get_spans()), {0, 1, 2})
+        total_days = sum(span + 1 for span in self.get_spans())
+        self.assertEqual(
+            sum(DailyScheduleStats.objects.filter(calendar=self.calendar).values_list('count', flat=True)), total_days
+        )
+
+    def test_generate_single_day_spans(self):
+        """--max-span-days 1なら、複数日のスケジュールは作らない"""
+        self.load(generate=100, multi_day_ratio=1.0, max_span_days=1)
+        self.assertEqual(set(self.get_spans()), {0})
+
+    def test_csv(self):
+        path = self.write_file('.csv', (
+            'summary,description,date,end_date,start_time,end_time\n'
+            '会議,資料を準備,2019-03-04,,10:00,11:00\n'
+            '出張,,2019-03-05,2019-03-07,09:00,18:00\n'
+            ',概要が無い,2019-03-06,,10:00,11:00\n'
+            '長期,,2019-03-01,2019-12-31,09:00,18:00\n'
+        ))
+        output = self.load(path, batch_size=1)
+        self.assertIn('2件のスケジュールを作成しました(読み飛ばし: 2件)', output)
+        schedules = Schedule.objects.filter(calendar=self.calendar).order_by('date')
+        self.assertEqual(
+            [(schedule.summary, schedule.date, schedule.end_date, schedule.start_time) for schedule in schedules], [
+                ('会議', datetime.date(2019, 3, 4), datetime.date(2019, 3, 4), datetime.time(10, 0)),
+                ('出張', datetime.date(2019, 3, 5), datetime.date(2019, 3, 7), datetime.time(9, 0)),
+            ]
+        )
+        self.assertEqual(schedules[0].description, '資料を準備')
+
+    def test_ndjson_from_export(self):
+        """/api/schedules/で書き出したNDJSONを、そのまま読み込める"""
+        create_schedule('会議', datetime.date(2019, 3, 4), (10, 0), (11, 0))
+        create_schedule('出張', datetime.date(2019, 3, 5), (9, 0), (18, 0), end_date=datetime.date(2019, 3, 6))
+        response = self.client.get('/api/schedules/', {'start': '2019-03-01', 'end': '2019-03-31'})
+        path = self.write_file('.txt', b''.join(response.streaming_content).decode() + '{"summary": "壊れた行"\n')
+        output = self.load(path, format='ndjson')
+        self.assertIn('2件のスケジュールを作成しました(読み飛ばし: 1件)', output)
+        self.assertEqual(
+            list(Schedule.objects.filter(calendar=self.calendar).order_by('date').values_list('summary', 'end_date')),
+            [('会議', datetime.date(2019, 3, 4)), ('出張', datetime.date(2019, 3, 6))],
+        )
+
+    def test_invalid_options(self):
+        with self.assertRaisesMessage(CommandError, '--max-span-days'):
+            self.load(generate=1, max_span_days=0)
+        with self.assertRaisesMessage(CommandError, '--format'):
+            self.load(self.write_file('.txt', ''))
+
+
+class ICalendarTests(TestCase):
+    """.icsの書き出しと、importicsでの読み込み"""
+
+    def setUp(self):
+        self.shared = Calendar.objects.filter(owner__isnull=True).order_by('pk').first()
+        self.other = Calendar.objects.create(name='読み込み先')
+
+    def import_ics(self, content, calendar):
+        with tempfile.NamedTemporaryFile('w', suffix='.ics', encoding='utf-8', delete=False) as file:
+            file.write(content)
+        self.addCleanup(os.remove, file.name)
+        stdout = io.StringIO()
+        call_command('importics', file.name, calendar=calendar.pk, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_round_trip(self):
+        Schedule.objects.create(
+            calendar=self.shared, summary='出張, 大阪', description='新幹線で移動\n宿泊あり', date=datetime.date(2019, 3, 4),
+            end_date=datetime.date(2019, 3, 6), start_time=datetime.time(9, 0), end_time=datetime.time(18, 0),
+        )
+        recurring_schedule = RecurringSchedule.objects.create(
+            calendar=self.shared, summary='定例', start_date=datetime.date(2019, 3, 4), frequency=recurrence.WEEKLY,
+            weekdays='0,2', count=10, start_time=datetime.time(10, 0), end_time=datetime.time(11, 0),
+        )
+        RecurrenceException.objects.create(recurring_schedule=recurring_schedule, date=datetime.date(2019, 3, 6))
+        response = self.client.get('/schedules.ics?start=2019-03-01&end=2019-03-31')
+        content = b''.join(response.streaming_content).decode()
+
+        self.import_ics(content, self.other)
+        schedule = Schedule.objects.get(calendar=self.other)
+        self.assertEqual(
+            (schedule.summary, schedule.description, schedule.date, schedule.end_date, schedule.start_time, schedule.end_time),
+            ('出張, 大阪', '新幹線で移動\n宿泊あり', datetime.date(2019, 3, 4), datetime.date(2019, 3, 6),
+             datetime.time(9, 0), datetime.time(18, 0)),
+        )
+        imported = RecurringSchedule.objects.get(calendar=self.other)
+        self.assertEqual(
+            (imported.frequency, imported.get_weekdays(), imported.count, imported.end_date),
+            (recurrence.WEEKLY, [0, 2], 10, recurring_schedule.end_date),
+        )
+        self.assertEqual(list(imported.exceptions.values_list('date', flat=True)), [datetime.date(2019, 3, 6)])
+
+        # 同じファイルをもう一度読み込んでも、増えない
+        output = self.import_ics(content, self.other)
+        self.assertIn('読み込み済み: 2件', output)
+        self.assertEqual(Schedule.objects.filter(calendar=self.other).count(), 1)
+        self.assertEqual(RecurringSchedule.objects.filter(calendar=self.other).count(), 1)
+
+    def test_huge_count(self):
+        """COUNTが大きくても、回を数えずに最後の日を計算する"""
+        self.import_ics('\r\n'.join([
+            'BEGIN:VCALENDAR', 'BEGIN:VEVENT', 'UID:huge@example.com',
+            'DTSTART:20190304T100000', 'DTEND:20190304T110000', 'RRULE:FREQ=DAILY;COUNT=999999999999',
+            'SUMMARY:毎日', 'END:VEVENT',
+            'BEGIN:VEVENT', 'UID:large@example.com',
+            'DTSTART:20190304T100000', 'DTEND:20190304T110000', 'RRULE:FREQ=MONTHLY;COUNT=200000',
+            'SUMMARY:毎月', 'END:VEVENT', 'END:VCALENDAR', '',
+        ]), self.other)
+        self.assertIsNone(RecurringSchedule.objects.get(uid='huge@example.com').end_date)
+        self.assertIsNone(RecurringSchedule.objects.get(uid='large@example.com').end_date)
+
+
+class ScheduleOverlapTests(TestCase):
+    """BS4ScheduleFormの、時間の重なる(ダブルブッキングの)チェック"""
+
+    def setUp(self):
+        self.calendar = Calendar.objects.filter(owner__isnull=True).order_by('pk').first()
+        create_schedule('会議', datetime.date(2019, 3, 4), (10, 0), (11, 0))
+        create_schedule('出張', datetime.date(2019, 3, 5), (13, 0), (9, 0), end_date=datetime.date(2019, 3, 7))
+
+    def get_form(self, date, start_time, end_time, end_date=''):
+        return BS4ScheduleForm(
+            {'summary': '新規', 'description': '', 'start_time': start_time, 'end_time': end_time, 'end_date': end_date},
+            date=date, calendar_id=self.calendar.pk,
+        )
+
+    def test_overlap(self):
+        form = self.get_form(datetime.date(2019, 3, 4), '10:30', '12:00')
+        self.assertFalse(form.is_valid())
+        self.assertIn('「会議」', form.non_field_errors()[0])
+
+    def test_adjacent_is_not_overlap(self):
+        self.assertTrue(self.get_form(datetime.date(2019, 3, 4), '11:00', '12:00').is_valid())
+        self.assertTrue(self.get_form(datetime.date(2019, 3, 4), '9:00', '10:00').is_valid())
+
+    def test_overlap_with_multi_day_schedule(self):
+        self.assertFalse(self.get_form(datetime.date(2019, 3, 6), '12:00', '13:00').is_valid())
+        self.assertFalse(self.get_form(datetime.date(2019, 3, 7), '8:00', '10:00').is_valid())
+        self.assertTrue(self.get_form(datetime.date(2019, 3, 7), '9:00', '10:00').is_valid())
+        self.assertFalse(self.get_form(datetime.date(2019, 3, 3), '12:00', '14:00', end_date='2019-03-05').is_valid())
+        self.assertTrue(self.get_form(datetime.date(2019, 3, 4), '12:00', '13:00', end_date='2019-03-05').is_valid())
+
+    def test_other_calendar_is_not_overlap(self):
+        form = self.get_form(datetime.date(2019, 3, 4), '10:30', '12:00')
+        form.calendar_id = Calendar.objects.create(name='別').pk
+        self.assertTrue(form.is_valid())
+
+
+class ScheduleSearchTests(TestCase):
+    """全文検索の、外部コンテンツの仮想テーブル"""
+
+    def setUp(self):
+        if not search.is_available(Schedule):
+            self.skipTest('FTS5(trigram)の無いSQLiteです')
+        self.schedule = create_schedule('定例会議', datetime.date(2019, 1, 7), (10, 0), (11, 0))
+
+    def search(self, text):
+        return list(search.filter_queryset(Schedule.objects.all(), text, search.SCHEDULE_FIELDS))
+
+    def assert_index_is_consistent(self):
+        """索引とapp_scheduleの中身が食い違っていれば、integrity-checkがエラーになります"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO app_schedule_search(app_schedule_search, rank) VALUES ('integrity-check', 1)"
+            )
+
+    def test_table_has_external_content(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'app_schedule_search'")
+            self.assertIn('content="app_schedule"', cursor.fetchone()[0])
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'app_schedule_search_content'")
+            self.assertIsNone(cursor.fetchone())
+        self.assertEqual(self.search('定例会'), [self.schedule])
+
+    def test_save_replaces_old_text(self):
+        self.schedule.summary = '打ち合わせ'
+        self.schedule.save()
+        self.assertEqual(self.search('定例会'), [])
+        self.assertEqual(self.search('打ち合'), [self.schedule])
+        self.assert_index_is_consistent()
+
+    def test_bulk_update_replaces_old_text(self):
+        previous = MonthWithFormsCalendar().get_previous_instances([self.schedule])
+        self.schedule.summary = '打ち合わせ'
+        Schedule.objects.bulk_update([self.schedule], ['summary'])
+        bulk_saved.send(sender=Schedule, created=[], updated=[self.schedule], previous=previous)
+        self.assertEqual(self.search('定例会'), [])
+        self.assertEqual(self.search('打ち合'), [self.schedule])
+        self.assert_index_is_consistent()
+
+    def test_delete_removes_from_index(self):
+        self.schedule.delete()
+        self.assertEqual(self.search('定例会'), [])
+        self.assert_index_is_consistent()
+
+    def test_rebuild(self):
+        Schedule.objects.update(summary='打ち合わせ')
+        call_command('rebuildschedulesearch', stdout=io.StringIO())
+        self.assertEqual(self.search('打ち合'), [self.schedule])
+        self.assert_index_is_consistent()
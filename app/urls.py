@@ -22,6 +22,11 @@ urlpatterns = [
         'month_with_schedule/<int:year>/<int:month>/',
         views.MonthWithScheduleCalendar.as_view(), name='month_with_schedule'
     ),
+    path('year/', views.RangeCalendar.as_view(), name='year'),
+    path('year/<int:year>/', views.RangeCalendar.as_view(), name='year'),
+    path('range/', views.RangeCalendar.as_view(), name='range'),
+    path('heatmap/', views.YearHeatmapCalendar.as_view(), name='heatmap'),
+    path('heatmap/<int:year>/', views.YearHeatmapCalendar.as_view(), name='heatmap'),
     path('mycalendar/', views.MyCalendar.as_view(), name='mycalendar'),
     path(
         'mycalendar/<int:year>/<int:month>/<int:day>/', views.MyCalendar.as_view(), name='mycalendar'
@@ -34,4 +39,36 @@ urlpatterns = [
         'month_with_forms/<int:year>/<int:month>/',
         views.MonthWithFormsCalendar.as_view(), name='month_with_forms'
     ),
+    path(
+        'fragment/day/<int:year>/<int:month>/<int:day>/',
+        views.DayScheduleFragment.as_view(), name='day_fragment'
+    ),
+    path(
+        'fragment/week/<int:year>/<int:month>/<int:day>/',
+        views.WeekScheduleFragment.as_view(), name='week_fragment'
+    ),
+    path('api/month/', views.MonthCalendarAPI.as_view(), name='api_month'),
+    path('api/month/<int:year>/<int:month>/', views.MonthCalendarAPI.as_view(), name='api_month'),
+    path('api/week/', views.WeekCalendarAPI.as_view(), name='api_week'),
+    path('api/week/<int:year>/<int:month>/<int:day>/', views.WeekCalendarAPI.as_view(), name='api_week'),
+    path(
+        'api/week_with_schedule/',
+        views.WeekWithScheduleAPI.as_view(), name='api_week_with_schedule'
+    ),
+    path(
+        'api/week_with_schedule/<int:year>/<int:month>/<int:day>/',
+        views.WeekWithScheduleAPI.as_view(), name='api_week_with_schedule'
+    ),
+    path(
+        'api/month_with_schedule/',
+        views.MonthWithScheduleAPI.as_view(), name='api_month_with_schedule'
+    ),
+    path(
+        'api/month_with_schedule/<int:year>/<int:month>/',
+        views.MonthWithScheduleAPI.as_view(), name='api_month_with_schedule'
+    ),
+    path('api/schedules/', views.ScheduleExportAPI.as_view(), name='api_schedules'),
+    path('schedules.ics', views.ICalendarExport.as_view(), name='ics'),
+    path('search/', views.ScheduleSearch.as_view(), name='search'),
+    path('api/search/', views.ScheduleSearchAPI.as_view(), name='api_search'),
 ]
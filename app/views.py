@@ -1,8 +1,10 @@
-import datetime
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseBadRequest
 from django.shortcuts import redirect, render
+from django.utils.dateparse import parse_date
 from django.views import generic
 from .forms import BS4ScheduleForm, SimpleScheduleForm
-from .models import Schedule
+from .models import DailyScheduleStats, RecurringSchedule, Schedule, ScheduleConflict
 from . import mixins
 
 
@@ -28,11 +30,18 @@ class WeekCalendar(mixins.WeekCalendarMixin, generic.TemplateView):
         return context
 
 
-class WeekWithScheduleCalendar(mixins.WeekWithScheduleMixin, generic.TemplateView):
+class WeekWithScheduleCalendar(
+        mixins.ServerTimingMixin, mixins.ConditionalScheduleMixin, mixins.WeekWithScheduleMixin, generic.TemplateView):
     """スケジュール付きの週間カレンダーを表示するビュー"""
     template_name = 'app/week_with_schedule.html'
     model = Schedule
     date_field = 'date'
+    end_date_field = 'end_date'
+    calendar_field = 'calendar'
+    recurrence_model = RecurringSchedule
+    schedule_fields = ('summary', 'description', 'start_time', 'end_time')
+    updated_field = 'updated_at'
+    prefetch_neighbour_weeks = True
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -41,11 +50,18 @@ class WeekWithScheduleCalendar(mixins.WeekWithScheduleMixin, generic.TemplateVie
         return context
 
 
-class MonthWithScheduleCalendar(mixins.MonthWithScheduleMixin, generic.TemplateView):
+class MonthWithScheduleCalendar(
+        mixins.ServerTimingMixin, mixins.ConditionalScheduleMixin, mixins.MonthWithScheduleMixin, generic.TemplateView):
     """スケジュール付きの月間カレンダーを表示するビュー"""
     template_name = 'app/month_with_schedule.html'
     model = Schedule
     date_field = 'date'
+    end_date_field = 'end_date'
+    calendar_field = 'calendar'
+    recurrence_model = RecurringSchedule
+    updated_field = 'updated_at'
+    max_schedules_per_day = 3
+    schedule_fields = ('summary',)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -54,41 +70,97 @@ class MonthWithScheduleCalendar(mixins.MonthWithScheduleMixin, generic.TemplateV
         return context
 
 
-class MyCalendar(mixins.MonthCalendarMixin, mixins.WeekWithScheduleMixin, generic.CreateView):
-    """月間カレンダー、週間カレンダー、スケジュール登録画面のある欲張りビュー"""
+class RangeCalendar(mixins.ServerTimingMixin, mixins.RangeCalendarMixin, generic.TemplateView):
+    """1年間や四半期など、期間を指定したスケジュール付きカレンダーを表示するビュー"""
+    template_name = 'app/range.html'
+    model = Schedule
+    date_field = 'date'
+    end_date_field = 'end_date'
+    calendar_field = 'calendar'
+    recurrence_model = RecurringSchedule
+    max_schedules_per_day = 2
+    schedule_fields = ('summary',)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        calendar_context = self.get_range_calendar()
+        context.update(calendar_context)
+        return context
+
+
+class YearHeatmapCalendar(mixins.ServerTimingMixin, mixins.YearHeatmapMixin, generic.TemplateView):
+    """1年間の、日毎のスケジュールの件数をヒートマップで表示するビュー"""
+    template_name = 'app/year_heatmap.html'
+    model = DailyScheduleStats
+    calendar_field = 'calendar'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        calendar_context = self.get_year_heatmap()
+        context.update(calendar_context)
+        return context
+
+
+class MyCalendar(
+        mixins.ServerTimingMixin, mixins.ScheduleFragmentMixin, mixins.MonthWeekWithScheduleMixin, generic.CreateView):
+    """月間カレンダー、週間カレンダー、スケジュール登録画面のある欲張りビュー
+
+    htmxから登録した場合は、ページに移動せず、登録したスケジュールの日のセルだけを返します。
+
+    """
     template_name = 'app/mycalendar.html'
     model = Schedule
     date_field = 'date'
+    end_date_field = 'end_date'
+    calendar_field = 'calendar'
+    recurrence_model = RecurringSchedule
+    schedule_fields = ('summary', 'description', 'start_time', 'end_time')
     form_class = BS4ScheduleForm
+    form_template_name = 'app/includes/schedule_form.html'
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        # 同じカレンダーの、同じ時間帯のスケジュールとの重なりを調べるため
+        kwargs['date'] = self.get_current_day()
+        kwargs['calendar_id'] = self.get_default_calendar_id()
+        return kwargs
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        week_calendar_context = self.get_week_calendar()
-        month_calendar_context = self.get_month_calendar()
-        context.update(week_calendar_context)
-        context.update(month_calendar_context)
+        calendar_context = self.get_month_week_calendar()
+        context.update(calendar_context)
         return context
 
     def form_valid(self, form):
-        month = self.kwargs.get('month')
-        year = self.kwargs.get('year')
-        day = self.kwargs.get('day')
-        if month and year and day:
-            date = datetime.date(year=int(year), month=int(month), day=int(day))
-        else:
-            date = datetime.date.today()
+        if not self.validate_default_calendar([form]):
+            return self.form_invalid(form)
+        date = self.get_current_day()
         schedule = form.save(commit=False)
         schedule.date = date
+        schedule.calendar_id = self.get_default_calendar_id()
         schedule.save()
+        if self.is_fragment_request():
+            return self.render_saved_fragment(schedule)
         return redirect('app:mycalendar', year=date.year, month=date.month, day=date.day)
 
+    def form_invalid(self, form):
+        if self.is_fragment_request():
+            # 月間・週間カレンダーは変わらないので、フォームだけを返します
+            return self.render_form_fragment(self.form_template_name, {'form': form})
+        return super().form_invalid(form)
+
 
-class MonthWithFormsCalendar(mixins.MonthWithFormsMixin, generic.View):
+class MonthWithFormsCalendar(mixins.ServerTimingMixin, mixins.MonthWithFormsMixin, generic.View):
     """フォーム付きの月間カレンダーを表示するビュー"""
     template_name = 'app/month_with_forms.html'
     model = Schedule
     date_field = 'date'
+    end_date_field = 'end_date'
+    calendar_field = 'calendar'
     form_class = SimpleScheduleForm
+    formset_bulk_save = True
+    lazy_forms = True
+    version_field = 'version'
 
     def get(self, request, **kwargs):
         context = self.get_month_calendar()
@@ -97,8 +169,263 @@ class MonthWithFormsCalendar(mixins.MonthWithFormsMixin, generic.View):
     def post(self, request, **kwargs):
         context = self.get_month_calendar()
         formset = context['month_formset']
-        if formset.is_valid():
-            formset.save()
-            return redirect('app:month_with_forms')
+        new_forms = [form for form in formset.extra_forms if form.has_changed()]
+        if formset.is_valid() and (not new_forms or self.validate_default_calendar(new_forms)):
+            try:
+                self.save_month_formset(formset)
+            except ScheduleConflict as e:
+                # 他の人の変更は上書きせず、変更されていたスケジュールのフォームにエラーを表示します
+                self.add_conflict_errors(formset, e.instances)
+            else:
+                return redirect('app:month_with_forms')
 
         return render(request, self.template_name, context)
+
+
+class DayScheduleFragment(mixins.ServerTimingMixin, mixins.ScheduleFragmentMixin, generic.View):
+    """1日のスケジュールのセル(<td>)だけを返すビュー"""
+    model = Schedule
+    date_field = 'date'
+    end_date_field = 'end_date'
+    calendar_field = 'calendar'
+    recurrence_model = RecurringSchedule
+    schedule_fields = ('summary', 'description', 'start_time', 'end_time')
+
+    def get(self, request, **kwargs):
+        return self.render_days_fragment([self.get_current_day()])
+
+
+class WeekScheduleFragment(DayScheduleFragment):
+    """1週間のスケジュールの行(<tr>)だけを返すビュー"""
+
+    def get(self, request, **kwargs):
+        return self.render_days_fragment(self.get_week_days())
+
+
+class MonthCalendarAPI(mixins.JSONCalendarMixin, mixins.MonthCalendarMixin, generic.View):
+    """月間カレンダーをJSONで返すビュー"""
+
+    def get(self, request, **kwargs):
+        return self.render_to_json_response(self.get_month_calendar())
+
+
+class WeekCalendarAPI(mixins.JSONCalendarMixin, mixins.WeekCalendarMixin, generic.View):
+    """週間カレンダーをJSONで返すビュー"""
+
+    def get(self, request, **kwargs):
+        return self.render_to_json_response(self.get_week_calendar())
+
+
+class WeekWithScheduleAPI(
+        mixins.ConditionalScheduleMixin, mixins.JSONCalendarMixin, mixins.WeekWithScheduleMixin, generic.View):
+    """スケジュール付きの週間カレンダーをJSONで返すビュー
+
+    ?format=ndjsonなら、その週のスケジュールだけを返します。
+    ?neighbours=1なら、前週と次週のスケジュールもweek_neighboursに入れて返します。
+
+    """
+    model = Schedule
+    date_field = 'date'
+    end_date_field = 'end_date'
+    calendar_field = 'calendar'
+    recurrence_model = RecurringSchedule
+    updated_field = 'updated_at'
+    representation_params = ('format', 'neighbours')
+
+    def use_neighbour_prefetch(self):
+        return super().use_neighbour_prefetch() or self.request.GET.get('neighbours') == '1'
+
+    def get(self, request, **kwargs):
+        if request.GET.get('format') == 'ndjson':
+            days = self.get_week_days()
+            return self.render_to_ndjson_response(days[0], days[-1])
+        return self.render_to_json_response(self.get_week_calendar())
+
+
+class MonthWithScheduleAPI(
+        mixins.ConditionalScheduleMixin, mixins.JSONCalendarMixin, mixins.MonthWithScheduleMixin, generic.View):
+    """スケジュール付きの月間カレンダーをJSONで返すビュー。?format=ndjsonなら、その月のスケジュールだけを返します"""
+    model = Schedule
+    date_field = 'date'
+    end_date_field = 'end_date'
+    calendar_field = 'calendar'
+    recurrence_model = RecurringSchedule
+    updated_field = 'updated_at'
+
+    def get(self, request, **kwargs):
+        if request.GET.get('format') == 'ndjson':
+            days = self.get_month_days(self.get_current_month())
+            return self.render_to_ndjson_response(days[0][0], days[-1][-1])
+        return self.render_to_json_response(self.get_month_calendar())
+
+
+class ScheduleExportAPI(mixins.JSONCalendarMixin, mixins.BaseScheduleMixin, generic.View):
+    """?start=2019-01-01&end=2019-12-31 の期間のスケジュールを、NDJSONで返すビュー"""
+    model = Schedule
+    date_field = 'date'
+    calendar_field = 'calendar'
+
+    def get(self, request, **kwargs):
+        start, end = get_date_range(request)
+        if start is None:
+            return HttpResponseBadRequest('start、endには、YYYY-MM-DD形式の日付を指定してください')
+        return self.render_to_ndjson_response(start, end)
+
+
+class ICalendarExport(mixins.ICalendarMixin, mixins.BaseScheduleMixin, generic.View):
+    """?start=2019-01-01&end=2019-12-31 の期間と重なるスケジュールを、iCalendar(.ics)で返すビュー"""
+    model = Schedule
+    date_field = 'date'
+    end_date_field = 'end_date'
+    calendar_field = 'calendar'
+    recurrence_model = RecurringSchedule
+
+    def get(self, request, **kwargs):
+        start, end = get_date_range(request)
+        if start is None:
+            return HttpResponseBadRequest('start、endには、YYYY-MM-DD形式の日付を指定してください')
+        return self.render_to_ics_response(start, end)
+
+
+class ScheduleSearch(mixins.ServerTimingMixin, mixins.ScheduleSearchMixin, generic.TemplateView):
+    """スケジュールを検索するビュー"""
+    template_name = 'app/search.html'
+    model = Schedule
+    calendar_field = 'calendar'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(self.get_search_results())
+        if context['search_next']:
+            query = self.request.GET.copy()
+            query[self.search_cursor_param] = context['search_next']
+            context['search_next_query'] = query.urlencode()
+        return context
+
+
+class ScheduleSearchAPI(mixins.JSONCalendarMixin, mixins.ScheduleSearchMixin, generic.View):
+    """スケジュールの検索結果を、JSONで返すビュー。nextを?after=に付けると、次のページです"""
+    model = Schedule
+    calendar_field = 'calendar'
+    json_fields = ('id', 'summary', 'description', 'date', 'end_date', 'start_time', 'end_time')
+
+    def get_search_queryset(self, *args, **kwargs):
+        return super().get_search_queryset(*args, **kwargs).values(*self.json_fields)
+
+    def get(self, request, **kwargs):
+        results = self.get_search_results()
+        return self.render_to_json_response({'schedules': results['search_schedules'], 'next': results['search_next']})
+
+
+def get_date_range(request):
+    """?start=2019-01-01&end=2019-12-31 の(最初の日, 最後の日)を返す。正しくなければ(None, None)"""
+    try:
+        start = parse_date(request.GET.get('start', ''))
+        end = parse_date(request.GET.get('end', ''))
+    except ValueError:
+        start = end = None
+    if start is None or end is None or start > end:
+        return None, None
+    return start, end
+
+
+class AsyncMonthCalendar(mixins.MonthCalendarMixin, generic.View):
+    """月間カレンダーを表示するビューの非同期版"""
+    template_name = 'app/month.html'
+
+    async def get(self, request, **kwargs):
+        return render(request, self.template_name, self.get_month_calendar())
+
+
+class AsyncWeekCalendar(mixins.WeekCalendarMixin, generic.View):
+    """週間カレンダーを表示するビューの非同期版"""
+    template_name = 'app/week.html'
+
+    async def get(self, request, **kwargs):
+        return render(request, self.template_name, self.get_week_calendar())
+
+
+class AsyncWeekWithScheduleCalendar(
+        mixins.ServerTimingMixin, mixins.AsyncConditionalScheduleMixin, mixins.AsyncWeekWithScheduleMixin, generic.View):
+    """スケジュール付きの週間カレンダーを表示するビューの非同期版"""
+    template_name = 'app/week_with_schedule.html'
+    model = Schedule
+    date_field = 'date'
+    end_date_field = 'end_date'
+    calendar_field = 'calendar'
+    recurrence_model = RecurringSchedule
+    schedule_fields = ('summary', 'description', 'start_time', 'end_time')
+    updated_field = 'updated_at'
+    prefetch_neighbour_weeks = True
+
+    async def get(self, request, **kwargs):
+        return render(request, self.template_name, await self.aget_week_calendar())
+
+
+class AsyncMonthWithScheduleCalendar(
+        mixins.ServerTimingMixin, mixins.AsyncConditionalScheduleMixin, mixins.AsyncMonthWithScheduleMixin, generic.View):
+    """スケジュール付きの月間カレンダーを表示するビューの非同期版"""
+    template_name = 'app/month_with_schedule.html'
+    model = Schedule
+    date_field = 'date'
+    end_date_field = 'end_date'
+    calendar_field = 'calendar'
+    recurrence_model = RecurringSchedule
+    updated_field = 'updated_at'
+    max_schedules_per_day = 3
+    schedule_fields = ('summary',)
+
+    async def get(self, request, **kwargs):
+        return render(request, self.template_name, await self.aget_month_calendar())
+
+
+class AsyncMyCalendar(
+        mixins.ServerTimingMixin, mixins.AsyncScheduleFragmentMixin, mixins.AsyncMonthWeekWithScheduleMixin,
+        generic.edit.FormMixin, generic.View):
+    """月間カレンダー、週間カレンダー、スケジュール登録画面のある欲張りビューの非同期版"""
+    template_name = 'app/mycalendar.html'
+    model = Schedule
+    date_field = 'date'
+    end_date_field = 'end_date'
+    calendar_field = 'calendar'
+    recurrence_model = RecurringSchedule
+    schedule_fields = ('summary', 'description', 'start_time', 'end_time')
+    form_class = BS4ScheduleForm
+    form_template_name = 'app/includes/schedule_form.html'
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        # 同じカレンダーの、同じ時間帯のスケジュールとの重なりを調べるため
+        kwargs['date'] = self.get_current_day()
+        kwargs['calendar_id'] = self.get_default_calendar_id()
+        return kwargs
+
+    async def get(self, request, **kwargs):
+        await self.aprepare_schedules()
+        # get_form_kwargsでは、データベースを使わずにカレンダーのidを渡せるよう、先に読み込んでおきます
+        await self.aget_default_calendar_id()
+        return await self.render_calendar(self.get_form())
+
+    async def post(self, request, **kwargs):
+        await self.aprepare_schedules()
+        await self.aget_default_calendar_id()
+        form = self.get_form()
+        # 重なるスケジュールをデータベースで調べるので、フォームの検証はスレッドで行います
+        if not await sync_to_async(form.is_valid)() or not self.validate_default_calendar([form]):
+            if self.is_fragment_request():
+                return self.render_form_fragment(self.form_template_name, {'form': form})
+            return await self.render_calendar(form)
+
+        date = self.get_current_day()
+        schedule = form.save(commit=False)
+        schedule.date = date
+        schedule.calendar_id = self.get_default_calendar_id()
+        await schedule.asave()
+        if self.is_fragment_request():
+            return await self.arender_saved_fragment(schedule)
+        return redirect('app:mycalendar', year=date.year, month=date.month, day=date.day)
+
+    async def render_calendar(self, form):
+        context = self.get_context_data(form=form)
+        context.update(await self.aget_month_week_calendar())
+        return render(self.request, self.template_name, context)